@@ -2,16 +2,35 @@
 Flask backend API for pixelation tool.
 """
 
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Response, g, request, jsonify, send_file, send_from_directory
 from flask_cors import CORS
+from werkzeug.exceptions import NotFound
 from werkzeug.utils import secure_filename
+import multiprocessing
 import os
+import time
+import uuid
 from PIL import Image
 import io
 
-from pixelation import pixelate_image
+from pixelation import PIXELATION_METHODS, clamp_grid, pixelate_image, pixelate_file_tiled, upscale_grid
 from background_removal import remove_background
-from utils import validate_image, save_uploaded_file, cleanup_file, get_image_dimensions
+from utils import (
+    MAX_FILE_SIZE, get_image_dimensions, stream_zip
+)
+from encoding import save_image
+from palette import format_colors
+from cache import RAW_FOLDER, ResultCache, DecodedImageCache, PyramidCache, IntegralImageStore
+from storage import UploadStore
+from jobs import JobManager, QueueFull, BatchTooLarge
+from janitor import Janitor
+from metrics import histograms, timed, start_request_timing, finish_request_timing
+from processing import (
+    MAX_OUTPUT_SCALE, parse_output_scale, parse_proxy_size, grid_info, build_operations, chain_size,
+    derives_palette, derive_palette, with_palette, process_upload, should_tile, needs_decoded_image,
+    uses_integral, apply_operations_integral, preview_operations, preview_level, render_preview,
+    draft_threshold, PREVIEW_MAX_SIZE, RAW_DECODED_UPLOADS
+)
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for React frontend
@@ -27,13 +46,181 @@ os.makedirs(PROCESSED_FOLDER, exist_ok=True)
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['PROCESSED_FOLDER'] = PROCESSED_FOLDER
-app.config['MAX_CONTENT_LENGTH'] = 10 * 1024 * 1024  # 10MB max file size
+app.config['MAX_CONTENT_LENGTH'] = MAX_FILE_SIZE
+
+# Uploads stored once per distinct content and shared by reference count
+upload_store = UploadStore(UPLOAD_FOLDER, derived_folders=[RAW_FOLDER, IntegralImageStore.FOLDER])
+
+# Processed results keyed by (upload content, operation chain, parameters)
+result_cache = ResultCache(
+    PROCESSED_FOLDER,
+    max_entries=int(os.environ.get('PXL8_RESULT_CACHE_ENTRIES', 512)),
+    max_bytes=int(os.environ.get('PXL8_RESULT_CACHE_MB', 512)) * 1024 * 1024
+)
+
+# Process pool for batch and async jobs (one worker per CPU unless configured);
+# submissions beyond PXL8_JOB_QUEUE_DEPTH pending images get a 429. A job's
+# results stay pinned in the result cache until it is downloaded or dropped
+job_manager = JobManager(
+    max_workers=int(os.environ.get('PXL8_BATCH_WORKERS', 0)) or None,
+    max_queue=int(os.environ.get('PXL8_JOB_QUEUE_DEPTH', 256)) or None,
+    on_drop=lambda job: result_cache.unpin(job.id)
+)
+
+# Longest a job poll may block waiting for completion (?wait=seconds)
+MAX_JOB_WAIT = 30.0
+
+# Seconds clients are asked to back off when the job queue is full
+QUEUE_FULL_RETRY_AFTER = 5
+
+# Decoded uploads shared by every processing route (memory-mapped from raw
+# files shared with other processes when PXL8_RAW_DECODED=1)
+decoded_cache = DecodedImageCache(
+    max_bytes=int(os.environ.get('PXL8_DECODED_CACHE_MB', 256)) * 1024 * 1024,
+    raw=RAW_DECODED_UPLOADS
+)
+
+# Reduced copies of decoded uploads that previews start from
+pyramid_cache = PyramidCache(
+    decoded_cache,
+    max_bytes=int(os.environ.get('PXL8_PYRAMID_CACHE_MB', 128)) * 1024 * 1024
+)
+
+# Summed-area tables saved beside uploads (PXL8_INTEGRAL_IMAGES=1), so
+# 'average' re-pixelation at any grid size skips decoding and reads only
+# the grid's block corners; they take 8 bytes per pixel and channel on disk
+INTEGRAL_IMAGES = os.environ.get('PXL8_INTEGRAL_IMAGES', '0') == '1'
+integral_store = IntegralImageStore(decoded_cache)
+
+# Largest preview_size a client may ask /api/preview for
+MAX_PREVIEW_SIZE = 2048
+
+# Seconds browsers may reuse a stored image before revalidating it (0 to
+# always revalidate); stored names are content-addressed, so a name never
+# changes content, and revalidation gets a 304 while the ETag matches
+IMAGE_MAX_AGE = int(os.environ.get('PXL8_IMAGE_MAX_AGE', 3600))
+
+# Content types of stored images, by extension
+IMAGE_MIMETYPES = {'png': 'image/png', 'jpg': 'image/jpeg', 'jpeg': 'image/jpeg', 'webp': 'image/webp'}
+
+# Add a Server-Timing header with per-stage durations to every response
+SERVER_TIMING = os.environ.get('PXL8_SERVER_TIMING', '0') == '1'
+
+# Retention: uploads and processed results unused for this long are deleted,
+# and uploads are trimmed least recently used first past their quota (0 disables each)
+UPLOAD_TTL = float(os.environ.get('PXL8_UPLOAD_TTL_HOURS', 24)) * 3600 or None
+UPLOAD_QUOTA = int(os.environ.get('PXL8_UPLOAD_QUOTA_MB', 2048)) * 1024 * 1024 or None
+PROCESSED_TTL = float(os.environ.get('PXL8_PROCESSED_TTL_HOURS', 24)) * 3600 or None
+
+
+def _expire_uploads():
+    for filename in upload_store.expire(UPLOAD_TTL, UPLOAD_QUOTA):
+        _forget_upload(filename)
+
+
+def _forget_upload(filename):
+    """Drop everything derived from an upload once its file is deleted."""
+    filepath = upload_store.path(filename)
+    decoded_cache.invalidate(filepath)
+    pyramid_cache.invalidate(filepath)
+    integral_store.invalidate(filepath)
+    result_cache.forget_source(filepath)
+
+
+def _expire_results():
+    if PROCESSED_TTL:
+        result_cache.expire(PROCESSED_TTL)
+
+
+# Background cleanup every PXL8_JANITOR_INTERVAL seconds (0 disables)
+janitor = Janitor(float(os.environ.get('PXL8_JANITOR_INTERVAL', 300)), [_expire_uploads, _expire_results])
+# Spawned pool workers re-import this module; only the server process cleans up
+if janitor.interval > 0 and multiprocessing.parent_process() is None:
+    janitor.start()
+
+
+@app.before_request
+def _start_timing():
+    if SERVER_TIMING:
+        g.request_start = time.perf_counter()
+        start_request_timing()
+
+
+@app.after_request
+def _add_server_timing(response):
+    if SERVER_TIMING and 'request_start' in g:
+        header = finish_request_timing(time.perf_counter() - g.request_start)
+        if header:
+            response.headers['Server-Timing'] = header
+    return response
+
+
+def _send_stored(folder, filename, **kwargs):
+    """
+    Send a stored image with ETag, Range and conditional-GET support.
+    The path is resolved safely inside folder; a missing file is a 404.
+    """
+    extension = filename.rsplit('.', 1)[-1].lower()
+    try:
+        return send_from_directory(
+            os.path.abspath(folder), filename, max_age=IMAGE_MAX_AGE,
+            mimetype=IMAGE_MIMETYPES.get(extension), **kwargs
+        )
+    except NotFound:
+        return jsonify({'error': 'File not found'}), 404
+
+
+def _send_upscaled(filepath, scale, **kwargs):
+    """
+    Upscale a stored grid by an integer multiplier at send time.
+    The ETag combines the stored file's version and the scale, so a
+    revalidation that still matches gets a 304 without upscaling.
+    """
+    try:
+        stat = os.stat(filepath)
+    except FileNotFoundError:
+        return jsonify({'error': 'File not found'}), 404
+    etag = f'{stat.st_mtime_ns:x}-{stat.st_size:x}-x{scale}'
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+    
+    with Image.open(filepath) as image:
+        image_format = image.format
+        width, height = image.size
+        if width * height * scale * scale > Image.MAX_IMAGE_PIXELS:
+            return jsonify({'error': 'Requested scale is too large'}), 400
+        image = upscale_grid(image, (width * scale, height * scale))
+        buffer = io.BytesIO()
+        save_image(image, buffer, image_format)
+    buffer.seek(0)
+    return send_file(
+        buffer, mimetype=Image.MIME.get(image_format, 'application/octet-stream'),
+        etag=etag, max_age=IMAGE_MAX_AGE, **kwargs
+    )
 
 
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """Health check endpoint."""
-    return jsonify({'status': 'ok', 'message': 'Pixelation API is running'})
+    return jsonify({
+        'status': 'ok',
+        'message': 'Pixelation API is running',
+        'result_cache': result_cache.stats(),
+        'decoded_cache': decoded_cache.stats(),
+        'pyramid_cache': pyramid_cache.stats(),
+        'integral_images': integral_store.stats(),
+        'jobs': job_manager.stats(),
+        'uploads': upload_store.stats(),
+        'janitor_runs': janitor.runs
+    })
+
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    """Per-stage latency histograms in Prometheus text format."""
+    return Response(histograms.render(), mimetype='text/plain; version=0.0.4')
 
 
 @app.route('/api/upload', methods=['POST'])
@@ -47,27 +234,58 @@ def upload_image():
     if file.filename == '':
         return jsonify({'error': 'No file selected'}), 400
     
-    # Validate file
-    is_valid, error_msg = validate_image(file)
-    if not is_valid:
-        return jsonify({'error': error_msg}), 400
-    
     try:
-        # Save uploaded file
-        filename = save_uploaded_file(file, UPLOAD_FOLDER)
-        filepath = os.path.join(UPLOAD_FOLDER, filename)
-        
-        # Get image dimensions
-        width, height = get_image_dimensions(filepath)
-        
-        return jsonify({
-            'filename': filename,
-            'width': width,
-            'height': height,
-            'message': 'File uploaded successfully'
-        })
+        # Store, hash and validate the upload in one pass over its bytes;
+        # identical content resolves to the already stored file
+        with timed('ingest'):
+            upload = upload_store.add(file)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': f'Upload failed: {str(e)}'}), 500
+    
+    # Processing routes can key their cache without rereading the file
+    result_cache.remember_hash(upload_store.path(upload['filename']), upload['sha256'])
+    
+    return jsonify({
+        'filename': upload['filename'],
+        'token': upload['token'],
+        'width': upload['width'],
+        'height': upload['height'],
+        'message': 'File uploaded successfully'
+    })
+
+
+@app.route('/api/upload/<filename>', methods=['DELETE'])
+def delete_upload(filename):
+    """
+    Release an uploaded image, given the token /api/upload returned for it.
+    The file is deleted once every upload of the same content has been released.
+    """
+    filename = secure_filename(filename)
+    token = (request.get_json(silent=True) or {}).get('token')
+    if not token:
+        return jsonify({'error': 'Upload token required'}), 400
+    
+    try:
+        deleted = remove_upload(filename, str(token))
+    except KeyError:
+        return jsonify({'error': 'File not found'}), 404
+    except PermissionError as e:
+        return jsonify({'error': str(e)}), 403
+    if deleted:
+        message = 'Reference released; file deleted'
+    else:
+        message = 'Reference released; file kept for other uploads'
+    return jsonify({'deleted': deleted, 'message': message})
+
+
+def remove_upload(filename, token):
+    """Release the reference a token holds; drop the upload's decoded copies once the file is gone."""
+    deleted = upload_store.release(filename, token)
+    if deleted:
+        _forget_upload(filename)
+    return deleted
 
 
 @app.route('/api/pixelate', methods=['POST'])
@@ -76,35 +294,101 @@ def pixelate():
     data = request.json
     
     filename = data.get('filename')
-    target_width = int(data.get('target_width', 100))
-    target_height = int(data.get('target_height', 100))
-    method = data.get('method', 'average')  # 'nearest' or 'average'
+    method = data.get('method', 'average')  # 'nearest', 'spatial' or 'average'
     
     if not filename:
         return jsonify({'error': 'Filename required'}), 400
+    try:
+        target_width = int(data.get('target_width', 100))
+        target_height = int(data.get('target_height', 100))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'target_width and target_height must be integers'}), 400
+    if method not in PIXELATION_METHODS:
+        return jsonify({'error': f'method must be one of {list(PIXELATION_METHODS)}'}), 400
+    
+    try:
+        scale = parse_output_scale(data.get('output_scale'))
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': f'Invalid output_scale: {str(e)}'}), 400
     
     filepath = os.path.join(UPLOAD_FOLDER, filename)
     if not os.path.exists(filepath):
         return jsonify({'error': 'File not found'}), 404
     
+    operations = [['pixelate', {
+        'target_width': max(1, target_width),
+        'target_height': max(1, target_height),
+        'method': method,
+        'scale': scale,
+        'min_block_pixels': draft_threshold(data, method)
+    }]]
     try:
-        # Load image
-        image = Image.open(filepath)
-        
-        # Apply pixelation
-        pixelated = pixelate_image(image, target_width, target_height, method)
+        chain_size(get_image_dimensions(filepath), operations)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    # Keep the upload out of retention while it is being processed
+    upload_store.pin(os.path.basename(filepath))
+    try:
+        # Return the cached result if this upload was already pixelated this way
+        cache_key = result_cache.make_key(result_cache.source_hash(filepath), operations)
+        result = result_cache.get(cache_key)
         
-        # Save processed image
-        processed_filename = f"pixelated_{filename}"
-        processed_path = os.path.join(PROCESSED_FOLDER, processed_filename)
-        pixelated.save(processed_path)
+        if result is None:
+            base, ext = filename.rsplit('.', 1)
+            grid_size = clamp_grid(get_image_dimensions(filepath), target_width, target_height)
+            
+            min_block_pixels = operations[0][1]['min_block_pixels']
+            
+            if should_tile(filepath, operations):
+                # Large image: pixelate strip by strip straight to a PNG
+                processed_filename = f"pixelated_{base}_{cache_key[:16]}.png"
+                processed_path = os.path.join(PROCESSED_FOLDER, processed_filename)
+                original_size = get_image_dimensions(filepath)
+                with timed('pixelate_tiled', method, original_size):
+                    output_size = pixelate_file_tiled(
+                        filepath, processed_path, target_width, target_height, method, scale=scale,
+                        min_block_pixels=min_block_pixels
+                    )
+            else:
+                if INTEGRAL_IMAGES and uses_integral(operations) and needs_decoded_image(filepath, operations):
+                    # Average the grid from the upload's summed-area table
+                    integral = integral_store.get(filepath)
+                    original_size = (integral.shape[1] - 1, integral.shape[0] - 1)
+                    pixelated = apply_operations_integral(integral, operations)
+                else:
+                    # Load image (lazily when a coarse JPEG grid can use draft mode)
+                    if needs_decoded_image(filepath, operations):
+                        image, _ = decoded_cache.load_array(filepath)
+                        original_size = (image.shape[1], image.shape[0])
+                    else:
+                        image = Image.open(filepath)
+                        original_size = image.size
+                    
+                    # Apply pixelation
+                    pixelated = pixelate_image(
+                        image, target_width, target_height, method, scale=scale,
+                        min_block_pixels=min_block_pixels
+                    )
+                
+                # Save processed image
+                processed_filename = f"pixelated_{base}_{cache_key[:16]}.{ext}"
+                processed_path = os.path.join(PROCESSED_FOLDER, processed_filename)
+                with timed('encode', 'JPEG' if ext.lower() in ('jpg', 'jpeg') else ext.upper(), pixelated.size):
+                    pixelated.save(processed_path)
+                output_size = pixelated.size
+            
+            result = {
+                'processed_filename': processed_filename,
+                **grid_info(original_size, grid_size, output_size)
+            }
+            result_cache.put(cache_key, result)
         
-        return jsonify({
-            'processed_filename': processed_filename,
-            'message': 'Pixelation applied successfully'
-        })
+        return jsonify({**result, 'message': 'Pixelation applied successfully'})
     except Exception as e:
         return jsonify({'error': f'Pixelation failed: {str(e)}'}), 500
+    finally:
+        upload_store.unpin(os.path.basename(filepath))
 
 
 @app.route('/api/remove-background', methods=['POST'])
@@ -113,51 +397,63 @@ def remove_bg():
     data = request.json
     
     filename = data.get('filename')
-    threshold = float(data.get('threshold', 50.0))
     
     if not filename:
         return jsonify({'error': 'Filename required'}), 400
+    try:
+        threshold = float(data.get('threshold', 50.0))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'threshold must be a number'}), 400
+    
+    try:
+        proxy_size = parse_proxy_size(data.get('proxy_size'), 'proxy_size')
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': f'Invalid proxy_size: {str(e)}'}), 400
     
     filepath = os.path.join(UPLOAD_FOLDER, filename)
     if not os.path.exists(filepath):
         return jsonify({'error': 'File not found'}), 404
     
+    upload_store.pin(os.path.basename(filepath))
     try:
-        # Load image
-        image = Image.open(filepath)
-        
-        # Remove background
-        result = remove_background(image, threshold)
+        # Return the cached result if this upload was already processed this way
+        operations = [['remove_background', {'threshold': threshold, 'proxy_size': proxy_size}]]
+        cache_key = result_cache.make_key(result_cache.source_hash(filepath), operations)
+        cached = result_cache.get(cache_key)
         
-        # Save processed image (always PNG for transparency)
-        processed_filename = f"nobg_{filename.rsplit('.', 1)[0]}.png"
-        processed_path = os.path.join(PROCESSED_FOLDER, processed_filename)
-        result.save(processed_path, 'PNG')
+        if cached is None:
+            # Load image (the decoded pixels are read in place)
+            image, _ = decoded_cache.load_array(filepath)
+            
+            # Remove background
+            result = remove_background(image, threshold, proxy_size=proxy_size)
+            
+            # Save processed image (always PNG for transparency)
+            processed_filename = f"nobg_{filename.rsplit('.', 1)[0]}_{cache_key[:16]}.png"
+            processed_path = os.path.join(PROCESSED_FOLDER, processed_filename)
+            with timed('encode', 'PNG', result.size):
+                result.save(processed_path, 'PNG')
+            
+            cached = {'processed_filename': processed_filename}
+            result_cache.put(cache_key, cached)
         
-        return jsonify({
-            'processed_filename': processed_filename,
-            'message': 'Background removal applied successfully'
-        })
+        return jsonify({**cached, 'message': 'Background removal applied successfully'})
     except Exception as e:
         return jsonify({'error': f'Background removal failed: {str(e)}'}), 500
+    finally:
+        upload_store.unpin(os.path.basename(filepath))
 
 
 @app.route('/api/process', methods=['POST'])
 def process_image():
     """
-    Process image with pixelation and/or background removal.
-    Supports both operations in user-specified order.
+    Process image with pixelation, background removal and geometry operations.
+    Operations run in process_order or an explicit operation_order.
+    With 'async': true, uncached work is queued and a job to poll is returned.
     """
     data = request.json
     
     filename = data.get('filename')
-    pixelate_enabled = data.get('pixelate_enabled', False)
-    remove_bg_enabled = data.get('remove_bg_enabled', False)
-    target_width = int(data.get('target_width', 100))
-    target_height = int(data.get('target_height', 100))
-    pixelation_method = data.get('pixelation_method', 'average')
-    bg_threshold = float(data.get('bg_threshold', 50.0))
-    process_order = data.get('process_order', 'pixelate_first')  # 'pixelate_first' or 'bg_first'
     
     if not filename:
         return jsonify({'error': 'Filename required'}), 400
@@ -166,66 +462,350 @@ def process_image():
     if not os.path.exists(filepath):
         return jsonify({'error': 'File not found'}), 404
     
-    if not pixelate_enabled and not remove_bg_enabled:
-        return jsonify({'error': 'At least one processing option must be enabled'}), 400
+    try:
+        # Describe the operation chain in the order it will run
+        operations = build_operations(data)
+        chain_size(get_image_dimensions(filepath), operations)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
+    upload_store.pin(os.path.basename(filepath))
     try:
-        # Load image
-        image = Image.open(filepath)
-        
-        # Apply processing based on order
-        if process_order == 'pixelate_first':
-            if pixelate_enabled:
-                image = pixelate_image(image, target_width, target_height, pixelation_method)
-            if remove_bg_enabled:
-                image = remove_background(image, bg_threshold)
-        else:  # bg_first
-            if remove_bg_enabled:
-                image = remove_background(image, bg_threshold)
-            if pixelate_enabled:
-                image = pixelate_image(image, target_width, target_height, pixelation_method)
+        # Return the cached result if this upload was already processed this way
+        cache_key = result_cache.make_key(result_cache.source_hash(filepath), operations)
+        result = result_cache.get(cache_key)
         
-        # Determine output format
-        output_ext = 'png' if remove_bg_enabled else filename.rsplit('.', 1)[1].lower()
+        if result is None and data.get('async', False):
+            upload = {'filename': filename, 'filepath': filepath, 'cache_key': cache_key}
+            job = _submit_pinned([upload], operations)
+            return jsonify(job.to_dict()), 202
         
-        # Save processed image
-        processed_filename = f"processed_{filename.rsplit('.', 1)[0]}.{output_ext}"
-        processed_path = os.path.join(PROCESSED_FOLDER, processed_filename)
-        image.save(processed_path, output_ext.upper())
+        if result is None:
+            # Large or coarse pixelate-first jobs read the file directly (tiled / draft mode)
+            image = integral = None
+            if needs_decoded_image(filepath, operations):
+                if INTEGRAL_IMAGES and uses_integral(operations):
+                    integral = integral_store.get(filepath)
+                else:
+                    image, _ = decoded_cache.load_array(filepath)
+            result = process_upload(
+                filepath, operations, PROCESSED_FOLDER, cache_key, image=image, integral=integral
+            )
+            result_cache.put(cache_key, result)
         
-        return jsonify({
-            'processed_filename': processed_filename,
-            'message': 'Image processed successfully'
-        })
+        return jsonify({**result, 'message': 'Image processed successfully'})
+    except QueueFull as e:
+        return _queue_full(e)
     except Exception as e:
         return jsonify({'error': f'Processing failed: {str(e)}'}), 500
+    finally:
+        upload_store.unpin(os.path.basename(filepath))
 
 
-@app.route('/api/download/<filename>', methods=['GET'])
-def download_image(filename):
-    """Download a processed image."""
-    filepath = os.path.join(PROCESSED_FOLDER, secure_filename(filename))
+@app.route('/api/preview', methods=['POST'])
+def preview_image():
+    """
+    Render a low-latency PNG preview of /api/process options.
+    The chain runs on the smallest cached reduction of the upload that keeps
+    enough pixels per grid block, and the compact grid is returned upscaled
+    to at most preview_size pixels. Nothing is written to disk or cached;
+    the final /api/process call renders at full resolution.
+    """
+    data = request.json
     
+    filename = data.get('filename')
+    if not filename:
+        return jsonify({'error': 'Filename required'}), 400
+    
+    filepath = os.path.join(UPLOAD_FOLDER, secure_filename(filename))
     if not os.path.exists(filepath):
         return jsonify({'error': 'File not found'}), 404
     
-    return send_file(filepath, as_attachment=True)
+    try:
+        preview_size = int(data.get('preview_size', PREVIEW_MAX_SIZE))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'preview_size must be an integer'}), 400
+    if preview_size < 1 or preview_size > MAX_PREVIEW_SIZE:
+        return jsonify({'error': f'preview_size must be between 1 and {MAX_PREVIEW_SIZE}'}), 400
+    
+    try:
+        operations = build_operations(data)
+        size = get_image_dimensions(filepath)
+        chain_size(size, operations)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if preview_operations(operations, size, size) is None:
+        return jsonify({'error': 'Previews need geometry operations before pixelation'}), 400
+    
+    try:
+        with upload_store.pinned(os.path.basename(filepath)):
+            source_size, levels, mode = pyramid_cache.levels(filepath)
+            index = preview_level(
+                operations, source_size, [(level.shape[1], level.shape[0]) for level in levels],
+                max_size=preview_size
+            )
+            pixels = decoded_cache.load_array(filepath)[0] if index is None else levels[index]
+            level_size = (pixels.shape[1], pixels.shape[0])
+            image = render_preview(
+                Image.fromarray(pixels, mode), preview_operations(operations, source_size, level_size),
+                max_size=preview_size
+            )
+            buffer = io.BytesIO()
+            save_image(image, buffer, 'PNG', palette=True, compress_level=1)
+    except Exception as e:
+        return jsonify({'error': f'Preview failed: {str(e)}'}), 500
+    
+    buffer.seek(0)
+    response = send_file(buffer, mimetype='image/png')
+    response.headers['X-Preview-Source'] = f'{level_size[0]}x{level_size[1]}'
+    return response
+
+
+@app.route('/api/palette', methods=['POST'])
+def create_palette():
+    """
+    Derive a k-means palette from an upload's pixelated grid.
+    Takes the /api/process options; the returned colors can be passed as
+    'palette' to later requests so they all share it.
+    """
+    data = request.json
+    
+    filename = data.get('filename')
+    if not filename:
+        return jsonify({'error': 'Filename required'}), 400
+    
+    filepath = os.path.join(UPLOAD_FOLDER, secure_filename(filename))
+    if not os.path.exists(filepath):
+        return jsonify({'error': 'File not found'}), 404
+    
+    try:
+        operations = build_operations({**data, 'pixelate_enabled': True, 'palette': 'auto'})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        with upload_store.pinned(os.path.basename(filepath)):
+            colors = derive_palette(decoded_cache.open(filepath), operations)
+    except Exception as e:
+        return jsonify({'error': f'Palette derivation failed: {str(e)}'}), 500
+    
+    return jsonify({'palette': format_colors(colors)})
+
+
+@app.route('/api/batch', methods=['POST'])
+def create_batch():
+    """
+    Process several uploads with one shared processing spec.
+    Takes the /api/process options plus a 'filenames' list and returns a job to poll.
+    """
+    data = request.json
+    
+    filenames = data.get('filenames')
+    if not filenames or not isinstance(filenames, list):
+        return jsonify({'error': 'Filenames required'}), 400
+    
+    try:
+        operations = build_operations(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    # Derive an 'auto' palette once, from palette_source or the first image,
+    # so the whole batch shares it
+    palette = None
+    if derives_palette(operations):
+        source_name = data.get('palette_source') or filenames[0]
+        source = os.path.join(UPLOAD_FOLDER, secure_filename(source_name))
+        if not os.path.exists(source):
+            return jsonify({'error': 'File not found', 'missing': [source_name]}), 404
+        try:
+            with upload_store.pinned(os.path.basename(source)):
+                palette = derive_palette(decoded_cache.open(source), operations)
+        except Exception as e:
+            return jsonify({'error': f'Palette derivation failed: {str(e)}'}), 500
+        operations = with_palette(operations, palette)
+    
+    # Cached results are pinned for the job as they are found
+    job_id = uuid.uuid4().hex
+    uploads = []
+    missing = []
+    for filename in filenames:
+        filepath = os.path.join(UPLOAD_FOLDER, secure_filename(filename))
+        if not os.path.exists(filepath):
+            missing.append(filename)
+            continue
+        try:
+            chain_size(get_image_dimensions(filepath), operations)
+        except ValueError as e:
+            result_cache.unpin(job_id)
+            return jsonify({'error': f'{filename}: {str(e)}'}), 400
+        cache_key = result_cache.make_key(result_cache.source_hash(filepath), operations)
+        uploads.append({
+            'filename': filename,
+            'filepath': filepath,
+            'cache_key': cache_key,
+            'result': result_cache.get(cache_key, owner=job_id)
+        })
+    
+    if missing:
+        result_cache.unpin(job_id)
+        return jsonify({'error': 'File not found', 'missing': missing}), 404
+    
+    try:
+        job = _submit_pinned(uploads, operations, job_id)
+    except BatchTooLarge as e:
+        return jsonify({'error': str(e), 'max_queue': job_manager.max_queue}), 413
+    except QueueFull as e:
+        return _queue_full(e)
+    except Exception as e:
+        return jsonify({'error': f'Batch failed: {str(e)}'}), 500
+    
+    response = job.to_dict()
+    if palette is not None:
+        response['palette'] = format_colors(palette)
+    return jsonify(response), 202
+
+
+@app.route('/api/batch/<job_id>', methods=['GET'])
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_batch(job_id):
+    """
+    Poll a batch or async job for per-image progress and results.
+    With ?wait=seconds, blocks until the job finishes or the time runs out.
+    """
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    try:
+        wait = min(max(float(request.args.get('wait', 0)), 0.0), MAX_JOB_WAIT)
+    except ValueError:
+        return jsonify({'error': 'Invalid wait'}), 400
+    if wait:
+        job.wait(wait)
+    
+    return jsonify(job.to_dict())
+
+
+def _submit_pinned(uploads, operations, job_id=None):
+    """
+    Queue uploads on the job pool, pinned against retention until each item
+    finishes; their results stay pinned for the job until it is downloaded
+    or dropped. Pins already taken for job_id are released if queueing fails.
+    """
+    job_id = job_id or uuid.uuid4().hex
+    for upload in uploads:
+        upload_store.pin(os.path.basename(upload['filepath']))
+    try:
+        return job_manager.submit_batch(
+            uploads, operations, PROCESSED_FOLDER,
+            on_result=lambda cache_key, result: result_cache.put(cache_key, result, owner=job_id),
+            on_finish=lambda upload: upload_store.unpin(os.path.basename(upload['filepath'])),
+            job_id=job_id
+        )
+    except Exception:
+        for upload in uploads:
+            upload_store.unpin(os.path.basename(upload['filepath']))
+        result_cache.unpin(job_id)
+        raise
+
+
+def _queue_full(error):
+    """429 response asking the client to retry once the job queue drains."""
+    response = jsonify({'error': str(error)})
+    response.headers['Retry-After'] = str(QUEUE_FULL_RETRY_AFTER)
+    return response, 429
+
+
+@app.route('/api/download/<filename>', methods=['GET'])
+def download_image(filename):
+    """Download a processed image, optionally upscaled with ?scale=N."""
+    filename = secure_filename(filename)
+    
+    scale = request.args.get('scale', 1, type=int)
+    if scale < 1 or scale > MAX_OUTPUT_SCALE:
+        return jsonify({'error': f'scale must be between 1 and {MAX_OUTPUT_SCALE}'}), 400
+    result_cache.touch_file(filename)
+    if scale > 1:
+        return _send_upscaled(
+            os.path.join(PROCESSED_FOLDER, filename), scale, as_attachment=True, download_name=filename
+        )
+    
+    return _send_stored(PROCESSED_FOLDER, filename, as_attachment=True)
+
+
+@app.route('/api/download-zip', methods=['POST'])
+def download_zip():
+    """Stream a ZIP archive of processed images, built as it is sent."""
+    data = request.json
+    
+    filenames = data.get('filenames')
+    if not filenames or not isinstance(filenames, list):
+        return jsonify({'error': 'Filenames required'}), 400
+    
+    return _send_zip(filenames, data.get('archive_name', 'pxl8_images.zip'))
+
+
+@app.route('/api/batch/<job_id>/download', methods=['GET'])
+def download_batch(job_id):
+    """Stream a ZIP archive of a batch job's finished results."""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    done = job.done  # Before listing, so no result finishing in between is missed
+    filenames = [
+        item['processed_filename'] for item in job.to_dict()['items'] if item['status'] == 'done'
+    ]
+    if not filenames:
+        return jsonify({'error': 'No finished results to download'}), 404
+    
+    response = _send_zip(filenames, f'pxl8_batch_{job_id[:8]}.zip')
+    if isinstance(response, Response) and done:
+        # Downloaded: the results may be evicted once the archive is sent
+        response.call_on_close(lambda: result_cache.unpin(job.id))
+    return response
+
+
+def _send_zip(filenames, archive_name):
+    """Respond with a streamed ZIP of files from the processed folder."""
+    files = []
+    missing = []
+    for filename in dict.fromkeys(secure_filename(filename) for filename in filenames):
+        filepath = os.path.join(PROCESSED_FOLDER, filename)
+        if os.path.exists(filepath):
+            files.append((filepath, filename))
+        else:
+            missing.append(filename)
+    
+    if missing:
+        return jsonify({'error': 'File not found', 'missing': missing}), 404
+    
+    archive_name = secure_filename(archive_name) or 'pxl8_images.zip'
+    return Response(
+        stream_zip(files),
+        mimetype='application/zip',
+        headers={'Content-Disposition': f'attachment; filename="{archive_name}"'}
+    )
 
 
 @app.route('/api/image/<folder>/<filename>', methods=['GET'])
 def get_image(folder, filename):
-    """Get an image file (for preview)."""
+    """Get an image file (for preview); revalidations that still match get a 304."""
     if folder not in ['uploads', 'processed']:
         return jsonify({'error': 'Invalid folder'}), 400
     
-    filepath = os.path.join(folder, secure_filename(filename))
+    filename = secure_filename(filename)
     
-    if not os.path.exists(filepath):
-        return jsonify({'error': 'File not found'}), 404
+    # Previews count as use for retention
+    if folder == 'uploads':
+        upload_store.touch(filename)
+    else:
+        result_cache.touch_file(filename)
     
-    return send_file(filepath, mimetype='image/png' if filename.endswith('.png') else 'image/jpeg')
+    return _send_stored(folder, filename)
 
 
 if __name__ == '__main__':
+    # Development server; see wsgi.py and gunicorn.conf.py for production
     app.run(debug=True, host='0.0.0.0', port=5000)
 
@@ -4,110 +4,179 @@ Background removal using edge detection and flood fill.
 
 from PIL import Image
 import numpy as np
-from typing import Tuple
+from typing import Optional, Tuple, Union
 import cv2
 
+from metrics import timed
+
+
+# Fast guided filter settings for proxy masks (radius in proxy pixels, eps on 0-1 intensities)
+PROXY_GUIDE_RADIUS = 4
+PROXY_GUIDE_EPS = 1e-3
+
 
 def remove_background(
-    image: Image.Image,
-    threshold: float = 50.0
+    image: Union[Image.Image, np.ndarray],
+    threshold: float = 50.0,
+    proxy_size: Optional[int] = None
 ) -> Image.Image:
     """
     Remove background from image using edge detection and flood fill.
     
     Args:
-        image: PIL Image object (will be converted to RGB if needed)
+        image: PIL Image object (will be converted to RGB if needed), or an
+            L, RGB or RGBA uint8 array such as a memory-mapped decoded
+            upload, which is read in place and not modified
         threshold: Sensitivity threshold (0-100), higher = more aggressive removal
+        proxy_size: If set and the image is larger, compute the mask on a copy
+            whose longer side is proxy_size pixels and upsample it with an
+            edge-aware (guided) filter. Much faster on large images.
     
     Returns:
         PIL Image with transparent background (RGBA mode)
     """
-    # Convert PIL to numpy array
-    if image.mode == 'RGBA':
-        img_array = np.array(image)
-        has_alpha = True
-    else:
-        img_array = np.array(image.convert('RGB'))
-        has_alpha = False
+    if isinstance(image, np.ndarray):
+        return Image.fromarray(with_alpha(image, background_mask(image, threshold, proxy_size)), 'RGBA')
     
-    # Convert to OpenCV format (BGR)
-    if len(img_array.shape) == 3:
-        cv_image = cv2.cvtColor(img_array, cv2.COLOR_RGB2BGR)
-    else:
-        cv_image = img_array
+    # One writable RGBA buffer; the mask is written into its alpha channel
+    if image.mode != 'RGBA':
+        image = image.convert('RGBA')
+    result = np.array(image)
     
-    # Create mask using edge detection and flood fill
-    mask = _create_background_mask(cv_image, threshold)
+    # Apply mask as the alpha channel (background = 0, foreground = 255)
+    result[:, :, 3] = background_mask(result, threshold, proxy_size)
     
-    # Apply mask to create transparent background
-    if has_alpha:
-        result_array = img_array.copy()
-        result_array[:, :, 3] = mask * 255  # Update alpha channel
+    # Convert back to PIL Image
+    return Image.fromarray(result, 'RGBA')
+
+
+def with_alpha(pixels: np.ndarray, alpha: np.ndarray) -> np.ndarray:
+    """Return an RGBA array with the colors of an L, RGB or RGBA array and the given alpha."""
+    rgba = np.empty(pixels.shape[:2] + (4,), dtype=np.uint8)
+    if pixels.ndim == 2:
+        rgba[:, :, :3] = pixels[:, :, np.newaxis]
     else:
-        # Convert to RGBA
-        result_array = np.zeros((img_array.shape[0], img_array.shape[1], 4), dtype=np.uint8)
-        result_array[:, :, :3] = img_array
-        result_array[:, :, 3] = mask * 255  # Set alpha channel
+        rgba[:, :, :3] = pixels[:, :, :3]
+    rgba[:, :, 3] = alpha
+    return rgba
+
+
+def background_mask(
+    pixels: np.ndarray,
+    threshold: float = 50.0,
+    proxy_size: Optional[int] = None
+) -> np.ndarray:
+    """
+    Compute the foreground mask of an L, RGB or RGBA pixel array.
     
-    # Convert back to PIL Image
-    result = Image.fromarray(result_array, 'RGBA')
+    Args:
+        pixels: uint8 array of shape (height, width) or (height, width, 3 or 4); not modified
+        threshold: Sensitivity threshold (0-100), as in remove_background
+        proxy_size: Proxy mask size, as in remove_background
     
-    return result
+    Returns:
+        uint8 mask of shape (height, width): 255 for foreground, 0 for background
+    """
+    # Contiguous RGB copy for OpenCV (flood fill is symmetric in channel order)
+    if pixels.ndim == 2:
+        rgb = cv2.cvtColor(pixels, cv2.COLOR_GRAY2RGB)
+    elif pixels.shape[2] == 4:
+        rgb = cv2.cvtColor(pixels, cv2.COLOR_RGBA2RGB)
+    else:
+        rgb = pixels.copy()
+    
+    height, width = rgb.shape[:2]
+    if proxy_size and max(width, height) > proxy_size:
+        with timed('mask', 'proxy', (width, height)):
+            return _create_proxy_mask(rgb, threshold, proxy_size)
+    with timed('mask', 'exact', (width, height)):
+        return _create_background_mask(rgb, threshold)
 
 
 def _create_background_mask(
-    cv_image: np.ndarray,
+    rgb: np.ndarray,
     threshold: float
 ) -> np.ndarray:
     """
-    Create a mask identifying foreground (1) vs background (0).
-    Uses edge detection and flood fill from image edges.
+    Create a uint8 mask identifying foreground (255) vs background (0).
+    Flood fills the blurred color image from its four corners, so the
+    background is whatever touches the edges within the color tolerance.
     """
-    # Normalize threshold (0-100 -> 0-255)
+    # Normalize threshold (0-100 -> 0-255); each channel may differ by a quarter of it
     threshold_value = int((threshold / 100.0) * 255)
+    diff = (threshold_value // 4,) * 3
     
-    # Convert to grayscale for processing
-    if len(cv_image.shape) == 3:
-        gray = cv2.cvtColor(cv_image, cv2.COLOR_BGR2GRAY)
-    else:
-        gray = cv_image
-    
-    # Apply Gaussian blur to reduce noise
-    blurred = cv2.GaussianBlur(gray, (5, 5), 0)
+    # Apply Gaussian blur to reduce noise (in place on our private copy)
+    cv2.GaussianBlur(rgb, (5, 5), 0, dst=rgb)
     
-    # Create mask with border padding for flood fill
-    height, width = gray.shape
-    mask = np.zeros((height + 2, width + 2), np.uint8)
-    
-    # Add border to image for flood fill
-    bordered = cv2.copyMakeBorder(blurred, 1, 1, 1, 1, cv2.BORDER_CONSTANT, value=0)
-    
-    # Flood fill from all four corners to identify background
-    # This assumes background touches the edges
+    # Flood fill mask needs a 1-pixel border around the image
+    height, width = rgb.shape[:2]
+    fill_mask = np.zeros((height + 2, width + 2), np.uint8)
     fill_flags = 4 | cv2.FLOODFILL_MASK_ONLY | (255 << 8)
-    lo_diff = threshold_value // 4
-    up_diff = threshold_value // 4
     
-    # Fill from corners
-    cv2.floodFill(bordered, mask, (0, 0), 0, (lo_diff, lo_diff, lo_diff), (up_diff, up_diff, up_diff), fill_flags)
-    cv2.floodFill(bordered, mask, (width, 0), 0, (lo_diff, lo_diff, lo_diff), (up_diff, up_diff, up_diff), fill_flags)
-    cv2.floodFill(bordered, mask, (0, height), 0, (lo_diff, lo_diff, lo_diff), (up_diff, up_diff, up_diff), fill_flags)
-    cv2.floodFill(bordered, mask, (width, height), 0, (lo_diff, lo_diff, lo_diff), (up_diff, up_diff, up_diff), fill_flags)
+    # Fill from corners; this assumes background touches the edges
+    for x, y in ((0, 0), (width - 1, 0), (0, height - 1), (width - 1, height - 1)):
+        if fill_mask[y + 1, x + 1] == 0:
+            cv2.floodFill(rgb, fill_mask, (x, y), 0, diff, diff, fill_flags)
     
-    # Remove border padding
-    mask = mask[1:-1, 1:-1]
-    
-    # Invert mask (background=0, foreground=1)
-    mask = 1 - (mask / 255.0)
+    # Invert (filled background -> 0, foreground -> 255)
+    mask = cv2.bitwise_not(fill_mask[1:-1, 1:-1])
     
     # Apply morphological operations to clean up mask
     kernel = np.ones((5, 5), np.uint8)
-    mask_uint8 = (mask * 255).astype(np.uint8)
-    mask_uint8 = cv2.morphologyEx(mask_uint8, cv2.MORPH_CLOSE, kernel)
-    mask_uint8 = cv2.morphologyEx(mask_uint8, cv2.MORPH_OPEN, kernel)
-    
-    # Normalize back to 0-1
-    mask = mask_uint8.astype(np.float32) / 255.0
+    cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel, dst=mask)
+    cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel, dst=mask)
     
     return mask
 
+
+def _create_proxy_mask(
+    rgb: np.ndarray,
+    threshold: float,
+    proxy_size: int
+) -> np.ndarray:
+    """
+    Compute the mask on a downscaled proxy and upsample it to full size.
+    
+    The upsampling is a fast guided filter: the proxy mask is fitted as a
+    local linear function of the proxy's luminance, the coefficients are
+    upsampled bilinearly and applied to the full-size luminance, so the mask
+    edge snaps to image edges instead of following the coarse proxy grid.
+    """
+    height, width = rgb.shape[:2]
+    factor = proxy_size / max(width, height)
+    proxy_width = max(1, round(width * factor))
+    proxy_height = max(1, round(height * factor))
+    
+    # Bilinear is enough here: the proxy is blurred before flood filling anyway
+    proxy = cv2.resize(rgb, (proxy_width, proxy_height), interpolation=cv2.INTER_LINEAR)
+    guide_small = cv2.cvtColor(proxy, cv2.COLOR_RGB2GRAY).astype(np.float32) / 255.0
+    mask_small = _create_background_mask(proxy, threshold).astype(np.float32) / 255.0
+    
+    a, b = _guided_filter_coefficients(guide_small, mask_small, PROXY_GUIDE_RADIUS, PROXY_GUIDE_EPS)
+    
+    # q = a * I + b at full resolution, thresholded back to a binary mask
+    guide = cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY)
+    a = cv2.resize(a, (width, height), interpolation=cv2.INTER_LINEAR)
+    b = cv2.resize(b, (width, height), interpolation=cv2.INTER_LINEAR)
+    cv2.multiply(a, guide, dst=a, scale=1.0 / 255.0, dtype=cv2.CV_32F)
+    cv2.add(a, b, dst=a)
+    return cv2.compare(a, 0.5, cv2.CMP_GE)
+
+
+def _guided_filter_coefficients(
+    guide: np.ndarray,
+    source: np.ndarray,
+    radius: int,
+    eps: float
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Box-filtered linear coefficients (a, b) of the guided filter source ~ a * guide + b."""
+    size = (2 * radius + 1, 2 * radius + 1)
+    mean_guide = cv2.blur(guide, size)
+    mean_source = cv2.blur(source, size)
+    var_guide = cv2.blur(guide * guide, size) - mean_guide * mean_guide
+    cov = cv2.blur(guide * source, size) - mean_guide * mean_source
+    
+    a = cov / (var_guide + eps)
+    b = mean_source - a * mean_guide
+    return cv2.blur(a, size), cv2.blur(b, size)
@@ -0,0 +1 @@
+# PXL8 backend benchmarks
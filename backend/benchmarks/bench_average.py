@@ -0,0 +1,84 @@
+"""
+Benchmark the vectorized 'average' pixelation against the per-block loop.
+
+Run from the backend directory:
+    python -m benchmarks.bench_average [--quick]
+"""
+
+import argparse
+
+import numpy as np
+from PIL import Image
+
+from pixelation import pixelate_image
+from benchmarks.common import synthetic_image, best_time
+
+
+SIZES = [(640, 480), (1920, 1080), (4000, 3000)]
+GRIDS = [(32, 24), (100, 100), (333, 217), (400, 300)]
+
+
+def reference_pixelate_average(
+    image: Image.Image,
+    target_width: int,
+    target_height: int
+) -> Image.Image:
+    """Original per-block loop, kept as the parity and speed reference."""
+    img_array = np.array(image)
+    orig_height, orig_width = img_array.shape[:2]
+    
+    block_width = orig_width / target_width
+    block_height = orig_height / target_height
+    
+    if len(img_array.shape) == 3:
+        output = np.zeros((target_height, target_width, img_array.shape[2]), dtype=img_array.dtype)
+    else:
+        output = np.zeros((target_height, target_width), dtype=img_array.dtype)
+    
+    for y in range(target_height):
+        for x in range(target_width):
+            x_start = int(x * block_width)
+            x_end = min(int((x + 1) * block_width), orig_width)
+            y_start = int(y * block_height)
+            y_end = min(int((y + 1) * block_height), orig_height)
+            
+            block = img_array[y_start:y_end, x_start:x_end]
+            
+            if len(img_array.shape) == 3:
+                avg_color = np.mean(block.reshape(-1, img_array.shape[2]), axis=0)
+            else:
+                avg_color = np.mean(block)
+            output[y, x] = avg_color.astype(img_array.dtype)
+    
+    result = Image.fromarray(output)
+    return result.resize((orig_width, orig_height), Image.Resampling.NEAREST)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--quick', action='store_true', help='Skip the largest image size')
+    parser.add_argument('--repeat', type=int, default=3, help='Timing repetitions (best is reported)')
+    args = parser.parse_args()
+    
+    sizes = SIZES[:-1] if args.quick else SIZES
+    
+    print(f"{'size':>11} {'mode':>5} {'grid':>9} {'loop s':>9} {'vector s':>9} {'speedup':>8}  match")
+    for width, height in sizes:
+        for mode in ('L', 'RGB', 'RGBA'):
+            image = synthetic_image(width, height, mode)
+            for grid_width, grid_height in GRIDS:
+                loop_time, expected = best_time(
+                    lambda: reference_pixelate_average(image, grid_width, grid_height), 1
+                )
+                vector_time, actual = best_time(
+                    lambda: pixelate_image(image, grid_width, grid_height, 'average'), args.repeat
+                )
+                match = np.array_equal(np.asarray(expected), np.asarray(actual))
+                print(
+                    f"{width:>5}x{height:<5} {mode:>5} {grid_width:>4}x{grid_height:<4} "
+                    f"{loop_time:>9.4f} {vector_time:>9.4f} {loop_time / vector_time:>7.1f}x  {match}"
+                )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+"""
+Benchmark the uint8 background-removal pipeline (exact and proxy modes)
+against the original float/grayscale pipeline, with mask-IoU regression checks.
+
+The color flood fill only accepts a pixel when every channel is within the
+tolerance, so it can never leak further than the grayscale fill did: the
+original foreground must stay covered, while the IoU may drop where the
+grayscale fill leaked into a shape of similar brightness.
+
+Run from the backend directory:
+    python -m benchmarks.bench_background [--quick] [--proxy-size N]
+"""
+
+import argparse
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from background_removal import remove_background
+from benchmarks.common import synthetic_scene, best_time
+
+
+SIZES = [(800, 600), (1920, 1080), (4000, 3000)]
+THRESHOLDS = [15.0, 25.0]
+
+# Regression limits: share of the reference foreground the exact mask keeps,
+# and foreground IoU of the proxy mask against the exact mask
+MIN_COVERAGE_EXACT = 0.98
+MIN_IOU_PROXY = 0.95
+
+# Proxy mode is only measured for images at least this many times its size
+PROXY_MIN_FACTOR = 2
+
+
+def reference_remove_background(image: Image.Image, threshold: float = 50.0) -> Image.Image:
+    """
+    Original pipeline, kept as the speed and mask reference: float mask
+    round trips, a grayscale flood fill from a 1-pixel border and several
+    full-size RGBA copies.
+    
+    The original sized the flood-fill mask for the image rather than the
+    bordered image (which OpenCV rejects) and used a constant 0 border
+    (which only ever leaks into near-black backgrounds); here the mask is
+    sized for the bordered image and the border replicates the edges.
+    """
+    if image.mode == 'RGBA':
+        img_array = np.array(image)
+        has_alpha = True
+    else:
+        img_array = np.array(image.convert('RGB'))
+        has_alpha = False
+    cv_image = cv2.cvtColor(img_array, cv2.COLOR_RGB2BGR)
+    
+    threshold_value = int((threshold / 100.0) * 255)
+    gray = cv2.cvtColor(cv_image, cv2.COLOR_BGR2GRAY)
+    blurred = cv2.GaussianBlur(gray, (5, 5), 0)
+    height, width = gray.shape
+    mask = np.zeros((height + 4, width + 4), np.uint8)
+    bordered = cv2.copyMakeBorder(blurred, 1, 1, 1, 1, cv2.BORDER_REPLICATE)
+    fill_flags = 4 | cv2.FLOODFILL_MASK_ONLY | (255 << 8)
+    diff = threshold_value // 4
+    for seed in ((0, 0), (width, 0), (0, height), (width, height)):
+        cv2.floodFill(bordered, mask, seed, 0, (diff,) * 3, (diff,) * 3, fill_flags)
+    mask = mask[2:-2, 2:-2]
+    mask = 1 - (mask / 255.0)
+    kernel = np.ones((5, 5), np.uint8)
+    mask_uint8 = (mask * 255).astype(np.uint8)
+    mask_uint8 = cv2.morphologyEx(mask_uint8, cv2.MORPH_CLOSE, kernel)
+    mask_uint8 = cv2.morphologyEx(mask_uint8, cv2.MORPH_OPEN, kernel)
+    mask = mask_uint8.astype(np.float32) / 255.0
+    
+    if has_alpha:
+        result_array = img_array.copy()
+    else:
+        result_array = np.zeros((height, width, 4), dtype=np.uint8)
+        result_array[:, :, :3] = img_array
+    result_array[:, :, 3] = mask * 255
+    return Image.fromarray(result_array, 'RGBA')
+
+
+def foreground_iou(expected: Image.Image, actual: Image.Image) -> float:
+    """Intersection over union of the opaque (foreground) pixels."""
+    expected = np.asarray(expected)[:, :, 3] > 127
+    actual = np.asarray(actual)[:, :, 3] > 127
+    union = np.logical_or(expected, actual).sum()
+    return 1.0 if union == 0 else np.logical_and(expected, actual).sum() / union
+
+
+def foreground_coverage(expected: Image.Image, actual: Image.Image) -> float:
+    """Share of the expected foreground that is also foreground in actual."""
+    expected = np.asarray(expected)[:, :, 3] > 127
+    actual = np.asarray(actual)[:, :, 3] > 127
+    total = expected.sum()
+    return 1.0 if total == 0 else np.logical_and(expected, actual).sum() / total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--quick', action='store_true', help='Skip the largest image size')
+    parser.add_argument('--repeat', type=int, default=3, help='Timing repetitions (best is reported)')
+    parser.add_argument('--proxy-size', type=int, default=512, help='Longer side of the proxy mask')
+    args = parser.parse_args()
+    
+    sizes = SIZES[:-1] if args.quick else SIZES
+    failures = 0
+    
+    print(f"{'size':>11} {'thresh':>6} {'legacy s':>9} {'exact s':>8} {'proxy s':>8} "
+          f"{'exact x':>8} {'proxy x':>8} {'IoU exact':>10} {'coverage':>9} {'IoU proxy':>10}")
+    for width, height in sizes:
+        image = synthetic_scene(width, height, seed=width)
+        for threshold in THRESHOLDS:
+            legacy_time, legacy = best_time(lambda: reference_remove_background(image, threshold), args.repeat)
+            exact_time, exact = best_time(lambda: remove_background(image, threshold), args.repeat)
+            iou_exact = foreground_iou(legacy, exact)
+            coverage = foreground_coverage(legacy, exact)
+            failures += coverage < MIN_COVERAGE_EXACT
+            row = (
+                f"{width:>5}x{height:<5} {threshold:>6.0f} {legacy_time:>9.4f} {exact_time:>8.4f} "
+            )
+            # The proxy only pays off (and only stays faithful) well above its own size
+            if max(width, height) >= PROXY_MIN_FACTOR * args.proxy_size:
+                proxy_time, proxy = best_time(
+                    lambda: remove_background(image, threshold, proxy_size=args.proxy_size), args.repeat
+                )
+                iou_proxy = foreground_iou(exact, proxy)
+                failures += iou_proxy < MIN_IOU_PROXY
+                print(
+                    f"{row}{proxy_time:>8.4f} {legacy_time / exact_time:>7.1f}x {legacy_time / proxy_time:>7.1f}x "
+                    f"{iou_exact:>10.4f} {coverage:>9.4f} {iou_proxy:>10.4f}"
+                )
+            else:
+                print(
+                    f"{row}{'-':>8} {legacy_time / exact_time:>7.1f}x {'-':>8} "
+                    f"{iou_exact:>10.4f} {coverage:>9.4f} {'-':>10}"
+                )
+    
+    if failures:
+        print(f"{failures} case(s) below limits (coverage >= {MIN_COVERAGE_EXACT}, proxy IoU >= {MIN_IOU_PROXY})")
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+Benchmark a batch job end to end through the API, with a result cache
+smaller than the batch, and check its ZIP download.
+
+Uploads synthetic images, runs them as one /api/batch job, waits for it
+and downloads /api/batch/<id>/download. With the cache limited to fewer
+entries than the batch, finished results must stay pinned for the job
+until it is downloaded, so the archive has to hold every image. Reports
+the batch and download times. Runs in a temporary folder.
+
+Run from the backend directory:
+    python -m benchmarks.bench_batch [--images N] [--cache-entries N]
+"""
+
+import argparse
+import io
+import os
+import shutil
+import tempfile
+import time
+import zipfile
+
+from benchmarks.common import synthetic_image
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--images', type=int, default=8, help='Images in the batch')
+    parser.add_argument('--cache-entries', type=int, default=3, help='PXL8_RESULT_CACHE_ENTRIES')
+    parser.add_argument('--size', type=int, default=1024, help='Width of each image (4:3)')
+    args = parser.parse_args()
+    
+    folder = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    # The app keeps uploads/ and processed/ in the working directory and reads
+    # its limits at import, so both have to be in place first
+    os.chdir(folder)
+    os.environ['PXL8_RESULT_CACHE_ENTRIES'] = str(args.cache_entries)
+    os.environ['PXL8_JANITOR_INTERVAL'] = '0'
+    try:
+        from app import app, job_manager
+        client = app.test_client()
+        
+        filenames = []
+        for index in range(args.images):
+            buffer = io.BytesIO()
+            synthetic_image(args.size, args.size * 3 // 4, seed=index).save(buffer, 'PNG')
+            buffer.seek(0)
+            response = client.post('/api/upload', data={'file': (buffer, f'{index}.png')})
+            filenames.append(response.get_json()['filename'])
+        
+        start = time.perf_counter()
+        job = client.post('/api/batch', json={
+            'filenames': filenames, 'pixelate_enabled': True, 'target_width': 64, 'target_height': 48
+        }).get_json()
+        while job['status'] == 'running':
+            job = client.get(f"/api/batch/{job['job_id']}?wait=5").get_json()
+        batch_time = time.perf_counter() - start
+        
+        start = time.perf_counter()
+        response = client.get(f"/api/batch/{job['job_id']}/download")
+        archive = response.get_data()
+        download_time = time.perf_counter() - start
+        job_manager.shutdown()
+        
+        entries = len(zipfile.ZipFile(io.BytesIO(archive)).namelist()) if response.status_code == 200 else 0
+        print(f"{'images':>6} {'cache':>6} {'status':>22} {'batch s':>8} {'download s':>11} {'zip entries':>12}")
+        print(
+            f"{args.images:>6} {args.cache_entries:>6} {job['status']:>22} {batch_time:>8.3f} "
+            f"{download_time:>11.4f} {entries:>12}"
+        )
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(folder)
+    
+    if response.status_code != 200 or entries != args.images:
+        print(f"FAILED: download returned {response.status_code} with {entries} of {args.images} images")
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
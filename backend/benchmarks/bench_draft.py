@@ -0,0 +1,74 @@
+"""
+Benchmark JPEG draft-mode decoding against full decoding for coarse grids,
+reporting speed and how far the draft grid drifts from the full-decode grid.
+
+Run from the backend directory:
+    python -m benchmarks.bench_draft [--quick] [--min-block-pixels N]
+"""
+
+import argparse
+import io
+
+import numpy as np
+from PIL import Image
+
+from pixelation import DRAFT_METHODS, pixelate_image, draft_reduction
+from benchmarks.common import synthetic_image, best_time
+
+
+SIZES = [(1920, 1080), (4000, 3000), (6000, 4000)]
+GRIDS = [(32, 24), (64, 48), (160, 120), (400, 300)]
+METHODS = list(DRAFT_METHODS)
+
+
+def psnr(expected: np.ndarray, actual: np.ndarray) -> float:
+    """Peak signal-to-noise ratio in dB (inf when identical)."""
+    mse = np.mean((expected.astype(np.float64) - actual.astype(np.float64)) ** 2)
+    return float('inf') if mse == 0 else 10 * np.log10(255.0 ** 2 / mse)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--quick', action='store_true', help='Skip the largest image size')
+    parser.add_argument('--repeat', type=int, default=3, help='Timing repetitions (best is reported)')
+    parser.add_argument('--min-block-pixels', type=int, default=8,
+                        help='Source pixels to keep along each block side')
+    args = parser.parse_args()
+    
+    sizes = SIZES[:-1] if args.quick else SIZES
+    
+    print(f"{'size':>11} {'method':>8} {'grid':>9} {'draft':>6} {'full s':>8} {'draft s':>8} "
+          f"{'speedup':>8} {'mean err':>9} {'max err':>8} {'PSNR dB':>8}")
+    for width, height in sizes:
+        buffer = io.BytesIO()
+        synthetic_image(width, height, 'RGB').save(buffer, 'JPEG', quality=90)
+        data = buffer.getvalue()
+        
+        def open_jpeg():
+            return Image.open(io.BytesIO(data))
+        
+        for method in METHODS:
+            for grid_width, grid_height in GRIDS:
+                reduction = draft_reduction(open_jpeg(), grid_width, grid_height, args.min_block_pixels)
+                full_time, full = best_time(
+                    lambda: pixelate_image(open_jpeg(), grid_width, grid_height, method, scale=1),
+                    args.repeat
+                )
+                draft_time, draft = best_time(
+                    lambda: pixelate_image(
+                        open_jpeg(), grid_width, grid_height, method, scale=1,
+                        min_block_pixels=args.min_block_pixels
+                    ),
+                    args.repeat
+                )
+                full, draft = np.asarray(full), np.asarray(draft)
+                error = np.abs(full.astype(np.int16) - draft.astype(np.int16))
+                print(
+                    f"{width:>5}x{height:<5} {method:>8} {grid_width:>4}x{grid_height:<4} {'1/' + str(reduction):>6} "
+                    f"{full_time:>8.4f} {draft_time:>8.4f} {full_time / draft_time:>7.1f}x "
+                    f"{error.mean():>9.3f} {error.max():>8d} {psnr(full, draft):>8.2f}"
+                )
+
+
+if __name__ == '__main__':
+    main()
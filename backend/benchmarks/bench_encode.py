@@ -0,0 +1,94 @@
+"""
+Benchmark output encoding of pixelated results: time and bytes for each
+output option, from the compact grid to the encoded file.
+
+Every option starts from the same pixelated grid and includes its upscale,
+so the times compare what process_upload spends after pixelation. Palette
+output is checked to decode to exactly the pixels of the default PNG.
+
+Run from the backend directory:
+    python -m benchmarks.bench_encode [--quick]
+"""
+
+import argparse
+import io
+import itertools
+
+import numpy as np
+from PIL import Image
+
+from encoding import palette_image, save_image
+from pixelation import pixelate_image, upscale_grid
+from benchmarks.common import synthetic_image, best_time
+
+
+SIZES = [(1920, 1080), (4000, 3000), (8000, 6000)]
+GRIDS = [(64, 48), (320, 240)]
+MODES = ['RGB', 'RGBA']
+
+# (label, output format, palette, compress level, upscaled)
+OPTIONS = [
+    ('png', 'PNG', False, 6, True),
+    ('png level 1', 'PNG', False, 1, True),
+    ('png level 9', 'PNG', False, 9, True),
+    ('png palette', 'PNG', True, 6, True),
+    ('png palette level 1', 'PNG', True, 1, True),
+    ('webp lossless', 'WEBP', False, 6, True),
+    ('webp lossless level 1', 'WEBP', False, 1, True),
+    ('grid png', 'PNG', False, 6, False),
+]
+
+
+def encode(grid: Image.Image, size: tuple, image_format: str, palette: bool, level: int, upscaled: bool) -> bytes:
+    """Encode a grid the way process_upload does for these options."""
+    if upscaled:
+        # Palette chains index the grid and upscale the 1-byte indices
+        image = upscale_grid((palette and palette_image(grid)) or grid, size)
+    else:
+        image = grid
+    buffer = io.BytesIO()
+    save_image(image, buffer, image_format, palette=palette, compress_level=level)
+    return buffer.getvalue()
+
+
+def decoded(data: bytes) -> np.ndarray:
+    with Image.open(io.BytesIO(data)) as image:
+        return np.asarray(image.convert('RGBA'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--quick', action='store_true', help='Skip the largest image size')
+    parser.add_argument('--repeat', type=int, default=3, help='Timing repetitions (best is reported)')
+    args = parser.parse_args()
+    
+    sizes = SIZES[:-1] if args.quick else SIZES
+    mismatches = 0
+    print(f"{'size':>11} {'mode':>5} {'grid':>8} {'colors':>7} {'option':>22} {'seconds':>8} {'bytes':>10} {'vs png':>7}")
+    for (width, height), mode, (grid_width, grid_height) in itertools.product(sizes, MODES, GRIDS):
+        # Few channel levels keep the grid within a 256-color palette
+        source = synthetic_image(width, height, mode, seed=width, levels=4 if mode == 'RGB' else 3)
+        grid = pixelate_image(source, grid_width, grid_height, 'nearest', scale=1)
+        colors = len(grid.getcolors(256) or ()) or '>256'
+        
+        baseline = None
+        for label, image_format, palette, level, upscaled in OPTIONS:
+            seconds, data = best_time(
+                lambda: encode(grid, (width, height), image_format, palette, level, upscaled), args.repeat
+            )
+            if baseline is None:
+                baseline = (seconds, data)
+            elif palette and not np.array_equal(decoded(data), decoded(baseline[1])):
+                mismatches += 1
+                print(f"MISMATCH {width}x{height} {mode} grid={grid_width}x{grid_height} {label}")
+            print(
+                f"{width:>5}x{height:<5} {mode:>5} {grid_width:>3}x{grid_height:<4} {colors:>7} {label:>22} "
+                f"{seconds:>8.4f} {len(data):>10} {baseline[0] / seconds:>6.1f}x"
+            )
+    
+    if mismatches:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""
+Benchmark and parity-check the fused pixelate + remove_background chain
+against running both operations one after the other on PIL images.
+
+Parity is exact wherever the two paths are defined to agree: bg_first order
+at any output scale, and pixelate_first order at output_scale 'grid'. For
+pixelate_first at the original size the fused chain computes the mask on the
+grid, so only the foreground agreement with the sequential chain is reported.
+
+Run from the backend directory:
+    python -m benchmarks.bench_fused [--quick] [--parity-only]
+"""
+
+import argparse
+import itertools
+
+import numpy as np
+from PIL import Image
+
+from pixelation import pixelate_image
+from background_removal import remove_background
+from processing import apply_operations_fused
+from benchmarks.common import synthetic_image, synthetic_scene, best_time
+
+
+SIZES = [(800, 600), (1920, 1080), (4000, 3000)]
+GRID = (100, 75)
+THRESHOLD = 15.0
+
+PARITY_SIZES = [(31, 17), (64, 64), (320, 240)]
+PARITY_GRIDS = [(1, 1), (7, 4), (32, 24)]
+PARITY_METHODS = ['average', 'spatial', 'nearest']
+
+
+def sequential_operations(image: Image.Image, operations: list) -> Image.Image:
+    """Run each operation on PIL images in turn, as the chain did before fusing."""
+    for operation, params in operations:
+        if operation == 'pixelate':
+            image = pixelate_image(
+                image, params['target_width'], params['target_height'],
+                params['method'], scale=params['scale']
+            )
+        else:
+            image = remove_background(image, params['threshold'], proxy_size=params.get('proxy_size'))
+    return image
+
+
+def make_operations(grid, method, scale, bg_first):
+    operations = [
+        ['pixelate', {'target_width': grid[0], 'target_height': grid[1], 'method': method, 'scale': scale}],
+        ['remove_background', {'threshold': THRESHOLD, 'proxy_size': None}]
+    ]
+    if bg_first:
+        operations.reverse()
+    return operations
+
+
+def foreground_agreement(expected: Image.Image, actual: Image.Image) -> float:
+    """Share of pixels on the same side of the foreground/background split."""
+    expected = np.asarray(expected)[:, :, 3] > 127
+    actual = np.asarray(actual)[:, :, 3] > 127
+    return float((expected == actual).mean())
+
+
+def check_parity() -> bool:
+    """Compare fused and sequential chains where they must match; return True if all do."""
+    failures = 0
+    cases = 0
+    for (width, height), grid, method, mode, bg_first in itertools.product(
+        PARITY_SIZES, PARITY_GRIDS, PARITY_METHODS, ('L', 'RGB', 'RGBA'), (False, True)
+    ):
+        if mode == 'RGB':
+            image = synthetic_scene(width, height, seed=width)
+        else:
+            image = synthetic_image(width, height, mode, seed=width, levels=4)
+        # The grid must be the output for pixelate_first to match exactly
+        scales = [None, 1, 3] if bg_first else [1]
+        for scale in scales:
+            operations = make_operations(grid, method, scale, bg_first)
+            expected = np.asarray(sequential_operations(image, operations))
+            actual = np.asarray(apply_operations_fused(image, operations))
+            cases += 1
+            if not np.array_equal(expected, actual):
+                failures += 1
+                print(f"MISMATCH {width}x{height} {mode} grid={grid} {method} scale={scale} bg_first={bg_first}")
+    
+    print(f"parity: {cases - failures}/{cases} cases identical")
+    return failures == 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--quick', action='store_true', help='Skip the largest image size')
+    parser.add_argument('--parity-only', action='store_true', help='Only run the parity checks')
+    parser.add_argument('--repeat', type=int, default=3, help='Timing repetitions (best is reported)')
+    args = parser.parse_args()
+    
+    if not check_parity():
+        raise SystemExit(1)
+    if args.parity_only:
+        return
+    
+    sizes = SIZES[:-1] if args.quick else SIZES
+    print(f"{'size':>11} {'order':>15} {'method':>8} {'sequential s':>13} {'fused s':>8} {'speedup':>8} {'agreement':>10}")
+    for (width, height), bg_first, method in itertools.product(sizes, (False, True), ('average', 'nearest')):
+        image = synthetic_scene(width, height, seed=width)
+        operations = make_operations(GRID, method, None, bg_first)
+        sequential_time, expected = best_time(lambda: sequential_operations(image, operations), args.repeat)
+        fused_time, actual = best_time(lambda: apply_operations_fused(image, operations), args.repeat)
+        order = 'bg_first' if bg_first else 'pixelate_first'
+        print(
+            f"{width:>5}x{height:<5} {order:>15} {method:>8} {sequential_time:>13.4f} {fused_time:>8.4f} "
+            f"{sequential_time / fused_time:>7.1f}x {foreground_agreement(expected, actual):>10.4f}"
+        )
+
+
+if __name__ == '__main__':
+    main()
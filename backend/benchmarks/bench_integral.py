@@ -0,0 +1,92 @@
+"""
+Benchmark 'average' pixelation from a memory-mapped summed-area table
+against reducing the decoded image, at several grid sizes.
+
+Reports the one-off table build time and size on disk per image, then the
+time per grid for both approaches. Every grid is checked to be identical.
+
+Run from the backend directory:
+    python -m benchmarks.bench_integral [--quick]
+"""
+
+import argparse
+import itertools
+import os
+import tempfile
+
+import numpy as np
+
+from pixelation import _average_blocks, _block_edges, average_from_integral, integral_image
+from benchmarks.common import synthetic_image, best_time
+
+
+SIZES = [(1920, 1080), (4000, 3000), (8000, 6000)]
+MODES = ['L', 'RGB', 'RGBA']
+GRIDS = [(16, 12), (64, 48), (320, 240), (1000, 750)]
+
+
+def build_table(pixels: np.ndarray, path: str) -> np.ndarray:
+    """Write a table to path the way IntegralImageStore does and map it back."""
+    height, width = pixels.shape[:2]
+    table = np.lib.format.open_memmap(
+        path, mode='w+', dtype=np.int64, shape=(height + 1, width + 1) + pixels.shape[2:]
+    )
+    integral_image(pixels, out=table)
+    table.flush()
+    del table
+    return np.load(path, mmap_mode='r')
+
+
+def compare_grids(pixels: np.ndarray, mode: str, path: str, repeat: int) -> int:
+    """
+    Time every grid from the image and from its table, printing one row each.
+    
+    The table is memory-mapped only while this runs, so path can be reused
+    for the next image. Returns the number of grids that differ.
+    """
+    height, width = pixels.shape[:2]
+    build_time, table = best_time(lambda: build_table(pixels, path), 1)
+    table_mb = os.path.getsize(path) / (1024 * 1024)
+    
+    mismatches = 0
+    for grid_width, grid_height in GRIDS:
+        row_edges = _block_edges(height, grid_height)
+        col_edges = _block_edges(width, grid_width)
+        blocks_time, expected = best_time(
+            lambda: _average_blocks(pixels, row_edges, col_edges), repeat
+        )
+        table_time, grid = best_time(
+            lambda: average_from_integral(table, grid_width, grid_height), repeat
+        )
+        if not np.array_equal(grid, expected):
+            mismatches += 1
+            print(f"MISMATCH {width}x{height} {mode} grid={grid_width}x{grid_height}")
+        print(
+            f"{width:>5}x{height:<5} {mode:>5} {build_time:>8.3f} {table_mb:>9.1f} "
+            f"{grid_width:>4}x{grid_height:<4} {blocks_time:>9.4f} {table_time:>9.4f} "
+            f"{blocks_time / table_time:>7.1f}x"
+        )
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--quick', action='store_true', help='Skip the largest image size')
+    parser.add_argument('--repeat', type=int, default=3, help='Timing repetitions (best is reported)')
+    args = parser.parse_args()
+    
+    sizes = SIZES[:-1] if args.quick else SIZES
+    mismatches = 0
+    print(f"{'size':>11} {'mode':>5} {'build s':>8} {'table MB':>9} {'grid':>9} "
+          f"{'blocks s':>9} {'table s':>9} {'speedup':>8}")
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'table.npy')
+        for (width, height), mode in itertools.product(sizes, MODES):
+            pixels = np.asarray(synthetic_image(width, height, mode, seed=width))
+            mismatches += compare_grids(pixels, mode, path, args.repeat)
+    
+    if mismatches:
+        raise SystemExit(1)
+
+if __name__ == '__main__':
+    main()
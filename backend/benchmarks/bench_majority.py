@@ -0,0 +1,120 @@
+"""
+Benchmark and parity-check the packed-key 'nearest' (majority color) pixelation
+against the original Counter-based loop.
+
+Run from the backend directory:
+    python -m benchmarks.bench_majority [--quick] [--parity-only]
+"""
+
+import argparse
+import itertools
+from collections import Counter
+
+import numpy as np
+from PIL import Image
+
+from pixelation import pixelate_image
+from benchmarks.common import synthetic_image, best_time
+
+
+SIZES = [(640, 480), (1920, 1080), (4000, 3000)]
+GRIDS = [(32, 24), (100, 100), (333, 217), (400, 300)]
+
+# Small images with few colors, so blocks have many ties
+PARITY_SIZES = [(1, 1), (7, 5), (31, 17), (64, 64), (101, 37)]
+PARITY_GRIDS = [(1, 1), (2, 3), (5, 5), (7, 4), (16, 16), (31, 17)]
+PARITY_LEVELS = [2, 3, 8]
+
+
+def reference_pixelate_majority(
+    image: Image.Image,
+    target_width: int,
+    target_height: int
+) -> Image.Image:
+    """Original Counter-based loop, kept as the parity and speed reference."""
+    img_array = np.array(image)
+    orig_height, orig_width = img_array.shape[:2]
+    
+    block_width = orig_width / target_width
+    block_height = orig_height / target_height
+    
+    if len(img_array.shape) == 3:
+        output = np.zeros((target_height, target_width, img_array.shape[2]), dtype=img_array.dtype)
+    else:
+        output = np.zeros((target_height, target_width), dtype=img_array.dtype)
+    
+    for y in range(target_height):
+        for x in range(target_width):
+            x_start = int(x * block_width)
+            x_end = min(int((x + 1) * block_width), orig_width)
+            y_start = int(y * block_height)
+            y_end = min(int((y + 1) * block_height), orig_height)
+            
+            block = img_array[y_start:y_end, x_start:x_end]
+            
+            if len(img_array.shape) == 3:
+                pixels = block.reshape(-1, img_array.shape[2])
+                color_counts = Counter(tuple(pixel) for pixel in pixels)
+                output[y, x] = np.array(color_counts.most_common(1)[0][0], dtype=img_array.dtype)
+            else:
+                color_counts = Counter(block.flatten())
+                output[y, x] = color_counts.most_common(1)[0][0]
+    
+    result = Image.fromarray(output)
+    return result.resize((orig_width, orig_height), Image.Resampling.NEAREST)
+
+
+def check_parity() -> bool:
+    """Compare both implementations on tie-heavy images; return True if all match."""
+    failures = 0
+    cases = 0
+    for (width, height), (grid_width, grid_height), mode, levels in itertools.product(
+        PARITY_SIZES, PARITY_GRIDS, ('L', 'RGB', 'RGBA'), PARITY_LEVELS
+    ):
+        if grid_width > width or grid_height > height:
+            continue  # The reference loop fails on empty blocks
+        image = synthetic_image(width, height, mode, seed=width * height, levels=levels)
+        expected = np.asarray(reference_pixelate_majority(image, grid_width, grid_height))
+        actual = np.asarray(pixelate_image(image, grid_width, grid_height, 'nearest'))
+        cases += 1
+        if not np.array_equal(expected, actual):
+            failures += 1
+            print(f"MISMATCH {width}x{height} {mode} levels={levels} grid {grid_width}x{grid_height}")
+    print(f"parity: {cases - failures}/{cases} cases match")
+    return failures == 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--quick', action='store_true', help='Skip the largest image size')
+    parser.add_argument('--parity-only', action='store_true', help='Only run the parity checks')
+    parser.add_argument('--repeat', type=int, default=3, help='Timing repetitions (best is reported)')
+    args = parser.parse_args()
+    
+    if not check_parity():
+        raise SystemExit(1)
+    if args.parity_only:
+        return
+    
+    sizes = SIZES[:-1] if args.quick else SIZES
+    
+    print(f"{'size':>11} {'mode':>5} {'grid':>9} {'Counter s':>10} {'packed s':>9} {'speedup':>8}  match")
+    for width, height in sizes:
+        for mode in ('L', 'RGB', 'RGBA'):
+            image = synthetic_image(width, height, mode, levels=16)
+            for grid_width, grid_height in GRIDS:
+                loop_time, expected = best_time(
+                    lambda: reference_pixelate_majority(image, grid_width, grid_height), 1
+                )
+                packed_time, actual = best_time(
+                    lambda: pixelate_image(image, grid_width, grid_height, 'nearest'), args.repeat
+                )
+                match = np.array_equal(np.asarray(expected), np.asarray(actual))
+                print(
+                    f"{width:>5}x{height:<5} {mode:>5} {grid_width:>4}x{grid_height:<4} "
+                    f"{loop_time:>10.4f} {packed_time:>9.4f} {loop_time / packed_time:>7.1f}x  {match}"
+                )
+
+
+if __name__ == '__main__':
+    main()
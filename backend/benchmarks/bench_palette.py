@@ -0,0 +1,95 @@
+"""
+Benchmark palette quantization: the 3D lookup table against an exact
+brute-force nearest-color search, on grids of increasing size.
+
+Reports the one-off table build time per palette, mapping time for both
+approaches, the share of pixels mapped to the exact nearest color, and the
+largest extra color distance where they differ. Also checks that deriving a
+palette for a fully transparent grid leaves the grid unchanged.
+
+Run from the backend directory:
+    python -m benchmarks.bench_palette [--quick]
+"""
+
+import argparse
+import itertools
+
+import numpy as np
+from PIL import Image
+
+from palette import _lookup_table, kmeans_palette, quantize_pixels, resolve_palette
+from pixelation import pixelate_image
+from benchmarks.common import synthetic_image, best_time
+
+
+GRIDS = [(64, 48), (320, 240), (1000, 750), (2000, 1500)]
+PALETTES = ['gameboy', 'pico8', 'kmeans 32', 'kmeans 256']
+
+
+def exact_quantize(pixels: np.ndarray, palette: np.ndarray) -> np.ndarray:
+    """Nearest palette color per pixel by comparing against every color."""
+    flat = pixels.reshape(-1, 3).astype(np.int32)
+    nearest = np.empty(len(flat), dtype=np.intp)
+    colors = palette.astype(np.int32)
+    for start in range(0, len(flat), 65536):
+        chunk = flat[start:start + 65536]
+        distances = ((chunk[:, np.newaxis, :] - colors[np.newaxis, :, :]) ** 2).sum(axis=2)
+        nearest[start:start + 65536] = distances.argmin(axis=1)
+    return palette[nearest].reshape(pixels.shape)
+
+
+def color_distance(colors: np.ndarray, pixels: np.ndarray) -> np.ndarray:
+    """Euclidean RGB distance per pixel."""
+    return np.sqrt(((colors.astype(np.float64) - pixels) ** 2).sum(axis=2))
+
+
+def make_palette(name: str, pixels: np.ndarray) -> np.ndarray:
+    if name.startswith('kmeans'):
+        return np.asarray(kmeans_palette(pixels, int(name.split()[1])), dtype=np.uint8)
+    return np.asarray(resolve_palette(name), dtype=np.uint8)
+
+
+def check_transparent() -> bool:
+    """A derived palette of a fully transparent grid has no colors; return True if that is handled."""
+    image = Image.new('RGBA', (16, 12), (40, 80, 120, 0))
+    try:
+        grid = pixelate_image(image, 2, 2, 'average', scale=1, palette=4)
+    except ValueError as e:
+        print(f"FAILED transparent grid: {e}")
+        return False
+    unchanged = np.array_equal(np.asarray(grid), np.asarray(pixelate_image(image, 2, 2, 'average', scale=1)))
+    print(f"transparent grid: {'unchanged' if unchanged else 'CHANGED'}")
+    return unchanged
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--quick', action='store_true', help='Skip the largest grid')
+    parser.add_argument('--repeat', type=int, default=3, help='Timing repetitions (best is reported)')
+    args = parser.parse_args()
+    
+    if not check_transparent():
+        raise SystemExit(1)
+    
+    grids = GRIDS[:-1] if args.quick else GRIDS
+    print(f"{'grid':>10} {'palette':>11} {'colors':>6} {'table s':>8} {'lut s':>8} {'exact s':>8} "
+          f"{'speedup':>8} {'exact match':>11} {'max extra':>9}")
+    for (width, height), name in itertools.product(grids, PALETTES):
+        pixels = np.asarray(synthetic_image(width, height, 'RGB', seed=width))
+        palette = make_palette(name, pixels)
+        
+        _lookup_table.cache_clear()
+        table_time, _ = best_time(lambda: _lookup_table(palette.tobytes()), 1)
+        lut_time, mapped = best_time(lambda: quantize_pixels(pixels, palette), args.repeat)
+        exact_time, exact = best_time(lambda: exact_quantize(pixels, palette), 1)
+        
+        match = float((mapped == exact).all(axis=2).mean())
+        extra = float((color_distance(mapped, pixels) - color_distance(exact, pixels)).max())
+        print(
+            f"{width:>4}x{height:<5} {name:>11} {len(palette):>6} {table_time:>8.4f} {lut_time:>8.4f} "
+            f"{exact_time:>8.4f} {exact_time / lut_time:>7.1f}x {match:>11.4f} {extra:>9.2f}"
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+Benchmark getting an upload's pixels into a fresh process's pipeline:
+decoding the file against memory-mapping its raw decoded copy (load_raw).
+
+For each source, reports the decode time, the time to map the raw file and
+the time to pixelate from each, with the raw file's size. A process that
+maps the raw file pays neither the decode nor a private copy of the pixels.
+Grids from both sources are checked to be identical.
+
+Run from the backend directory:
+    python -m benchmarks.bench_raw [--quick]
+"""
+
+import argparse
+import itertools
+import os
+import shutil
+import tempfile
+
+import numpy as np
+from PIL import Image
+
+from cache import decode_image, load_raw, raw_path
+from pixelation import pixelate_image
+from benchmarks.common import synthetic_image, best_time
+
+
+SIZES = [(1920, 1080), (4000, 3000), (8000, 6000)]
+FORMATS = ['JPEG', 'PNG']
+METHODS = ['average', 'nearest']
+
+
+def compare_methods(path: str, repeat: int) -> int:
+    """
+    Time decoding and memory-mapping one upload and pixelating each, printing
+    one row per method.
+    
+    The raw file is mapped only while this runs, so the folder can be removed
+    afterwards. Returns the number of methods whose grids differ.
+    """
+    raw_mb = os.path.getsize(raw_path(path)) / (1024 * 1024)
+    decode_time, (pixels, mode) = best_time(lambda: decode_image(path), repeat)
+    map_time, (mapped, _) = best_time(lambda: load_raw(path), repeat)
+    image = Image.fromarray(pixels, mode)
+    height, width = pixels.shape[:2]
+    image_format = os.path.splitext(path)[1][1:].upper()
+    
+    mismatches = 0
+    for method in METHODS:
+        pixelate_time, expected = best_time(
+            lambda: pixelate_image(image, 64, 48, method, scale=1), repeat
+        )
+        mapped_time, grid = best_time(
+            lambda: pixelate_image(mapped, 64, 48, method, scale=1), repeat
+        )
+        if not np.array_equal(np.asarray(grid), np.asarray(expected)):
+            mismatches += 1
+            print(f"MISMATCH {width}x{height} {image_format} {method}")
+        print(
+            f"{width:>5}x{height:<5} {image_format:>6} {raw_mb:>7.1f} {decode_time:>9.4f} "
+            f"{map_time:>8.5f} {method:>8} {pixelate_time:>11.4f} {mapped_time:>11.4f}"
+        )
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--quick', action='store_true', help='Skip the largest image size')
+    parser.add_argument('--repeat', type=int, default=3, help='Timing repetitions (best is reported)')
+    args = parser.parse_args()
+    
+    sizes = SIZES[:-1] if args.quick else SIZES
+    mismatches = 0
+    print(f"{'size':>11} {'format':>6} {'raw MB':>7} {'decode s':>9} {'map s':>8} "
+          f"{'method':>8} {'pixelate s':>11} {'from map s':>11}")
+    folder = tempfile.mkdtemp()
+    try:
+        for (width, height), image_format in itertools.product(sizes, FORMATS):
+            path = os.path.join(folder, f'source.{image_format.lower()}')
+            synthetic_image(width, height, 'RGB', seed=width).save(path, image_format)
+            load_raw(path)  # Write the raw file once, as the first process would
+            mismatches += compare_methods(path, args.repeat)
+    finally:
+        shutil.rmtree(folder)
+    
+    if mismatches:
+        raise SystemExit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""
+Parity-check and benchmark the tiled (strip by strip) PNG pixelation against
+pixelate_image followed by a PNG save.
+
+Every case is written with pixelate_file_tiled, read back and compared with
+the in-memory result, over methods, modes, output scales and strip sizes
+small enough that strips hold one block row or none of the output rows.
+Runs in a temporary folder.
+
+Run from the backend directory:
+    python -m benchmarks.bench_tiled [--parity-only] [--repeat N]
+"""
+
+import argparse
+import itertools
+import os
+import shutil
+import tempfile
+
+import numpy as np
+from PIL import Image
+
+from pixelation import pixelate_image, pixelate_file_tiled
+from png_writer import PNGStripWriter
+from benchmarks.common import synthetic_image, best_time
+
+
+# (width, height, grid width, grid height, strip_pixels); grids larger than
+# the image are clamped to it, which leaves strips without output rows
+PARITY_CASES = [
+    (64, 48, 8, 6, 64 * 48),
+    (64, 48, 7, 5, 64),
+    (101, 37, 33, 17, 101 * 3),
+    (97, 41, 31, 62, 312),
+    (41, 97, 62, 31, 312),
+    (31, 17, 1, 1, 1),
+]
+PARITY_SCALES = [None, 1, 3]
+
+SIZES = [(1920, 1080), (4000, 3000)]
+GRIDS = [(64, 48), (400, 300)]
+
+
+def check_parity(folder: str) -> bool:
+    """Compare tiled and in-memory output; return True if all match."""
+    failures = 0
+    cases = 0
+    path = os.path.join(folder, 'tiled.png')
+    for (width, height, grid_width, grid_height, strip_pixels), method, mode, scale in itertools.product(
+        PARITY_CASES, ('nearest', 'spatial', 'average'), ('L', 'RGB', 'RGBA'), PARITY_SCALES
+    ):
+        image = synthetic_image(width, height, mode, seed=width + height, levels=4)
+        source = os.path.join(folder, f'source_{mode}.png')
+        image.save(source)
+        expected = np.asarray(pixelate_image(image, grid_width, grid_height, method, scale))
+        pixelate_file_tiled(source, path, grid_width, grid_height, method, scale, strip_pixels)
+        with Image.open(path) as written:
+            actual = np.asarray(written)
+        cases += 1
+        if not np.array_equal(expected, actual):
+            failures += 1
+            print(
+                f"MISMATCH {width}x{height} {mode} {method} grid {grid_width}x{grid_height} "
+                f"scale={scale} strip_pixels={strip_pixels}"
+            )
+    
+    # An empty strip is a no-op for the writer, whatever the row width
+    with PNGStripWriter(path, 3, 1, 'RGB') as writer:
+        writer.write_rows(np.empty((0, 0, 3), dtype=np.uint8))
+        writer.write_rows(np.zeros((1, 3, 3), dtype=np.uint8))
+    cases += 1
+    
+    print(f"parity: {cases - failures}/{cases} cases match")
+    return failures == 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--parity-only', action='store_true', help='Only run the parity checks')
+    parser.add_argument('--repeat', type=int, default=3, help='Timing repetitions (best is reported)')
+    args = parser.parse_args()
+    
+    folder = tempfile.mkdtemp()
+    try:
+        if not check_parity(folder):
+            raise SystemExit(1)
+        if args.parity_only:
+            return
+        
+        path = os.path.join(folder, 'tiled.png')
+        print(f"{'size':>11} {'grid':>9} {'in-memory s':>12} {'tiled s':>8} {'speedup':>8}")
+        for width, height in SIZES:
+            source = os.path.join(folder, f'{width}x{height}.png')
+            synthetic_image(width, height).save(source)
+            for grid_width, grid_height in GRIDS:
+                def in_memory():
+                    with Image.open(source) as image:
+                        pixelate_image(image, grid_width, grid_height).save(path)
+                
+                memory_time, _ = best_time(in_memory, args.repeat)
+                tiled_time, _ = best_time(
+                    lambda: pixelate_file_tiled(source, path, grid_width, grid_height), args.repeat
+                )
+                print(
+                    f"{width:>5}x{height:<5} {grid_width:>4}x{grid_height:<4} "
+                    f"{memory_time:>12.4f} {tiled_time:>8.4f} {memory_time / tiled_time:>7.1f}x"
+                )
+    finally:
+        shutil.rmtree(folder)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+Shared helpers for the backend benchmarks.
+"""
+
+import time
+from typing import Callable, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+
+def synthetic_image(
+    width: int,
+    height: int,
+    mode: str = 'RGB',
+    seed: int = 0,
+    levels: Optional[int] = None
+) -> Image.Image:
+    """
+    Generate a reproducible test image: smooth gradients plus noise.
+    
+    Args:
+        width: Image width in pixels
+        height: Image height in pixels
+        mode: 'L', 'RGB' or 'RGBA'
+        seed: Random seed for the noise
+        levels: If set, quantize each channel to this many levels so blocks
+            contain repeated colors (useful for majority-color methods)
+    
+    Returns:
+        PIL Image
+    """
+    rng = np.random.default_rng(seed)
+    channels = {'L': 1, 'RGB': 3, 'RGBA': 4}[mode]
+    
+    y = np.linspace(0, 1, height, dtype=np.float32)[:, np.newaxis]
+    x = np.linspace(0, 1, width, dtype=np.float32)[np.newaxis, :]
+    
+    planes = []
+    for channel in range(channels):
+        phase = channel * 0.7
+        plane = 0.5 + 0.25 * np.sin(6 * x + phase) + 0.25 * np.cos(4 * y - phase)
+        plane = plane * 255 + rng.normal(0, 12, (height, width)).astype(np.float32)
+        planes.append(plane)
+    
+    data = np.clip(np.stack(planes, axis=-1), 0, 255)
+    if levels:
+        step = 256 / levels
+        data = np.floor(data / step) * step
+    data = data.astype(np.uint8)
+    
+    if mode == 'L':
+        data = data[:, :, 0]
+    return Image.fromarray(data, mode)
+
+
+def best_time(fn: Callable[[], object], repeat: int = 3) -> Tuple[float, object]:
+    """Run fn repeat times and return (best seconds, last result)."""
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def synthetic_scene(width: int, height: int, seed: int = 0) -> Image.Image:
+    """
+    Generate a reproducible RGB scene for background removal: a light,
+    slightly noisy gradient background with a few solid foreground shapes
+    away from the corners.
+    """
+    import cv2  # Only needed for drawing the shapes
+    
+    rng = np.random.default_rng(seed)
+    y = np.linspace(0, 1, height, dtype=np.float32)[:, np.newaxis, np.newaxis]
+    x = np.linspace(0, 1, width, dtype=np.float32)[np.newaxis, :, np.newaxis]
+    background = 215 + 20 * x - 10 * y + rng.normal(0, 2, (height, width, 3)).astype(np.float32)
+    scene = np.clip(background, 0, 255).astype(np.uint8)
+    
+    unit = min(width, height)
+    for _ in range(4):
+        color = tuple(int(c) for c in rng.integers(0, 160, 3))
+        center = (int(width * rng.uniform(0.3, 0.7)), int(height * rng.uniform(0.3, 0.7)))
+        if rng.random() < 0.5:
+            cv2.circle(scene, center, int(unit * rng.uniform(0.08, 0.2)), color, -1)
+        else:
+            half = int(unit * rng.uniform(0.08, 0.2))
+            cv2.rectangle(scene, (center[0] - half, center[1] - half), (center[0] + half, center[1] + half), color, -1)
+    
+    return Image.fromarray(scene, 'RGB')
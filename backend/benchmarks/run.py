@@ -0,0 +1,230 @@
+"""
+Reproducible benchmark suite for the pixelation and background-removal engines.
+
+Runs pixelate_image (all three methods) and remove_background (exact and proxy
+masks) on synthetic images across sizes, modes and grid sizes, and records for
+every case the best time, throughput, peak traced memory and a checksum of the
+output. Results are written as JSON so runs from different commits can be
+compared. Peak memory comes from tracemalloc, which sees numpy and Python
+allocations but not Pillow's internal image buffers.
+
+Run from the backend directory:
+    python -m benchmarks.run [--quick] [--output results.json]
+    python -m benchmarks.run --compare baseline.json results.json
+"""
+
+import argparse
+import hashlib
+import itertools
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, Iterator, List
+
+import cv2
+import numpy as np
+import PIL
+from PIL import Image
+
+from pixelation import pixelate_image
+from background_removal import remove_background
+from benchmarks.common import synthetic_image, best_time
+
+
+# Image sizes in megapixels (4:3 aspect ratio)
+SIZES_MP = [0.3, 1, 4, 12, 24, 50]
+QUICK_SIZES_MP = [0.3, 1, 4]
+MODES = ['L', 'RGB', 'RGBA']
+GRIDS = [(32, 24), (320, 240)]
+METHODS = ['average', 'spatial', 'nearest']
+BG_THRESHOLD = 25.0
+BG_PROXY_SIZE = 512
+
+# Default slowdown ratio that fails --compare, ignored below an absolute
+# difference of MIN_REGRESSION_SECONDS (timer noise on tiny cases)
+MAX_SLOWDOWN = 1.25
+MIN_REGRESSION_SECONDS = 0.005
+
+
+def image_size(megapixels: float) -> tuple:
+    """(width, height) of a 4:3 image with about this many megapixels."""
+    height = int(round((megapixels * 1e6 * 3 / 4) ** 0.5))
+    return (height * 4 // 3, height)
+
+
+def checksum(image: Image.Image) -> str:
+    """Digest of an image's size, mode and pixel data."""
+    digest = hashlib.sha256(f'{image.mode} {image.size}'.encode())
+    digest.update(image.tobytes())
+    return digest.hexdigest()[:16]
+
+
+def traced_peak(fn: Callable[[], object]) -> tuple:
+    """Run fn once under tracemalloc; return (peak bytes, result)."""
+    tracemalloc.start()
+    try:
+        result = fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak, result
+
+
+def iter_cases(sizes_mp: List[float], modes: List[str], engines: List[str]) -> Iterator[Dict[str, Any]]:
+    """Describe every case to run, in a stable order."""
+    for megapixels, mode in itertools.product(sizes_mp, modes):
+        width, height = image_size(megapixels)
+        base = {'width': width, 'height': height, 'mode': mode}
+        for engine in engines:
+            if engine in METHODS:
+                for grid_width, grid_height in GRIDS:
+                    yield {
+                        **base, 'engine': 'pixelate', 'method': engine,
+                        'grid_width': grid_width, 'grid_height': grid_height
+                    }
+            else:  # 'exact' or 'proxy' background removal
+                yield {**base, 'engine': 'remove_background', 'method': engine}
+
+
+def case_id(case: Dict[str, Any]) -> str:
+    """Stable identifier used to match cases across result files."""
+    parts = [case['engine'], case['method'], case['mode'], f"{case['width']}x{case['height']}"]
+    if case['engine'] == 'pixelate':
+        parts.append(f"grid{case['grid_width']}x{case['grid_height']}")
+    return '/'.join(parts)
+
+
+def case_function(case: Dict[str, Any], image: Image.Image) -> Callable[[], Image.Image]:
+    if case['engine'] == 'pixelate':
+        return lambda: pixelate_image(image, case['grid_width'], case['grid_height'], case['method'])
+    proxy_size = BG_PROXY_SIZE if case['method'] == 'proxy' else None
+    return lambda: remove_background(image, BG_THRESHOLD, proxy_size=proxy_size)
+
+
+def run_suite(sizes_mp: List[float], modes: List[str], engines: List[str], repeat: int) -> Dict[str, Any]:
+    """Run the selected cases and return the JSON-serializable report."""
+    results = []
+    images = {}
+    for case in iter_cases(sizes_mp, modes, engines):
+        key = (case['width'], case['height'], case['mode'])
+        if key not in images:
+            images.clear()  # Keep one source image alive at a time
+            images[key] = synthetic_image(case['width'], case['height'], case['mode'], seed=case['width'])
+        fn = case_function(case, images[key])
+        
+        seconds, _ = best_time(fn, repeat)
+        peak, output = traced_peak(fn)
+        megapixels = case['width'] * case['height'] / 1e6
+        result = {
+            'id': case_id(case),
+            **case,
+            'seconds': round(seconds, 6),
+            'megapixels_per_second': round(megapixels / seconds, 3),
+            'peak_traced_mb': round(peak / (1024 * 1024), 2),
+            'checksum': checksum(output)
+        }
+        results.append(result)
+        print(
+            f"{result['id']:<55} {seconds:>9.4f}s {result['megapixels_per_second']:>9.1f} MP/s "
+            f"{result['peak_traced_mb']:>8.1f} MB  {result['checksum']}",
+            file=sys.stderr
+        )
+    
+    return {'environment': environment(), 'repeat': repeat, 'results': results}
+
+
+def environment() -> Dict[str, Any]:
+    """Versions and machine details recorded with every run."""
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pillow': PIL.__version__,
+        'opencv': cv2.__version__,
+        'machine': platform.machine(),
+        'processor': platform.processor() or None
+    }
+
+
+def compare(baseline_path: str, current_path: str, max_slowdown: float) -> bool:
+    """
+    Print per-case speed ratios and checksum changes between two result files.
+    
+    Returns True when no case changed its output or slowed down by more than
+    max_slowdown.
+    """
+    with open(baseline_path) as f:
+        baseline = {result['id']: result for result in json.load(f)['results']}
+    with open(current_path) as f:
+        current = {result['id']: result for result in json.load(f)['results']}
+    
+    ok = True
+    print(f"{'case':<55} {'before s':>9} {'after s':>9} {'ratio':>7}  output")
+    for case in sorted(baseline.keys() & current.keys()):
+        before, after = baseline[case], current[case]
+        ratio = after['seconds'] / before['seconds'] if before['seconds'] else float('inf')
+        same = before['checksum'] == after['checksum']
+        flag = ''
+        if ratio > max_slowdown and after['seconds'] - before['seconds'] > MIN_REGRESSION_SECONDS:
+            flag = '  SLOWER'
+            ok = False
+        if not same:
+            ok = False
+        print(
+            f"{case:<55} {before['seconds']:>9.4f} {after['seconds']:>9.4f} {ratio:>6.2f}x  "
+            f"{'same' if same else 'CHANGED'}{flag}"
+        )
+    
+    for case in sorted(baseline.keys() - current.keys()):
+        print(f"{case:<55} missing from {current_path}")
+    for case in sorted(current.keys() - baseline.keys()):
+        print(f"{case:<55} new in {current_path}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--quick', action='store_true', help=f'Only sizes up to {QUICK_SIZES_MP[-1]}MP')
+    parser.add_argument('--sizes', type=float, nargs='+', help='Image sizes in megapixels')
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=MODES)
+    parser.add_argument(
+        '--engines', nargs='+', choices=METHODS + ['exact', 'proxy'], default=METHODS + ['exact', 'proxy'],
+        help='Pixelation methods and background-removal masks to run'
+    )
+    parser.add_argument('--repeat', type=int, default=3, help='Timing repetitions (best is reported)')
+    parser.add_argument('--output', '-o', help='Write JSON results here instead of stdout')
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CURRENT'), help='Compare two result files')
+    parser.add_argument(
+        '--max-slowdown', type=float, default=MAX_SLOWDOWN,
+        help='Time ratio above which --compare reports a regression'
+    )
+    args = parser.parse_args()
+    
+    if args.compare:
+        if not compare(args.compare[0], args.compare[1], args.max_slowdown):
+            raise SystemExit(1)
+        return
+    
+    sizes = args.sizes or (QUICK_SIZES_MP if args.quick else SIZES_MP)
+    report = run_suite(sizes, args.modes, args.engines, args.repeat)
+    
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,585 @@
+"""
+Caches for processed results and for decoded uploads, their preview
+pyramids and summed-area tables.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from metrics import timed
+from pixelation import integral_image
+from utils import array_mode, cleanup_file, hash_file, working_mode
+
+
+# Hidden folder inside the upload folder for load_raw()'s files (counted
+# toward the upload quota by the upload store)
+RAW_FOLDER = '.decoded'
+
+
+class ResultCache:
+    """
+    LRU cache of processed results, keyed by content rather than filename.
+    
+    Keys combine the upload's content hash with the operation chain and its
+    parameters, so the same upload processed with the same settings maps to
+    the same file in the processed folder. Entries are evicted least recently
+    used first once either the entry count or the total size of the cached
+    files on disk exceeds its limit, or by expire() once they have not been
+    used for a while; evicted files are deleted.
+    
+    Files already in the folder when the cache is created (results from a
+    previous run, which clients may still download) are adopted once as
+    keyless entries, oldest first, so they count against the limits too.
+    
+    Files can be pinned on behalf of an owner (a batch job), so results a
+    client has not downloaded yet are never evicted or expired; pinned
+    files still count against the limits, and unpin() releases all of an
+    owner's pins at once.
+    """
+    
+    # Memoized upload hashes kept at most (least recently used dropped first)
+    MAX_SOURCE_HASHES = 4096
+    
+    def __init__(self, folder: str, max_entries: int = 512, max_bytes: int = 512 * 1024 * 1024):
+        self.folder = folder
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: 'OrderedDict[str, Tuple[Dict[str, Any], int, float]]' = OrderedDict()
+        self._keys_by_file: Dict[str, str] = {}
+        self._total_bytes = 0
+        self._source_hashes: 'OrderedDict[Tuple[str, int, int], str]' = OrderedDict()
+        # owner -> pinned filenames, and filename -> pins held on it
+        self._pins: Dict[str, List[str]] = {}
+        self._pin_counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._adopt_existing()
+    
+    def source_hash(self, filepath: str) -> str:
+        """Content hash of an upload, memoized by path, mtime and size."""
+        stat = os.stat(filepath)
+        stamp = (os.path.abspath(filepath), stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            digest = self._source_hashes.get(stamp)
+            if digest is not None:
+                self._source_hashes.move_to_end(stamp)
+        if digest is None:
+            digest = hash_file(filepath)
+            with self._lock:
+                self._remember(stamp, digest)
+        return digest
+    
+    def remember_hash(self, filepath: str, digest: str) -> None:
+        """Record a content hash computed elsewhere (e.g. while the upload was stored)."""
+        stat = os.stat(filepath)
+        stamp = (os.path.abspath(filepath), stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            self._remember(stamp, digest)
+    
+    def forget_source(self, filepath: str) -> None:
+        """Drop the memoized hashes of an upload, e.g. after it is deleted."""
+        path = os.path.abspath(filepath)
+        with self._lock:
+            for stamp in [stamp for stamp in self._source_hashes if stamp[0] == path]:
+                del self._source_hashes[stamp]
+    
+    def _remember(self, stamp: Tuple[str, int, int], digest: str) -> None:
+        """Memoize a hash, dropping the least recently used past the limit (lock held)."""
+        self._source_hashes[stamp] = digest
+        self._source_hashes.move_to_end(stamp)
+        while len(self._source_hashes) > self.MAX_SOURCE_HASHES:
+            self._source_hashes.popitem(last=False)
+    
+    @staticmethod
+    def make_key(source_hash: str, operations: Any) -> str:
+        """Build a cache key from a source hash and a JSON-serializable operation chain."""
+        payload = json.dumps([source_hash, operations], sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+    
+    def get(self, key: str, owner: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Look up a cached result, pinning its file for owner on a hit.
+        
+        Returns the stored response fields (including 'processed_filename'),
+        or None on a miss or when the file has disappeared from disk.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                result, size, _ = entry
+                if os.path.exists(os.path.join(self.folder, result['processed_filename'])):
+                    self._entries[key] = (result, size, time.time())
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    if owner is not None:
+                        self._pin(owner, result['processed_filename'])
+                    return dict(result)
+                # File was removed behind our back; forget it
+                self._drop(key)
+            self.misses += 1
+            return None
+    
+    def touch_file(self, filename: str) -> None:
+        """Mark the entry owning a processed file as recently used (e.g. on download)."""
+        with self._lock:
+            key = self._keys_by_file.get(filename)
+            if key is not None:
+                result, size, _ = self._entries[key]
+                self._entries[key] = (result, size, time.time())
+                self._entries.move_to_end(key)
+    
+    def put(self, key: str, result: Dict[str, Any], owner: Optional[str] = None) -> None:
+        """
+        Store the response fields for a result already written to the
+        folder, pinning its file for owner if given.
+        """
+        filepath = os.path.join(self.folder, result['processed_filename'])
+        size = os.path.getsize(filepath)
+        with self._lock:
+            self._add(key, dict(result), size, time.time())
+            if owner is not None:
+                self._pin(owner, result['processed_filename'])
+            self._evict()
+    
+    def unpin(self, owner: str) -> None:
+        """Release every pin an owner holds; evict down to the limits again."""
+        with self._lock:
+            for filename in self._pins.pop(owner, []):
+                count = self._pin_counts[filename] - 1
+                if count > 0:
+                    self._pin_counts[filename] = count
+                else:
+                    del self._pin_counts[filename]
+            self._evict()
+    
+    def expire(self, ttl: float) -> int:
+        """Evict unpinned entries not used for ttl seconds; returns how many were removed."""
+        cutoff = time.time() - ttl
+        removed = 0
+        with self._lock:
+            # Entries are in use order, so stop at the first recent one
+            for key, (result, _, last_used) in list(self._entries.items()):
+                if last_used > cutoff:
+                    break
+                if result['processed_filename'] not in self._pin_counts:
+                    self._evict_entry(key)
+                    removed += 1
+        return removed
+    
+    def _pin(self, owner: str, filename: str) -> None:
+        """Pin a file for an owner (lock held)."""
+        self._pins.setdefault(owner, []).append(filename)
+        self._pin_counts[filename] = self._pin_counts.get(filename, 0) + 1
+    
+    def _add(self, key: str, result: Dict[str, Any], size: int, last_used: float) -> None:
+        """Insert or replace an entry as the most recently used (lock held)."""
+        if key in self._entries:
+            self._drop(key)
+        self._entries[key] = (result, size, last_used)
+        self._keys_by_file[result['processed_filename']] = key
+        self._total_bytes += size
+    
+    def _drop(self, key: str) -> Dict[str, Any]:
+        """Forget an entry without touching its file (lock held)."""
+        result, size, _ = self._entries.pop(key)
+        self._total_bytes -= size
+        if self._keys_by_file.get(result['processed_filename']) == key:
+            del self._keys_by_file[result['processed_filename']]
+        return result
+    
+    def _evict_entry(self, key: str) -> None:
+        """Forget an entry and delete its file (lock held)."""
+        result = self._drop(key)
+        self.evictions += 1
+        # Another entry may still point at the same file
+        if result['processed_filename'] not in self._keys_by_file:
+            cleanup_file(os.path.join(self.folder, result['processed_filename']))
+    
+    def _evict(self) -> None:
+        """Drop least recently used unpinned entries until both limits hold (lock held)."""
+        def within_limits():
+            return len(self._entries) <= self.max_entries and self._total_bytes <= self.max_bytes
+        
+        if within_limits():
+            return
+        for key, (result, _, _) in list(self._entries.items()):
+            if within_limits():
+                break
+            if result['processed_filename'] not in self._pin_counts:
+                self._evict_entry(key)
+    
+    def _adopt_existing(self) -> None:
+        """Track files left in the folder by a previous run, oldest first."""
+        files = []
+        if os.path.isdir(self.folder):
+            with os.scandir(self.folder) as entries:
+                for entry in entries:
+                    if entry.is_file() and not entry.name.startswith('.'):
+                        stat = entry.stat()
+                        files.append((stat.st_mtime, entry.name, stat.st_size))
+        
+        with self._lock:
+            # Not evicted here: processes that merely import the app (spawned
+            # pool workers) must not delete files; the next put() trims
+            for mtime, filename, size in sorted(files):
+                self._add(f'file:{filename}', {'processed_filename': filename}, size, mtime)
+    
+    def stats(self) -> Dict[str, int]:
+        """Counters for the health endpoint."""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self._total_bytes,
+                'pinned': len(self._pin_counts)
+            }
+
+
+class DecodedImageCache:
+    """
+    Memory-bounded LRU cache of decoded uploads.
+    
+    Each upload is decoded once and kept as a read-only numpy array, so
+    repeated operations on the same file skip JPEG/PNG decoding. Memory is
+    accounted by array size in bytes and least recently used arrays are
+    dropped first. Entries are tied to the file's mtime and size, and
+    invalidate() removes a file explicitly when it is deleted.
+    
+    With raw=True, uploads are decoded through load_raw() instead: the
+    cache holds memory maps of raw files that every process shares, so a
+    miss in one process reuses pixels another has already decoded, and
+    memory is charged once in the OS page cache rather than per process.
+    """
+    
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024, raw: bool = False):
+        self.max_bytes = max_bytes
+        self.raw = raw
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: 'OrderedDict[str, Tuple[Tuple[int, int], np.ndarray, str]]' = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+    
+    def open(self, filepath: str) -> Image.Image:
+        """Return the decoded upload as a PIL Image, decoding only on a miss."""
+        array, mode = self.load_array(filepath)
+        return Image.fromarray(array, mode)
+    
+    def load_array(self, filepath: str) -> Tuple[np.ndarray, str]:
+        """Return the decoded upload as a read-only (array, mode) pair."""
+        key = os.path.abspath(filepath)
+        stat = os.stat(filepath)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == stamp:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1], entry[2]
+            self.misses += 1
+        
+        # Decode outside the lock so other uploads are not blocked
+        if self.raw:
+            array, mode = load_raw(filepath)
+        else:
+            array, mode = decode_image(filepath)
+            array.setflags(write=False)
+        
+        with self._lock:
+            self._discard(key)
+            if array.nbytes <= self.max_bytes:
+                self._entries[key] = (stamp, array, mode)
+                self._total_bytes += array.nbytes
+                while self._total_bytes > self.max_bytes:
+                    _, (_, evicted, _) = self._entries.popitem(last=False)
+                    self._total_bytes -= evicted.nbytes
+                    self.evictions += 1
+        return array, mode
+    
+    def invalidate(self, filepath: str) -> None:
+        """Forget a decoded upload (and its raw file), e.g. after the file is deleted."""
+        with self._lock:
+            self._discard(os.path.abspath(filepath))
+        # Also when raw is off: a run with PXL8_RAW_DECODED=1 may have written it
+        cleanup_file(raw_path(filepath))
+    
+    def _discard(self, key: str) -> None:
+        """Remove an entry if present (lock held)."""
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._total_bytes -= entry[1].nbytes
+    
+    def stats(self) -> Dict[str, int]:
+        """Counters for the health endpoint."""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self._total_bytes
+            }
+
+
+class PyramidCache:
+    """
+    Memory-bounded LRU cache of reduced copies of decoded uploads.
+    
+    Each upload gets a pyramid of successive 2x area reductions of its
+    decoded pixels, built once, so previews of any grid can start from the
+    smallest copy that still has enough pixels per block instead of the
+    full-resolution image. The full-resolution image stays in the
+    DecodedImageCache; the reduced levels add about a third of its size.
+    Entries are tied to the file's mtime and size like the decoded cache's.
+    """
+    
+    # Reductions stop once the shorter side would fall below this
+    MIN_LEVEL_SIZE = 16
+    
+    def __init__(self, decoded: DecodedImageCache, max_bytes: int = 128 * 1024 * 1024):
+        self.decoded = decoded
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # path -> (file stamp, (size, levels, mode), bytes)
+        self._entries: 'OrderedDict[str, Tuple[Tuple[int, int], tuple, int]]' = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+    
+    def levels(self, filepath: str) -> Tuple[Tuple[int, int], List[np.ndarray], str]:
+        """
+        Reduced copies of an upload, building them on a miss.
+        
+        Hits never touch the full-resolution image, so callers that can work
+        from a reduced level skip decoding entirely; load it from the
+        decoded cache when none is large enough.
+        
+        Returns:
+            (size, levels, mode): the upload's (width, height), read-only
+            arrays from the largest reduction down, and the decoded image mode
+        """
+        key = os.path.abspath(filepath)
+        stat = os.stat(filepath)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == stamp:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        
+        # Build outside the lock so other uploads are not blocked
+        array, mode = self.decoded.load_array(filepath)
+        size = (array.shape[1], array.shape[0])
+        levels = []
+        with timed('pyramid', mode, size):
+            while min(array.shape[:2]) // 2 >= self.MIN_LEVEL_SIZE:
+                height, width = array.shape[:2]
+                array = cv2.resize(array, (width // 2, height // 2), interpolation=cv2.INTER_AREA)
+                array.setflags(write=False)
+                levels.append(array)
+        pyramid = (size, levels, mode)
+        nbytes = sum(level.nbytes for level in levels)
+        
+        with self._lock:
+            self._discard(key)
+            if nbytes <= self.max_bytes:
+                self._entries[key] = (stamp, pyramid, nbytes)
+                self._total_bytes += nbytes
+                while self._total_bytes > self.max_bytes:
+                    _, (_, _, evicted) = self._entries.popitem(last=False)
+                    self._total_bytes -= evicted
+                    self.evictions += 1
+        return pyramid
+    
+    def invalidate(self, filepath: str) -> None:
+        """Forget an upload's pyramid, e.g. after the file is deleted."""
+        with self._lock:
+            self._discard(os.path.abspath(filepath))
+    
+    def _discard(self, key: str) -> None:
+        """Remove an entry if present (lock held)."""
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._total_bytes -= entry[2]
+    
+    def stats(self) -> Dict[str, int]:
+        """Counters for the health endpoint."""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self._total_bytes
+            }
+
+
+class IntegralImageStore:
+    """
+    Summed-area tables of uploads, saved as .npy files beside them.
+    
+    A table is built from the decoded upload the first time it is needed
+    and memory-mapped afterwards, so 'average' pixelation at any grid size
+    reads only the grid's block corners instead of every source pixel (see
+    pixelation.average_from_integral). Tables live in a hidden folder inside
+    the upload folder, which the upload store counts towards its quota as
+    a derived folder; uploads are content-addressed and never change in
+    place, so a table stays valid until invalidate() deletes it with its
+    upload.
+    """
+    
+    FOLDER = '.integral'
+    
+    def __init__(self, decoded: DecodedImageCache):
+        self.decoded = decoded
+        self.hits = 0
+        self.builds = 0
+        # Table path -> (lock, waiting requests), so builds of different
+        # uploads run in parallel while one upload's table is built once
+        self._path_locks: Dict[str, Tuple[threading.Lock, int]] = {}
+        self._lock = threading.Lock()
+    
+    def path(self, filepath: str) -> str:
+        """Where an upload's table is stored."""
+        folder, filename = os.path.split(filepath)
+        return os.path.join(folder, self.FOLDER, f'{filename}.npy')
+    
+    def get(self, filepath: str) -> np.ndarray:
+        """
+        Return an upload's table as a read-only memory map, building it on
+        first use. The image mode follows from its shape: 2 dimensions for
+        L, 3 or 4 channels for RGB or RGBA.
+        """
+        path = self.path(filepath)
+        with self._locked(path):
+            built = not os.path.exists(path)
+            if built:
+                self._build(filepath, path)
+        with self._lock:
+            if built:
+                self.builds += 1
+            else:
+                self.hits += 1
+        return np.load(path, mmap_mode='r')
+    
+    @contextmanager
+    def _locked(self, path: str) -> Iterator[None]:
+        """Hold the lock of one table path, dropping it once nobody waits."""
+        with self._lock:
+            lock, users = self._path_locks.get(path, (threading.Lock(), 0))
+            self._path_locks[path] = (lock, users + 1)
+        try:
+            with lock:
+                yield
+        finally:
+            with self._lock:
+                users = self._path_locks[path][1] - 1
+                if users:
+                    self._path_locks[path] = (lock, users)
+                else:
+                    del self._path_locks[path]
+    
+    def _build(self, filepath: str, path: str) -> None:
+        """
+        Write a table to a partial file and rename it into place (path lock
+        held). The partial name is unique per process and thread, so other
+        processes building the same table never write into one file.
+        """
+        pixels, _ = self.decoded.load_array(filepath)
+        height, width = pixels.shape[:2]
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        partial_path = f'{path}.{os.getpid()}.{threading.get_ident()}.part'
+        try:
+            table = np.lib.format.open_memmap(
+                partial_path, mode='w+', dtype=np.int64,
+                shape=(height + 1, width + 1) + pixels.shape[2:]
+            )
+            integral_image(pixels, out=table)
+            table.flush()
+            del table
+            os.replace(partial_path, path)
+        finally:
+            cleanup_file(partial_path)
+    
+    def invalidate(self, filepath: str) -> None:
+        """Delete an upload's table, e.g. after the upload is deleted."""
+        cleanup_file(self.path(filepath))
+    
+    def stats(self) -> Dict[str, int]:
+        """Counters for the health endpoint."""
+        with self._lock:
+            return {'hits': self.hits, 'builds': self.builds}
+
+
+def raw_path(filepath: str) -> str:
+    """Where load_raw() keeps an upload's decoded pixels."""
+    folder, filename = os.path.split(filepath)
+    return os.path.join(folder, RAW_FOLDER, f'{filename}.npy')
+
+
+def load_raw(filepath: str) -> Tuple[np.ndarray, str]:
+    """
+    Memory-map an upload's decoded pixels, decoding them on first use.
+    
+    The pixels are saved uncompressed as a .npy file in a hidden folder
+    beside the upload and mapped read-only, so any number of processes
+    share one copy through the OS page cache. The file is written under a
+    per-process name and renamed into place, so processes decoding the
+    same upload at once never see a partial file. A raw file older than
+    its upload is decoded again.
+    
+    Returns:
+        (array, mode) with mode L, RGB or RGBA, as from decode_image()
+    """
+    path = raw_path(filepath)
+    try:
+        if os.stat(path).st_mtime_ns >= os.stat(filepath).st_mtime_ns:
+            array = np.load(path, mmap_mode='r')
+            return array, array_mode(array)
+    except (OSError, ValueError):
+        pass  # Missing, stale or unreadable: decode it again
+    
+    array, mode = decode_image(filepath)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    partial_path = f'{path}.{os.getpid()}.{threading.get_ident()}.part'
+    try:
+        with open(partial_path, 'wb') as f:
+            np.save(f, np.ascontiguousarray(array))
+        os.replace(partial_path, path)
+    finally:
+        cleanup_file(partial_path)
+    return np.load(path, mmap_mode='r'), mode
+
+
+def decode_image(filepath: str) -> Tuple[np.ndarray, str]:
+    """
+    Fully decode an image file into a numpy array.
+    
+    Modes numpy cannot round-trip cleanly (palette, 1-bit, CMYK, ...) are
+    converted to L, RGB or RGBA first (see utils.working_mode).
+    """
+    with Image.open(filepath) as image, timed('decode', image.format or '', image.size):
+        mode = working_mode(image)
+        if image.mode != mode:
+            image = image.convert(mode)
+        return np.asarray(image), mode
@@ -0,0 +1,90 @@
+"""
+Output encoding: format selection, exact palette PNGs and compression settings.
+"""
+
+import os
+from PIL import Image
+import numpy as np
+from typing import Optional
+
+from metrics import timed
+
+
+# Output formats clients may request, by request value
+OUTPUT_FORMATS = {'png': 'PNG', 'webp': 'WEBP'}
+
+# zlib level for PNG output (Pillow's default is 6; lower is faster, 9 smallest)
+PNG_COMPRESS_LEVEL = int(os.environ.get('PXL8_PNG_COMPRESS_LEVEL', 6))
+
+# Largest width or height a WebP image can have
+WEBP_MAX_SIZE = 16383
+
+
+def palette_image(image: Image.Image) -> Optional[Image.Image]:
+    """
+    Convert an RGB or RGBA image with at most 256 colors to palette mode.
+    
+    The conversion is exact: every pixel keeps its color (and alpha, stored
+    as the palette's transparency), so the PNG decodes to the same pixels.
+    
+    Returns:
+        P-mode PIL Image, or None if the image has more than 256 colors or
+        is in another mode
+    """
+    if image.mode not in ('RGB', 'RGBA'):
+        return None
+    colors = image.getcolors(256)
+    if colors is None:
+        return None
+    
+    with timed('palette', image.mode, image.size):
+        # Index pixels by their packed RGBA value; Pillow's own palette
+        # mapping (quantize) can merge nearby colors
+        rgba = image if image.mode == 'RGBA' else image.convert('RGBA')
+        packed = np.ascontiguousarray(np.asarray(rgba)).view('<u4')[:, :, 0]
+        opaque = (255,) if image.mode == 'RGB' else ()
+        keys = np.unique(np.array([color + opaque for _, color in colors], dtype=np.uint8).view('<u4'))
+        indices = np.searchsorted(keys, packed).astype(np.uint8)
+        
+        entries = keys.view(np.uint8).reshape(-1, 4)
+        result = Image.fromarray(indices, 'P')
+        result.putpalette(entries[:, :3].tobytes())
+        if image.mode == 'RGBA':
+            result.info['transparency'] = entries[:, 3].tobytes()
+        return result
+
+
+def save_image(
+    image: Image.Image,
+    path: str,
+    image_format: str,
+    palette: bool = False,
+    compress_level: Optional[int] = None
+) -> None:
+    """
+    Encode an image to a file.
+    
+    Args:
+        image: PIL Image to save
+        path: Output file path
+        image_format: Pillow format name ('PNG', 'WEBP', 'JPEG', ...)
+        palette: For PNG, write an indexed-color file when the image has at
+            most 256 colors (pixel art usually does)
+        compress_level: 0-9, for PNG the zlib level and for WebP (always
+            lossless) the encoder effort; None uses PNG_COMPRESS_LEVEL
+    """
+    level = PNG_COMPRESS_LEVEL if compress_level is None else compress_level
+    options = {}
+    if image_format == 'PNG':
+        if palette:
+            image = palette_image(image) or image
+        options['compress_level'] = level
+    elif image_format == 'WEBP':
+        if max(image.size) > WEBP_MAX_SIZE:
+            raise ValueError(f'WebP output is limited to {WEBP_MAX_SIZE} pixels per side')
+        # Effort scales with the level up to Pillow's defaults (quality 80,
+        # method 4); higher methods cost far more for a few percent
+        options.update(lossless=True, quality=round(level * 80 / 9), method=round(level * 4 / 9))
+    
+    with timed('encode', image_format, image.size):
+        image.save(path, image_format, **options)
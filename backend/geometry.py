@@ -0,0 +1,122 @@
+"""
+Geometric operations: crop, quarter-turn rotation and crunch (72dpi normalization).
+Mirrors the canvas helpers in frontend/src/utils/image-manipulation.js.
+"""
+
+from PIL import Image
+from typing import Optional, Tuple
+
+from metrics import timed
+
+
+# Centered crop aspect ratios (width / height) the frontend offers
+CROP_ASPECT_RATIOS = {'1:1': 1.0, '3:2': 3 / 2, '4:3': 4 / 3}
+
+# Crunch assumes a 96dpi source and scales it to 72dpi
+CRUNCH_FACTOR = 72 / 96
+MAX_CRUNCH = 2
+
+ROTATIONS = {
+    90: Image.Transpose.ROTATE_270,  # Pillow rotates counterclockwise
+    180: Image.Transpose.ROTATE_180,
+    270: Image.Transpose.ROTATE_90
+}
+
+
+def crop_box(
+    size: Tuple[int, int],
+    aspect_ratio: Optional[str] = None,
+    box: Optional[Tuple[int, int, int, int]] = None
+) -> Tuple[int, int, int, int]:
+    """
+    Resolve a crop to a (left, top, right, bottom) box inside an image.
+    
+    Args:
+        size: (width, height) of the image being cropped
+        aspect_ratio: '1:1', '3:2' or '4:3' for the largest centered crop
+        box: (x, y, width, height) in image pixels; clipped to the image
+    
+    Returns:
+        Pixel box for Image.crop()
+    
+    Raises:
+        ValueError: Unknown aspect ratio, or a box outside the image
+    """
+    width, height = size
+    if box is not None:
+        x, y, crop_width, crop_height = box
+        left, top = max(0, x), max(0, y)
+        right, bottom = min(width, x + crop_width), min(height, y + crop_height)
+        if right <= left or bottom <= top:
+            raise ValueError(f'Crop box lies outside the {width}x{height} image')
+        return (left, top, right, bottom)
+    
+    if aspect_ratio not in CROP_ASPECT_RATIOS:
+        raise ValueError(f'Invalid aspect ratio: {aspect_ratio}')
+    target_ratio = CROP_ASPECT_RATIOS[aspect_ratio]
+    
+    if width / height > target_ratio:
+        # Wider than the target: keep the full height (sizes truncate like a canvas's)
+        crop_width = max(1, int(height * target_ratio))
+        left = (width - crop_width) // 2
+        return (left, 0, left + crop_width, height)
+    crop_height = max(1, int(width / target_ratio))
+    top = (height - crop_height) // 2
+    return (0, top, width, top + crop_height)
+
+
+def crop_image(
+    image: Image.Image,
+    aspect_ratio: Optional[str] = None,
+    box: Optional[Tuple[int, int, int, int]] = None
+) -> Image.Image:
+    """Crop to a centered aspect ratio or an explicit box (see crop_box)."""
+    bounds = crop_box(image.size, aspect_ratio, box)
+    with timed('crop', aspect_ratio or 'box', image.size):
+        return image.crop(bounds)
+
+
+def rotate_image(image: Image.Image, degrees: int) -> Image.Image:
+    """
+    Rotate clockwise by a multiple of 90 degrees.
+    
+    Quarter turns are lossless transposes, so no resampling happens.
+    """
+    degrees %= 360
+    if degrees == 0:
+        return image
+    if degrees not in ROTATIONS:
+        raise ValueError('Rotation must be a multiple of 90 degrees')
+    with timed('rotate', str(degrees), image.size):
+        return image.transpose(ROTATIONS[degrees])
+
+
+def crunch_size(size: Tuple[int, int], count: int = 1) -> Tuple[int, int]:
+    """Size after crunching count times, rounding at every step like the frontend."""
+    width, height = size
+    for _ in range(count):
+        # Math.round: halves round up
+        width = max(1, int(width * CRUNCH_FACTOR + 0.5))
+        height = max(1, int(height * CRUNCH_FACTOR + 0.5))
+    return (width, height)
+
+
+def crunch_image(image: Image.Image, count: int = 1) -> Image.Image:
+    """
+    Normalize an image to 72dpi count times (normalizeTo72dpi on the frontend).
+    
+    Repeated crunches are done as one resample straight to the final size
+    instead of one per step, with the same output dimensions.
+    
+    Args:
+        image: PIL Image object
+        count: Number of crunches (0 returns the image unchanged)
+    
+    Returns:
+        Resized PIL Image
+    """
+    if count == 0:
+        return image
+    target_size = crunch_size(image.size, count)
+    with timed('crunch', str(count), image.size):
+        return image.resize(target_size, Image.Resampling.LANCZOS)
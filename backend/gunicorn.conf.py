@@ -0,0 +1,54 @@
+"""
+Gunicorn configuration for production serving.
+
+Run from the backend directory:
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Settings come from the environment:
+    PXL8_BIND           Address to listen on (default 0.0.0.0:$PORT, or port 5000)
+    PXL8_WEB_WORKERS    Ignored beyond 1, with a warning (as is WEB_CONCURRENCY)
+    PXL8_WEB_THREADS    Threads in the worker (default: two per CPU, 4 to 32),
+                        so job polls with ?wait and streamed downloads do not
+                        hold up other requests
+    PXL8_WEB_TIMEOUT    Seconds a request may run before the worker is
+                        restarted (default 120; full-resolution renders of
+                        large images can take several seconds)
+
+Jobs, upload references and pins, and the janitor live in the worker's
+memory, so a second worker would answer job polls for jobs it does not
+know with 404 and could delete uploads the other one is using. Running
+several workers is out of scope: the server always starts one and scales
+with threads (and the batch process pool) instead.
+"""
+
+import os
+
+# Heavy imports happen once here in the master process; the worker forks
+# after them, so it starts faster and a restarted worker skips them. The app
+# itself (stores, caches, janitor, job pool) is created in the worker.
+import cv2  # noqa: F401
+import numpy  # noqa: F401
+import PIL.Image  # noqa: F401
+import processing  # noqa: F401
+
+bind = os.environ.get('PXL8_BIND', f"0.0.0.0:{os.environ.get('PORT', 5000)}")
+
+# Set explicitly, since Gunicorn would otherwise take WEB_CONCURRENCY
+workers = 1
+requested_workers = os.environ.get('PXL8_WEB_WORKERS') or os.environ.get('WEB_CONCURRENCY')
+worker_class = 'gthread'
+threads = int(os.environ.get('PXL8_WEB_THREADS', 0)) or min(max(2 * (os.cpu_count() or 1), 4), 32)
+timeout = int(os.environ.get('PXL8_WEB_TIMEOUT', 120))
+graceful_timeout = 30
+keepalive = 5
+
+accesslog = '-'
+
+
+def on_starting(server):
+    """Warn when more workers were asked for than the single one started."""
+    if requested_workers and requested_workers.strip() != '1':
+        server.log.warning(
+            'Starting 1 worker instead of %s: jobs and upload references are kept per process',
+            requested_workers
+        )
@@ -0,0 +1,50 @@
+"""
+Background thread that runs periodic cleanup tasks.
+"""
+
+import logging
+import threading
+from typing import Callable, List, Optional
+
+
+logger = logging.getLogger(__name__)
+
+
+class Janitor:
+    """
+    Runs cleanup tasks every interval seconds on a daemon thread.
+    
+    Tasks are plain callables run in order; a failing task is logged and
+    does not stop the others or later runs.
+    """
+    
+    def __init__(self, interval: float, tasks: List[Callable[[], object]]):
+        self.interval = interval
+        self.tasks = tasks
+        self.runs = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+    
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name='pxl8-janitor', daemon=True)
+            self._thread.start()
+    
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+    
+    def run_once(self) -> None:
+        """Run every task once."""
+        for task in self.tasks:
+            try:
+                task()
+            except Exception:
+                logger.exception('Cleanup task %r failed', task)
+        self.runs += 1
+    
+    def _loop(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.run_once()
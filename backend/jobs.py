@@ -0,0 +1,264 @@
+"""
+Background processing jobs run on a process pool.
+"""
+
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from processing import process_upload
+
+
+class QueueFull(Exception):
+    """Raised when a job would push the queue past its depth limit."""
+
+
+class BatchTooLarge(Exception):
+    """Raised when a job has more uncached images than the queue can ever hold."""
+
+
+class BatchJob:
+    """
+    A set of uploads processed with one shared operation chain.
+    
+    Each item tracks its own status: 'queued', 'processing', 'done' or
+    'failed'. Items are updated from pool callbacks, so reads go through
+    to_dict(), which takes the job lock. Single /api/process jobs are
+    batches of one.
+    """
+    
+    def __init__(self, filenames: List[str], operations: List[list], job_id: Optional[str] = None):
+        self.id = job_id or uuid.uuid4().hex
+        self.operations = operations
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.items: List[Dict[str, Any]] = [
+            {'filename': filename, 'status': 'queued'} for filename in filenames
+        ]
+        self._futures: Dict[int, Future] = {}
+        self._lock = threading.Lock()
+        self._finished = threading.Condition(self._lock)
+    
+    @property
+    def done(self) -> bool:
+        with self._lock:
+            return self.finished_at is not None
+    
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Block until every item has finished or timeout seconds pass; return done."""
+        with self._finished:
+            return self._finished.wait_for(lambda: self.finished_at is not None, timeout)
+    
+    def _finish_item(self, index: int, result: Optional[Dict[str, Any]], error: Optional[str]) -> None:
+        with self._lock:
+            item = self.items[index]
+            if error is None:
+                item.update(result)
+                item['status'] = 'done'
+            else:
+                item['status'] = 'failed'
+                item['error'] = error
+            self._futures.pop(index, None)
+            if all(item['status'] in ('done', 'failed') for item in self.items):
+                self.finished_at = time.time()
+                self._finished.notify_all()
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Snapshot of the job for the polling endpoint."""
+        with self._lock:
+            items = []
+            for index, item in enumerate(self.items):
+                item = dict(item)
+                future = self._futures.get(index)
+                if future is not None and future.running():
+                    item['status'] = 'processing'
+                items.append(item)
+        
+        completed = sum(item['status'] == 'done' for item in items)
+        failed = sum(item['status'] == 'failed' for item in items)
+        if completed + failed < len(items):
+            status = 'running'
+        else:
+            status = 'completed_with_errors' if failed else 'completed'
+        
+        return {
+            'job_id': self.id,
+            'status': status,
+            'total': len(items),
+            'completed': completed,
+            'failed': failed,
+            'progress': (completed + failed) / len(items) if items else 1.0,
+            'items': items
+        }
+
+
+class JobManager:
+    """
+    Runs jobs on a process pool and keeps recent jobs for polling.
+    
+    The pool is created on first use with one worker per CPU by default,
+    using the 'spawn' start method so workers never inherit Flask's threads.
+    At most max_queue images may be queued or processing at once (None for
+    no limit); submitting more raises QueueFull, or BatchTooLarge when the
+    job alone needs more than max_queue, so waiting would never help. Only the most recent
+    max_jobs jobs are kept; finished jobs are dropped first, and on_drop is
+    called with each dropped job.
+    """
+    
+    def __init__(
+        self,
+        max_workers: Optional[int] = None,
+        max_jobs: int = 100,
+        max_queue: Optional[int] = None,
+        on_drop: Optional[Callable[[BatchJob], None]] = None
+    ):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_jobs = max_jobs
+        self.max_queue = max_queue
+        self.on_drop = on_drop
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._jobs: 'OrderedDict[str, BatchJob]' = OrderedDict()
+        self._pending = 0
+        self._lock = threading.Lock()
+    
+    def _pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+            return self._executor
+    
+    def submit_batch(
+        self,
+        uploads: List[Dict[str, str]],
+        operations: List[list],
+        processed_folder: str,
+        on_result: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+        on_finish: Optional[Callable[[Dict[str, str]], None]] = None,
+        job_id: Optional[str] = None
+    ) -> BatchJob:
+        """
+        Queue a batch job.
+        
+        Args:
+            uploads: One dict per image with 'filename', 'filepath' and
+                'cache_key', plus 'result' when the result is already cached
+            operations: Shared chain from processing.build_operations()
+            processed_folder: Directory for output files
+            on_result: Called with (cache_key, result) for every new result
+            on_finish: Called with the upload dict once its item is done or
+                failed, including items answered from the cache
+            job_id: Id for the job, when the caller needs it before
+                submitting (e.g. to pin cached results for it); random if None
+        
+        Returns:
+            The queued BatchJob
+        
+        Raises:
+            BatchTooLarge: If the job's uncached images alone exceed max_queue
+            QueueFull: If the new images would exceed max_queue now
+        """
+        self._reserve(sum(upload.get('result') is None for upload in uploads))
+        
+        job = BatchJob([upload['filename'] for upload in uploads], operations, job_id)
+        self._register(job)
+        
+        for index, upload in enumerate(uploads):
+            if upload.get('result') is not None:
+                job._finish_item(index, upload['result'], None)
+                if on_finish is not None:
+                    on_finish(upload)
+                continue
+            
+            try:
+                future = self._pool().submit(
+                    process_upload, upload['filepath'], operations, processed_folder, upload['cache_key']
+                )
+            except Exception as e:
+                self._release()
+                job._finish_item(index, None, str(e))
+                if on_finish is not None:
+                    on_finish(upload)
+                continue
+            with job._lock:
+                job._futures[index] = future
+            future.add_done_callback(
+                lambda future, index=index, upload=upload:
+                    self._collect(job, index, upload, future, on_result, on_finish)
+            )
+        
+        return job
+    
+    def _reserve(self, count: int) -> None:
+        if self.max_queue is not None and count > self.max_queue:
+            raise BatchTooLarge(
+                f'Batch has {count} images to process; at most {self.max_queue} are allowed per job'
+            )
+        with self._lock:
+            if self.max_queue is not None and count and self._pending + count > self.max_queue:
+                raise QueueFull(
+                    f'Job queue is full ({self._pending} of {self.max_queue} images pending)'
+                )
+            self._pending += count
+    
+    def _release(self) -> None:
+        with self._lock:
+            self._pending -= 1
+    
+    def _collect(self, job: BatchJob, index: int, upload: Dict[str, str], future: Future, on_result, on_finish) -> None:
+        self._release()
+        try:
+            try:
+                result = future.result()
+            except Exception as e:
+                job._finish_item(index, None, str(e))
+                return
+            # Cache the result before waking long-polling clients
+            try:
+                if on_result is not None:
+                    on_result(upload['cache_key'], result)
+            finally:
+                job._finish_item(index, result, None)
+        finally:
+            if on_finish is not None:
+                on_finish(upload)
+    
+    def _register(self, job: BatchJob) -> None:
+        dropped = []
+        with self._lock:
+            self._jobs[job.id] = job
+            while len(self._jobs) > self.max_jobs:
+                finished = next((job_id for job_id, old in self._jobs.items() if old.done), None)
+                if finished is None:
+                    break
+                dropped.append(self._jobs.pop(finished))
+        if self.on_drop is not None:
+            for old in dropped:
+                self.on_drop(old)
+    
+    def stats(self) -> Dict[str, Any]:
+        """Worker count and queue depth, for the health endpoint."""
+        with self._lock:
+            return {
+                'workers': self.max_workers,
+                'pending': self._pending,
+                'max_queue': self.max_queue,
+                'jobs': len(self._jobs)
+            }
+    
+    def get(self, job_id: str) -> Optional[BatchJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+    
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
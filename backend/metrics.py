@@ -0,0 +1,137 @@
+"""
+Per-stage latency histograms exported in Prometheus text format.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Tuple
+
+
+# Histogram bucket upper bounds in seconds (+Inf is implicit)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Image size label boundaries in megapixels
+SIZE_BUCKETS = ((1, '<1MP'), (4, '1-4MP'), (16, '4-16MP'), (64, '16-64MP'))
+
+# Stage timings of the current request, when Server-Timing is enabled for it
+_request_timings: ContextVar[Optional[List[Tuple[str, float, str]]]] = ContextVar(
+    'request_timings', default=None
+)
+
+
+def _label_value(value: str) -> str:
+    """Escape a label value for the Prometheus text format."""
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def size_bucket(size: Optional[Tuple[int, int]]) -> str:
+    """Label an image (width, height) with its megapixel range."""
+    if size is None:
+        return ''
+    megapixels = size[0] * size[1] / 1e6
+    for limit, label in SIZE_BUCKETS:
+        if megapixels < limit:
+            return label
+    return f'>={SIZE_BUCKETS[-1][0]}MP'
+
+
+class StageHistograms:
+    """
+    Latency histograms keyed by (stage, method, size) labels.
+    
+    An observation takes a lock and bumps at most a dozen counters, so
+    stages can be timed on every request.
+    """
+    
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._series: Dict[Tuple[str, str, str], List[float]] = {}
+        self._lock = threading.Lock()
+    
+    def observe(self, stage: str, seconds: float, method: str = '', size: str = '') -> None:
+        """Record one duration; series hold bucket counts followed by count and sum."""
+        key = (stage, method, size)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for index, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    series[index] += 1
+            series[-2] += 1
+            series[-1] += seconds
+    
+    def render(self) -> str:
+        """Prometheus text exposition of every series."""
+        lines = [
+            '# HELP pxl8_stage_seconds Time spent in each processing stage.',
+            '# TYPE pxl8_stage_seconds histogram'
+        ]
+        with self._lock:
+            snapshot = sorted((key, list(series)) for key, series in self._series.items())
+        
+        for (stage, method, size), series in snapshot:
+            labels = ','.join(
+                f'{name}="{_label_value(value)}"'
+                for name, value in (('stage', stage), ('method', method), ('size', size))
+            )
+            for bound, count in zip(self.buckets, series):
+                lines.append(f'pxl8_stage_seconds_bucket{{{labels},le="{bound}"}} {count}')
+            lines.append(f'pxl8_stage_seconds_bucket{{{labels},le="+Inf"}} {series[-2]}')
+            lines.append(f'pxl8_stage_seconds_count{{{labels}}} {series[-2]}')
+            lines.append(f'pxl8_stage_seconds_sum{{{labels}}} {series[-1]:.6f}')
+        return '\n'.join(lines) + '\n'
+    
+    def reset(self) -> None:
+        with self._lock:
+            self._series.clear()
+
+
+# Process-wide registry; pool workers keep their own, unexported copy
+histograms = StageHistograms()
+
+
+@contextmanager
+def timed(stage: str, method: str = '', size: Optional[Tuple[int, int]] = None) -> Iterator[None]:
+    """
+    Time a block as one observation of a stage.
+    
+    Args:
+        stage: Stage name ('decode', 'pixelate', 'mask', 'encode', ...)
+        method: Variant of the stage (pixelation method, image format, ...)
+        size: (width, height) of the image the stage works on, for the size label
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        bucket = size_bucket(size)
+        histograms.observe(stage, seconds, method, bucket)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings.append((stage, seconds, ' '.join(filter(None, (method, bucket)))))
+
+
+def start_request_timing() -> None:
+    """Collect stage timings of the current request for a Server-Timing header."""
+    _request_timings.set([])
+
+
+def finish_request_timing(total: Optional[float] = None) -> Optional[str]:
+    """
+    Stop collecting and format the Server-Timing header value.
+    
+    Returns None if timing was not started for this request.
+    """
+    timings = _request_timings.get()
+    _request_timings.set(None)
+    if timings is None:
+        return None
+    
+    entries = [f'{stage};dur={seconds * 1000:.1f};desc="{desc}"' for stage, seconds, desc in timings]
+    if total is not None:
+        entries.append(f'total;dur={total * 1000:.1f}')
+    return ', '.join(entries)
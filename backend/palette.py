@@ -0,0 +1,186 @@
+"""
+Palette quantization of pixelated grids: fixed palettes, k-means palettes and
+a 3D lookup table for fast nearest-color mapping.
+"""
+
+from functools import lru_cache
+from typing import List, Sequence, Union
+
+import cv2
+import numpy as np
+
+from metrics import timed
+
+
+# Built-in palettes, by request name
+FIXED_PALETTES = {
+    'gameboy': ['#0f380f', '#306230', '#8bac0f', '#9bbc0f'],
+    'cga': ['#000000', '#55ffff', '#ff55ff', '#ffffff'],
+    'gray4': ['#000000', '#555555', '#aaaaaa', '#ffffff'],
+    'pico8': [
+        '#000000', '#1d2b53', '#7e2553', '#008751', '#ab5236', '#5f574f', '#c2c3c7', '#fff1e8',
+        '#ff004d', '#ffa300', '#ffec27', '#00e436', '#29adff', '#83769c', '#ff77a8', '#ffccaa'
+    ],
+    'ega': [
+        '#000000', '#0000aa', '#00aa00', '#00aaaa', '#aa0000', '#aa00aa', '#aa5500', '#aaaaaa',
+        '#555555', '#5555ff', '#55ff55', '#55ffff', '#ff5555', '#ff55ff', '#ffff55', '#ffffff'
+    ]
+}
+
+MAX_PALETTE_COLORS = 256
+
+# Bits kept per channel when indexing the lookup table (64^3 cells)
+LUT_BITS = 6
+
+# Grid pixels k-means is fitted on at most (a fixed-seed sample beyond that)
+KMEANS_SAMPLE_PIXELS = 65536
+KMEANS_SEED = 0
+
+
+def parse_color(value: str) -> List[int]:
+    """'#rrggbb' (or 'rrggbb') to [r, g, b]; raises ValueError otherwise."""
+    digits = value[1:] if value.startswith('#') else value
+    if len(digits) != 6:
+        raise ValueError(f'Invalid color: {value}')
+    return [int(digits[i:i + 2], 16) for i in (0, 2, 4)]
+
+
+def format_colors(colors: Sequence[Sequence[int]]) -> List[str]:
+    """[[r, g, b], ...] to ['#rrggbb', ...]."""
+    return ['#%02x%02x%02x' % tuple(int(channel) for channel in color) for color in colors]
+
+
+def resolve_palette(value: Union[str, Sequence[str]]) -> List[List[int]]:
+    """
+    Turn a palette request option into a list of [r, g, b] colors.
+    
+    Accepts the name of a fixed palette or a list of '#rrggbb' colors.
+    Raises ValueError for anything else.
+    """
+    if isinstance(value, str):
+        if value not in FIXED_PALETTES:
+            raise ValueError(f'Unknown palette: {value} (choose from {sorted(FIXED_PALETTES)})')
+        value = FIXED_PALETTES[value]
+    if not isinstance(value, list) or not value:
+        raise ValueError('palette must be a palette name or a list of colors')
+    if len(value) > MAX_PALETTE_COLORS:
+        raise ValueError(f'palette may have at most {MAX_PALETTE_COLORS} colors')
+    return [parse_color(str(color)) for color in value]
+
+
+def kmeans_palette(pixels: np.ndarray, count: int) -> List[List[int]]:
+    """
+    Derive a palette of up to count colors from an L, RGB or RGBA pixel array.
+    
+    Fitted with k-means on the pixels' RGB values (fully transparent pixels
+    are ignored) with a fixed seed, so the same grid always gives the same
+    palette. Returns fewer colors when the pixels have fewer distinct ones,
+    and none when every pixel is fully transparent.
+    """
+    samples = _rgb(pixels)
+    if pixels.ndim == 3 and pixels.shape[2] == 4:
+        samples = samples[pixels[:, :, 3] > 0]
+    samples = samples.reshape(-1, 3)
+    
+    distinct = np.unique(samples, axis=0)
+    if len(distinct) <= count:
+        return distinct.tolist()
+    
+    if len(samples) > KMEANS_SAMPLE_PIXELS:
+        rng = np.random.default_rng(KMEANS_SEED)
+        samples = samples[rng.choice(len(samples), KMEANS_SAMPLE_PIXELS, replace=False)]
+    
+    cv2.setRNGSeed(KMEANS_SEED)
+    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 20, 0.5)
+    _, _, centers = cv2.kmeans(
+        samples.astype(np.float32), count, None, criteria, 1, cv2.KMEANS_PP_CENTERS
+    )
+    centers = np.clip(np.rint(centers), 0, 255).astype(np.uint8)
+    # Sorted so equal palettes compare (and cache) equal
+    return np.unique(centers, axis=0).tolist()
+
+
+def quantize_grid(pixels: np.ndarray, palette: Union[int, Sequence[Sequence[int]]]) -> np.ndarray:
+    """
+    Limit a pixelated grid to a palette.
+    
+    Args:
+        pixels: L, RGB or RGBA grid array
+        palette: [r, g, b] colors, or a color count to derive a palette for
+            this grid with kmeans_palette
+    
+    Returns:
+        RGB array, or RGBA with the grid's alpha for RGBA input; the grid
+        itself when the palette is empty (derived from a fully transparent
+        grid), since there is no color to map to
+    """
+    height, width = pixels.shape[:2]
+    with timed('quantize', 'kmeans' if isinstance(palette, int) else 'fixed', (width, height)):
+        if isinstance(palette, int):
+            palette = kmeans_palette(pixels, palette)
+        if len(palette) == 0:
+            return pixels
+        return quantize_pixels(pixels, palette)
+
+
+def quantize_pixels(pixels: np.ndarray, colors: Sequence[Sequence[int]]) -> np.ndarray:
+    """
+    Replace every pixel of an L, RGB or RGBA array by its nearest palette color.
+    
+    Colors are looked up in a table with one entry per RGB cell of
+    2^(8 - LUT_BITS) levels a side, holding the palette color nearest the
+    cell's center, so mapping is a single gather however large the grid or
+    palette. Pixels close to the boundary between two palette colors may get
+    the other one, at most a few levels further away than the nearest.
+    
+    Returns:
+        RGB array, or RGBA with the source alpha for RGBA input
+    """
+    palette = np.asarray(colors, dtype=np.uint8)
+    lut = _lookup_table(palette.tobytes())
+    
+    rgb = _rgb(pixels)
+    shift = 8 - LUT_BITS
+    index = (
+        (rgb[:, :, 0] >> shift).astype(np.intp) << (2 * LUT_BITS) |
+        (rgb[:, :, 1] >> shift).astype(np.intp) << LUT_BITS |
+        (rgb[:, :, 2] >> shift).astype(np.intp)
+    )
+    quantized = palette[lut[index]]
+    
+    if pixels.ndim == 3 and pixels.shape[2] == 4:
+        return np.dstack((quantized, pixels[:, :, 3]))
+    return quantized
+
+
+@lru_cache(maxsize=32)
+def _lookup_table(palette_bytes: bytes) -> np.ndarray:
+    """
+    Nearest palette index for the center of every RGB cell.
+    
+    Cached by palette, so a palette shared by a batch builds its table once
+    per process.
+    """
+    palette = np.frombuffer(palette_bytes, dtype=np.uint8).reshape(-1, 3).astype(np.float32)
+    step = 1 << (8 - LUT_BITS)
+    levels = np.arange(1 << LUT_BITS, dtype=np.float32) * step + (step - 1) / 2
+    
+    # One red plane of cells at a time keeps the distance array small
+    lut = np.empty((1 << LUT_BITS,) * 3, dtype=np.uint8)
+    green, blue = np.meshgrid(levels, levels, indexing='ij')
+    plane = np.stack((green.ravel(), blue.ravel()), axis=1)
+    plane_distances = (
+        (plane[:, np.newaxis, 0] - palette[np.newaxis, :, 1]) ** 2 +
+        (plane[:, np.newaxis, 1] - palette[np.newaxis, :, 2]) ** 2
+    )
+    for red_index, red in enumerate(levels):
+        distances = plane_distances + (red - palette[:, 0]) ** 2
+        lut[red_index] = np.argmin(distances, axis=1).reshape(green.shape)
+    return lut.ravel()
+
+
+def _rgb(pixels: np.ndarray) -> np.ndarray:
+    """The RGB channels of an L, RGB or RGBA array (gray repeated for L)."""
+    if pixels.ndim == 2:
+        return np.repeat(pixels[:, :, np.newaxis], 3, axis=2)
+    return pixels[:, :, :3]
@@ -5,54 +5,407 @@ Supports nearest neighbor (majority color), spatial approximation, and pixel ave
 
 from PIL import Image
 import numpy as np
-from typing import Tuple, Literal
-from collections import Counter
+from typing import Callable, Optional, Sequence, Tuple, Literal, Union
+
+from metrics import timed
+from palette import quantize_grid
+from png_writer import PNGStripWriter
+from utils import working_mode
+
+
+# Supported pixelation methods
+PIXELATION_METHODS = ('nearest', 'spatial', 'average')
+
+# Source pixels decoded and reduced per strip in tiled mode
+TILED_STRIP_PIXELS = 4 << 20
+
+# JPEG DCT scaling factors Pillow's draft mode can decode at
+DRAFT_REDUCTIONS = (8, 4, 2)
+
+# Methods whose grids stay close to full-size decoding in draft mode; the
+# majority color of 'nearest' does not survive the smoothed, smaller decode
+DRAFT_METHODS = ('average', 'spatial')
 
 
 def pixelate_image(
-    image: Image.Image,
+    image: Union[Image.Image, np.ndarray],
     target_width: int,
     target_height: int,
-    method: Literal['nearest', 'spatial', 'average'] = 'average'
+    method: Literal['nearest', 'spatial', 'average'] = 'average',
+    scale: Optional[int] = None,
+    min_block_pixels: Optional[int] = None,
+    palette: Optional[Union[int, Sequence[Sequence[int]]]] = None
 ) -> Image.Image:
     """
     Pixelate an image to target dimensions using specified method.
     
     Args:
-        image: PIL Image object
-        target_width: Target width in pixels (minimum 1)
-        target_height: Target height in pixels (minimum 1)
+        image: PIL Image object, or an L, RGB or RGBA uint8 array such as a
+            memory-mapped decoded upload, which is reduced in place without
+            a PIL copy
+        target_width: Target width in pixels (1 to the image width)
+        target_height: Target height in pixels (1 to the image height)
         method: 'nearest' for majority color, 'spatial' for spatial approximation, 'average' for pixel averaging
+        scale: Output scale. None scales the grid back up to the original size;
+            an integer N returns the compact grid with every cell drawn as an
+            N x N block (1 returns the grid itself)
+        min_block_pixels: If set, method is 'average' or 'spatial' and image
+            is a JPEG that has not been loaded yet, decode it in draft mode at
+            the largest reduction that still leaves this many source pixels
+            along each side of a block ('nearest' always decodes at full size)
+        palette: If set, limit the grid to these [r, g, b] colors, or to a
+            palette of this many colors derived from the grid (k-means)
     
     Returns:
         Pixelated PIL Image
     """
-    # Ensure minimum dimensions (1x1 for maximum pixelation - largest possible pixels)
-    target_width = max(1, target_width)
-    target_height = max(1, target_height)
+    # Ensure minimum dimensions (1x1 for maximum pixelation - largest possible
+    # pixels) and at most one cell per source pixel
+    size = (image.shape[1], image.shape[0]) if isinstance(image, np.ndarray) else image.size
+    target_width, target_height = clamp_grid(size, target_width, target_height)
+    
+    if isinstance(image, np.ndarray):
+        grid = Image.fromarray(pixelate_array(image, target_width, target_height, method, palette))
+        if scale is None:
+            return upscale_grid(grid, (image.shape[1], image.shape[0]))
+        return upscale_grid(grid, (target_width * scale, target_height * scale))
     
     # Get original dimensions
     orig_width, orig_height = image.size
     
-    if method == 'spatial':
-        # Spatial approximation: simple resize (fast, blocky)
-        pixelated = image.resize(
-            (target_width, target_height),
-            Image.Resampling.NEAREST
-        )
-        # Scale back up to original size for visible pixelation effect
-        pixelated = pixelated.resize(
-            (orig_width, orig_height),
-            Image.Resampling.NEAREST
-        )
-    elif method == 'nearest':
-        # Nearest neighbor: majority color per block
-        pixelated = _pixelate_majority(image, target_width, target_height)
-    else:  # method == 'average'
-        # Pixel averaging: average colors in each block
-        pixelated = _pixelate_average(image, target_width, target_height)
+    # Decode coarse grids from a reduced-size JPEG
+    if min_block_pixels and method in DRAFT_METHODS:
+        apply_draft(image, target_width, target_height, min_block_pixels)
+    
+    # Lazily opened files are decoded here
+    if getattr(image, 'tile', None):
+        with timed('decode', image.format or '', image.size):
+            image.load()
+    
+    with timed('pixelate', method, image.size):
+        if method == 'spatial':
+            # Spatial approximation: simple resize (fast, blocky)
+            grid = image.resize(
+                (target_width, target_height),
+                Image.Resampling.NEAREST
+            )
+        elif method == 'nearest':
+            # Nearest neighbor: majority color per block
+            grid = _pixelate_majority(image, target_width, target_height)
+        else:  # method == 'average'
+            # Pixel averaging: average colors in each block
+            grid = _pixelate_average(image, target_width, target_height)
+    
+    if palette is not None:
+        grid_mode = working_mode(grid)
+        grid = Image.fromarray(quantize_grid(np.asarray(grid.convert(grid_mode)), palette))
+    
+    # Scale up only as far as the caller needs for visible pixelation
+    if scale is None:
+        return upscale_grid(grid, (orig_width, orig_height))
+    return upscale_grid(grid, (target_width * scale, target_height * scale))
+
+
+def clamp_grid(size: Tuple[int, int], target_width: int, target_height: int) -> Tuple[int, int]:
+    """
+    Limit a target grid to between one cell and one cell per source pixel
+    along each side of an image of size (width, height).
+    
+    A finer grid has empty blocks, yet the block reductions would still
+    allocate several arrays of the grid's size.
+    """
+    return min(max(1, target_width), size[0]), min(max(1, target_height), size[1])
+
+
+def upscale_grid(grid: Image.Image, size: Tuple[int, int]) -> Image.Image:
+    """Scale a pixelated grid up to size with hard pixel edges."""
+    if grid.size == tuple(size):
+        return grid
+    with timed('upscale', '', size):
+        return grid.resize(size, Image.Resampling.NEAREST)
+
+
+def pixelate_array(
+    pixels: np.ndarray,
+    target_width: int,
+    target_height: int,
+    method: Literal['nearest', 'spatial', 'average'] = 'average',
+    palette: Optional[Union[int, Sequence[Sequence[int]]]] = None
+) -> np.ndarray:
+    """
+    Reduce a pixel array to its target_width x target_height grid (clamped
+    as in clamp_grid).
+    
+    Same engines, palette handling and results as pixelate_image, for
+    callers that keep working on numpy buffers between operations.
+    """
+    grid = _reduce_array(pixels, target_width, target_height, method)
+    if palette is not None:
+        grid = quantize_grid(grid, palette)
+    return grid
+
+
+def _reduce_array(
+    pixels: np.ndarray,
+    target_width: int,
+    target_height: int,
+    method: Literal['nearest', 'spatial', 'average']
+) -> np.ndarray:
+    height, width = pixels.shape[:2]
+    target_width, target_height = clamp_grid((width, height), target_width, target_height)
+    
+    with timed('pixelate', method, (width, height)):
+        if method == 'spatial':
+            rows = _nearest_index(height, target_height)
+            cols = _nearest_index(width, target_width)
+            return pixels[rows][:, cols]
+        
+        row_edges = _block_edges(height, target_height)
+        col_edges = _block_edges(width, target_width)
+        if method == 'nearest':
+            return _majority_blocks(pixels, row_edges, col_edges)
+        return _average_blocks(pixels, row_edges, col_edges)
+
+
+def upscale_array(grid: np.ndarray, size: Tuple[int, int]) -> np.ndarray:
+    """Scale a grid array up to size (width, height) exactly as upscale_grid does."""
+    height, width = grid.shape[:2]
+    if (width, height) == tuple(size):
+        return grid
+    rows = _nearest_index(height, size[1])
+    cols = _nearest_index(width, size[0])
+    return grid[rows][:, cols]
+
+
+def draft_reduction(
+    image: Image.Image,
+    target_width: int,
+    target_height: int,
+    min_block_pixels: int
+) -> int:
+    """
+    Largest JPEG draft reduction usable for a target grid.
     
-    return pixelated
+    Returns 8, 4 or 2 when decoding at that fraction of the size still
+    leaves at least min_block_pixels source pixels along each side of a
+    block, and 1 when draft mode does not apply (not a JPEG, already
+    loaded, or the grid is too fine).
+    """
+    if image.format != 'JPEG' or not image.tile or min_block_pixels < 1:
+        return 1
+    
+    width, height = image.size
+    for reduction in DRAFT_REDUCTIONS:
+        if (width / reduction >= target_width * min_block_pixels and
+                height / reduction >= target_height * min_block_pixels):
+            return reduction
+    return 1
+
+
+def apply_draft(
+    image: Image.Image,
+    target_width: int,
+    target_height: int,
+    min_block_pixels: int
+) -> int:
+    """
+    Switch an unloaded JPEG to draft mode for a target grid.
+    
+    Returns the reduction applied (1 if the image is decoded at full size).
+    """
+    reduction = draft_reduction(image, max(1, target_width), max(1, target_height), min_block_pixels)
+    if reduction > 1:
+        width, height = image.size
+        image.draft(image.mode, (width // reduction, height // reduction))
+    return reduction
+
+
+def grid_scale(original_size: Tuple[int, int], grid_size: Tuple[int, int]) -> Tuple[float, float]:
+    """Return the (x, y) factors that scale a grid back up to the original size."""
+    return (
+        original_size[0] / max(1, grid_size[0]),
+        original_size[1] / max(1, grid_size[1])
+    )
+
+
+def integral_image(pixels: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Build the summed-area table of an L, RGB or RGBA pixel array.
+    
+    Entry [y, x] holds the int64 sum of pixels[:y, :x] per channel, so the
+    table has one more row and column than the image (the first of each
+    all zeros). Rows are accumulated in strips of about TILED_STRIP_PIXELS,
+    so out can be a memory-mapped file without the whole table in memory.
+    
+    Args:
+        pixels: Pixel array to sum
+        out: Array of shape (height + 1, width + 1[, channels]) and dtype
+            int64 to fill; a new one is allocated if omitted
+    
+    Returns:
+        The filled table
+    """
+    height, width = pixels.shape[:2]
+    if out is None:
+        out = np.empty((height + 1, width + 1) + pixels.shape[2:], dtype=np.int64)
+    
+    with timed('integral', '', (width, height)):
+        out[0] = 0
+        out[:, 0] = 0
+        rows_per_strip = max(1, TILED_STRIP_PIXELS // max(1, width))
+        for start in range(0, height, rows_per_strip):
+            stop = min(height, start + rows_per_strip)
+            strip = np.cumsum(pixels[start:stop], axis=1, dtype=np.int64)
+            np.cumsum(strip, axis=0, out=strip)
+            strip += out[start, 1:]
+            out[start + 1:stop + 1, 1:] = strip
+    return out
+
+
+def average_from_integral(
+    table: np.ndarray,
+    target_width: int,
+    target_height: int,
+    dtype=np.uint8
+) -> np.ndarray:
+    """
+    Reduce an image to its 'average' grid using its summed-area table.
+    
+    Every block sum is four table lookups, so the cost depends only on the
+    grid size, and only the (target_height + 1) x (target_width + 1) block
+    corners are read from a memory-mapped table. The result is identical to
+    pixelating the image itself with the 'average' method.
+    
+    Args:
+        table: Table from integral_image()
+        target_width: Grid width (1 to the image width)
+        target_height: Grid height (1 to the image height)
+        dtype: Pixel dtype of the image the table was built from
+    """
+    height, width = table.shape[0] - 1, table.shape[1] - 1
+    target_width, target_height = clamp_grid((width, height), target_width, target_height)
+    row_edges = _block_edges(height, target_height)
+    col_edges = _block_edges(width, target_width)
+    
+    with timed('pixelate', 'average_integral', (width, height)):
+        corners = np.asarray(table[np.ix_(row_edges, col_edges)])
+        sums = corners[1:, 1:] - corners[:-1, 1:] - corners[1:, :-1] + corners[:-1, :-1]
+        
+        counts = np.outer(np.diff(row_edges), np.diff(col_edges))
+        if table.ndim == 3:
+            counts = counts[:, :, np.newaxis]
+        means = np.where(counts > 0, sums / np.maximum(counts, 1), 0)
+        return means.astype(dtype)
+
+
+def pixelate_file_tiled(
+    source_path: str,
+    output_path: str,
+    target_width: int,
+    target_height: int,
+    method: Literal['nearest', 'spatial', 'average'] = 'average',
+    scale: Optional[int] = None,
+    strip_pixels: int = TILED_STRIP_PIXELS,
+    min_block_pixels: Optional[int] = None,
+    compress_level: int = 6,
+    palette: Optional[Sequence[Sequence[int]]] = None
+) -> Tuple[int, int]:
+    """
+    Pixelate an image file to a PNG file in horizontal strips.
+    
+    The source is read through Image.crop one strip of whole block rows at
+    a time, reduced with the same engines as pixelate_image, and the
+    upscaled rows are written straight to an incremental PNG encoder. No
+    full-size numpy copy or upscaled image is ever allocated, so memory
+    beyond Pillow's decoded source is bounded by one strip. The output is
+    identical to pixelate_image followed by a PNG save.
+    
+    Args:
+        source_path: Image file to read
+        output_path: PNG file to write
+        target_width: Target width in pixels (1 to the image width)
+        target_height: Target height in pixels (1 to the image height)
+        method: 'nearest', 'spatial' or 'average', as in pixelate_image
+        scale: Output scale, as in pixelate_image
+        strip_pixels: Approximate number of source pixels per strip
+        min_block_pixels: JPEG draft-mode threshold, as in pixelate_image
+        compress_level: zlib level of the PNG (0-9)
+        palette: [r, g, b] colors to limit the grid to, as in pixelate_image
+            (derived palettes need the whole grid and are not supported)
+    
+    Returns:
+        (width, height) of the written image
+    """
+    with Image.open(source_path) as image:
+        full_size = image.size
+        target_width, target_height = clamp_grid(full_size, target_width, target_height)
+        if min_block_pixels and method in DRAFT_METHODS:
+            apply_draft(image, target_width, target_height, min_block_pixels)
+        
+        # Dimensions actually decoded (smaller than full_size in draft mode)
+        orig_width, orig_height = image.size
+        mode = working_mode(image)
+        
+        if scale is None:
+            output_size = full_size
+        else:
+            output_size = (target_width * scale, target_height * scale)
+        
+        # Grid cell shown at every output pixel, exactly as upscale_grid draws it
+        output_rows = _nearest_index(target_height, output_size[1])
+        output_cols = _nearest_index(target_width, output_size[0])
+        
+        # Source rows each grid row is computed from
+        if method == 'spatial':
+            sample_rows = _nearest_index(orig_height, target_height)
+            sample_cols = _nearest_index(orig_width, target_width)
+            row_starts, row_ends = sample_rows, sample_rows + 1
+        else:
+            row_edges = _block_edges(orig_height, target_height)
+            col_edges = _block_edges(orig_width, target_width)
+            row_starts, row_ends = row_edges[:-1], row_edges[1:]
+        
+        rows_per_strip = max(1, strip_pixels // orig_width)
+        
+        # Palette colors are RGB; alpha is kept
+        output_mode = 'RGB' if palette is not None and mode == 'L' else mode
+        with PNGStripWriter(output_path, output_size[0], output_size[1], output_mode, compress_level) as writer:
+            grid_row = 0
+            while grid_row < target_height:
+                # Take whole block rows until the strip is large enough
+                first_row = grid_row
+                y_start = int(row_starts[first_row])
+                grid_row += 1
+                while grid_row < target_height and row_ends[grid_row] - y_start <= rows_per_strip:
+                    grid_row += 1
+                y_end = max(int(row_ends[grid_row - 1]), y_start)
+                
+                strip = image.crop((0, y_start, orig_width, y_end))
+                if strip.mode != mode:
+                    strip = strip.convert(mode)
+                pixels = np.asarray(strip)
+                
+                if method == 'spatial':
+                    grid = pixels[sample_rows[first_row:grid_row] - y_start][:, sample_cols]
+                elif method == 'nearest':
+                    grid = _majority_blocks(pixels, row_edges[first_row:grid_row + 1] - y_start, col_edges)
+                else:  # method == 'average'
+                    grid = _average_blocks(pixels, row_edges[first_row:grid_row + 1] - y_start, col_edges)
+                if palette is not None:
+                    grid = quantize_grid(grid, palette)
+                
+                # Output rows showing these grid rows (output_rows is non-decreasing)
+                out_start = np.searchsorted(output_rows, first_row)
+                out_end = np.searchsorted(output_rows, grid_row)
+                writer.write_rows(grid[output_rows[out_start:out_end] - first_row][:, output_cols])
+    
+    return output_size
+
+
+def _nearest_index(source_length: int, target_length: int) -> np.ndarray:
+    """Source index Pillow's NEAREST resize picks for each target position along one axis."""
+    index = Image.fromarray(np.arange(source_length, dtype=np.int32)[np.newaxis, :])
+    return np.asarray(index.resize((target_length, 1), Image.Resampling.NEAREST))[0].astype(np.int64)
 
 
 def _pixelate_average(
@@ -63,55 +416,90 @@ def _pixelate_average(
     """
     Pixelate using pixel averaging method.
     Divides image into blocks and averages pixel values in each block.
+    Returns the target_width x target_height grid.
     """
     # Convert to numpy array
     img_array = np.array(image)
     orig_height, orig_width = img_array.shape[:2]
     
-    # Calculate block sizes
-    block_width = orig_width / target_width
-    block_height = orig_height / target_height
-    
-    # Create output array
-    if len(img_array.shape) == 3:  # Color image (RGB/RGBA)
-        output = np.zeros((target_height, target_width, img_array.shape[2]), dtype=img_array.dtype)
-    else:  # Grayscale
-        output = np.zeros((target_height, target_width), dtype=img_array.dtype)
-    
-    # Process each block
-    for y in range(target_height):
-        for x in range(target_width):
-            # Calculate block boundaries
-            x_start = int(x * block_width)
-            x_end = int((x + 1) * block_width)
-            y_start = int(y * block_height)
-            y_end = int((y + 1) * block_height)
-            
-            # Ensure we don't go out of bounds
-            x_end = min(x_end, orig_width)
-            y_end = min(y_end, orig_height)
-            
-            # Extract block
-            block = img_array[y_start:y_end, x_start:x_end]
-            
-            # Average the block
-            if len(img_array.shape) == 3:
-                avg_color = np.mean(block.reshape(-1, img_array.shape[2]), axis=0)
-                output[y, x] = avg_color.astype(img_array.dtype)
-            else:
-                avg_color = np.mean(block)
-                output[y, x] = avg_color.astype(img_array.dtype)
+    # Calculate block boundaries
+    row_edges = _block_edges(orig_height, target_height)
+    col_edges = _block_edges(orig_width, target_width)
+    
+    # Reduce all blocks in one pass
+    output = _average_blocks(img_array, row_edges, col_edges)
     
     # Convert back to PIL Image
-    result = Image.fromarray(output)
+    return Image.fromarray(output)
+
+
+def _block_edges(length: int, count: int) -> np.ndarray:
+    """
+    Calculate block boundaries along one axis.
     
-    # Scale back up to original size for visible pixelation
-    result = result.resize(
-        (orig_width, orig_height),
-        Image.Resampling.NEAREST
-    )
+    Edge i is int(i * length / count), clamped to length, so block i covers
+    [edges[i], edges[i + 1]). Blocks may be empty when count > length.
+    """
+    block_size = length / count
+    edges = (np.arange(count + 1) * block_size).astype(np.int64)
+    return np.minimum(edges, length)
+
+
+def _sum_blocks(array: np.ndarray, edges: np.ndarray, axis: int, dtype) -> np.ndarray:
+    """
+    Sum array over the blocks described by edges along one axis.
+    
+    Empty blocks sum to zero; pixels past the last edge are ignored.
+    """
+    starts = edges[:-1]
+    nonempty = edges[1:] > starts
     
-    return result
+    shape = list(array.shape)
+    shape[axis] = len(starts)
+    sums = np.zeros(shape, dtype=dtype)
+    
+    if nonempty.any():
+        # reduceat sums from each start to the next one, so only non-empty
+        # starts are passed and the tail beyond the last edge is cut off
+        covered = [slice(None)] * array.ndim
+        covered[axis] = slice(0, edges[-1])
+        selected = [slice(None)] * array.ndim
+        selected[axis] = nonempty
+        sums[tuple(selected)] = np.add.reduceat(
+            array[tuple(covered)], starts[nonempty], axis=axis, dtype=dtype
+        )
+    
+    return sums
+
+
+def _average_blocks(
+    img_array: np.ndarray,
+    row_edges: np.ndarray,
+    col_edges: np.ndarray
+) -> np.ndarray:
+    """
+    Average pixel values in every block with two reduceat passes.
+    
+    Integer images are summed exactly in int64, so the result matches
+    np.mean per block followed by a cast to the image dtype. Empty blocks
+    are left as zeros.
+    """
+    if np.issubdtype(img_array.dtype, np.integer) or img_array.dtype == np.bool_:
+        acc_dtype = np.int64
+    else:
+        acc_dtype = np.float64
+    
+    # Reduce rows first so the second pass runs on a target_height-row array
+    sums = _sum_blocks(img_array, row_edges, axis=0, dtype=acc_dtype)
+    sums = _sum_blocks(sums, col_edges, axis=1, dtype=acc_dtype)
+    
+    counts = np.outer(np.diff(row_edges), np.diff(col_edges))
+    if img_array.ndim == 3:
+        counts = counts[:, :, np.newaxis]
+    
+    means = np.where(counts > 0, sums / np.maximum(counts, 1), 0)
+    
+    return means.astype(img_array.dtype)
 
 
 def _pixelate_majority(
@@ -122,63 +510,122 @@ def _pixelate_majority(
     """
     Pixelate using majority color (mode) method.
     Divides image into blocks and uses the most frequent color in each block.
+    Ties go to the color that appears first in the block (row-major order).
+    Returns the target_width x target_height grid.
     """
     # Convert to numpy array
     img_array = np.array(image)
     orig_height, orig_width = img_array.shape[:2]
     
-    # Calculate block sizes
-    block_width = orig_width / target_width
-    block_height = orig_height / target_height
-    
-    # Create output array
-    if len(img_array.shape) == 3:  # Color image (RGB/RGBA)
-        output = np.zeros((target_height, target_width, img_array.shape[2]), dtype=img_array.dtype)
-    else:  # Grayscale
-        output = np.zeros((target_height, target_width), dtype=img_array.dtype)
-    
-    # Process each block
-    for y in range(target_height):
-        for x in range(target_width):
-            # Calculate block boundaries
-            x_start = int(x * block_width)
-            x_end = int((x + 1) * block_width)
-            y_start = int(y * block_height)
-            y_end = int((y + 1) * block_height)
-            
-            # Ensure we don't go out of bounds
-            x_end = min(x_end, orig_width)
-            y_end = min(y_end, orig_height)
-            
-            # Extract block
-            block = img_array[y_start:y_end, x_start:x_end]
-            
-            # Find majority color (mode)
-            if len(img_array.shape) == 3:
-                # Reshape to list of pixels
-                pixels = block.reshape(-1, img_array.shape[2])
-                # Convert to tuples for counting
-                pixel_tuples = [tuple(pixel) for pixel in pixels]
-                # Count frequencies
-                color_counts = Counter(pixel_tuples)
-                # Get most common color
-                majority_color = color_counts.most_common(1)[0][0]
-                output[y, x] = np.array(majority_color, dtype=img_array.dtype)
-            else:
-                # Grayscale: flatten and find mode
-                pixels = block.flatten()
-                color_counts = Counter(pixels)
-                majority_color = color_counts.most_common(1)[0][0]
-                output[y, x] = majority_color
+    # Calculate block boundaries
+    row_edges = _block_edges(orig_height, target_height)
+    col_edges = _block_edges(orig_width, target_width)
+    
+    # Find the mode of every block with packed-integer keys
+    output = _majority_blocks(img_array, row_edges, col_edges)
     
     # Convert back to PIL Image
-    result = Image.fromarray(output)
+    return Image.fromarray(output)
+
+
+# Pixels per sort when finding block modes; bounds the temporary arrays
+MAJORITY_CHUNK_PIXELS = 1 << 20
+
+
+def _pack_pixels(pixels: np.ndarray) -> Tuple[np.ndarray, Callable[[np.ndarray], np.ndarray]]:
+    """
+    Pack each pixel into a single integer key below 2**32.
     
-    # Scale back up to original size for visible pixelation
-    result = result.resize(
-        (orig_width, orig_height),
-        Image.Resampling.NEAREST
-    )
+    uint8 images with up to 4 channels are bit-packed into uint32; anything
+    else is mapped through np.unique. Returns the keys (one per pixel, in
+    row-major order) and a function turning keys back into pixel values.
+    """
+    channels = pixels.shape[2] if pixels.ndim == 3 else 1
+    flat = pixels.reshape(-1, channels)
     
-    return result
+    if pixels.dtype == np.uint8 and channels <= 4:
+        keys = np.zeros(len(flat), dtype=np.uint64)
+        for channel in range(channels):
+            keys |= flat[:, channel].astype(np.uint64) << np.uint64(8 * channel)
+        
+        def decode(packed: np.ndarray) -> np.ndarray:
+            shifts = np.arange(channels, dtype=np.uint64) * np.uint64(8)
+            values = (packed[:, np.newaxis] >> shifts) & np.uint64(0xFF)
+            return values.astype(np.uint8).reshape((-1,) + pixels.shape[2:])
+        
+        return keys, decode
+    
+    palette, inverse = np.unique(flat, axis=0, return_inverse=True)
+    
+    def decode(packed: np.ndarray) -> np.ndarray:
+        return palette[packed.astype(np.intp)].reshape((-1,) + pixels.shape[2:])
+    
+    return inverse.reshape(-1).astype(np.uint64), decode
+
 
+def _majority_blocks(
+    img_array: np.ndarray,
+    row_edges: np.ndarray,
+    col_edges: np.ndarray
+) -> np.ndarray:
+    """
+    Find the most frequent color in every block.
+    
+    Pixels are keyed by (block index, packed color) and sorted, so each run
+    of equal keys is one color within one block. The winning run has the
+    highest count, and ties go to the run whose first pixel comes earliest,
+    which matches Counter.most_common over the block in row-major order.
+    Block rows are processed in chunks of about MAJORITY_CHUNK_PIXELS.
+    Empty blocks are left as zeros.
+    """
+    target_height = len(row_edges) - 1
+    target_width = len(col_edges) - 1
+    output = np.zeros((target_height, target_width) + img_array.shape[2:], dtype=img_array.dtype)
+    flat_output = output.reshape((target_height * target_width,) + img_array.shape[2:])
+    
+    covered_width = int(col_edges[-1])
+    if covered_width == 0:
+        return output
+    col_ids = np.repeat(np.arange(target_width, dtype=np.uint64), np.diff(col_edges))
+    rows_per_chunk = max(1, MAJORITY_CHUNK_PIXELS // covered_width)
+    
+    row = 0
+    while row < target_height:
+        # Grow the chunk by whole block rows until it is large enough
+        first_row = row
+        while row < target_height and (
+            row == first_row or row_edges[row + 1] - row_edges[first_row] <= rows_per_chunk
+        ):
+            row += 1
+        y_start, y_end = int(row_edges[first_row]), int(row_edges[row])
+        if y_end <= y_start:
+            continue
+        
+        keys, decode = _pack_pixels(img_array[y_start:y_end, :covered_width])
+        row_ids = np.repeat(
+            np.arange(first_row, row, dtype=np.uint64),
+            np.diff(row_edges[first_row:row + 1])
+        )
+        block_ids = (row_ids[:, np.newaxis] * np.uint64(target_width) + col_ids).reshape(-1)
+        
+        # Sort by (block, color); positions are row-major within the chunk
+        combined = (block_ids << np.uint64(32)) | keys
+        order = np.argsort(combined)
+        combined = combined[order]
+        
+        run_starts = np.flatnonzero(np.concatenate(([True], combined[1:] != combined[:-1])))
+        run_counts = np.diff(np.append(run_starts, len(combined)))
+        run_first = np.minimum.reduceat(order, run_starts)
+        run_keys = combined[run_starts]
+        run_blocks = run_keys >> np.uint64(32)
+        
+        # Per block: highest count first, then earliest first occurrence
+        ranked = np.lexsort((run_first, -run_counts, run_blocks))
+        ranked_blocks = run_blocks[ranked]
+        winners = ranked[np.concatenate(([True], ranked_blocks[1:] != ranked_blocks[:-1]))]
+        
+        flat_output[run_blocks[winners].astype(np.intp)] = decode(
+            run_keys[winners] & np.uint64(0xFFFFFFFF)
+        )
+    
+    return output
@@ -0,0 +1,104 @@
+"""
+Incremental PNG encoder for writing large images strip by strip.
+"""
+
+import struct
+import zlib
+
+import numpy as np
+
+
+# PNG color types for the modes we write
+_COLOR_TYPES = {'L': 0, 'RGB': 2, 'RGBA': 6}
+
+
+class PNGStripWriter:
+    """
+    Write an 8-bit PNG one strip of rows at a time.
+    
+    Rows are filtered with the PNG 'Up' filter (difference to the row above),
+    which turns the repeated rows of an upscaled pixel grid into zeros, and
+    compressed into IDAT chunks as they arrive. Only the current strip and
+    the compressor state are held in memory.
+    
+    Usage:
+        with PNGStripWriter(path, width, height, 'RGB') as writer:
+            writer.write_rows(rows)  # (n, width[, channels]) uint8 arrays
+    """
+    
+    def __init__(self, path: str, width: int, height: int, mode: str, compress_level: int = 6,
+                 chunk_size: int = 256 * 1024):
+        if mode not in _COLOR_TYPES:
+            raise ValueError(f'Unsupported PNG mode: {mode}')
+        self.width = width
+        self.height = height
+        self.mode = mode
+        self.rows_written = 0
+        self._channels = len(mode)
+        self._chunk_size = chunk_size
+        self._compressor = zlib.compressobj(compress_level)
+        self._pending = []
+        self._pending_bytes = 0
+        self._previous_row = np.zeros(width * self._channels, dtype=np.uint8)
+        self._file = open(path, 'wb')
+        
+        self._file.write(b'\x89PNG\r\n\x1a\n')
+        self._write_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, _COLOR_TYPES[mode], 0, 0, 0))
+    
+    def __enter__(self) -> 'PNGStripWriter':
+        return self
+    
+    def __exit__(self, exc_type, exc, traceback) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self._file.close()
+    
+    def write_rows(self, rows: np.ndarray) -> None:
+        """Append rows of shape (n, width) or (n, width, channels)."""
+        if len(rows) == 0:
+            return
+        rows = np.ascontiguousarray(rows, dtype=np.uint8).reshape(len(rows), -1)
+        if rows.shape[1] != self.width * self._channels:
+            raise ValueError('Row width does not match the image')
+        if self.rows_written + len(rows) > self.height:
+            raise ValueError('Too many rows for the image height')
+        
+        # 'Up' filter: each row minus the one above, modulo 256
+        filtered = np.empty((len(rows), rows.shape[1] + 1), dtype=np.uint8)
+        filtered[:, 0] = 2
+        filtered[0, 1:] = rows[0] - self._previous_row
+        filtered[1:, 1:] = rows[1:] - rows[:-1]
+        self._previous_row = rows[-1].copy()
+        self.rows_written += len(rows)
+        
+        self._pending.append(self._compressor.compress(filtered.tobytes()))
+        self._pending_bytes += len(self._pending[-1])
+        if self._pending_bytes >= self._chunk_size:
+            self._flush_idat()
+    
+    def close(self) -> None:
+        """Finish the stream; all rows must have been written."""
+        if self._file.closed:
+            return
+        if self.rows_written != self.height:
+            self._file.close()
+            raise ValueError(f'Expected {self.height} rows, got {self.rows_written}')
+        self._pending.append(self._compressor.flush())
+        self._pending_bytes += len(self._pending[-1])
+        self._flush_idat()
+        self._write_chunk(b'IEND', b'')
+        self._file.close()
+    
+    def _flush_idat(self) -> None:
+        data = b''.join(self._pending)
+        self._pending = []
+        self._pending_bytes = 0
+        if data:
+            self._write_chunk(b'IDAT', data)
+    
+    def _write_chunk(self, chunk_type: bytes, data: bytes) -> None:
+        self._file.write(struct.pack('>I', len(data)))
+        self._file.write(chunk_type)
+        self._file.write(data)
+        self._file.write(struct.pack('>I', zlib.crc32(chunk_type + data) & 0xFFFFFFFF))
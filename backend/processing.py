@@ -0,0 +1,834 @@
+"""
+Processing chains shared by the API routes and background workers.
+"""
+
+import math
+import os
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+from PIL import Image
+
+from pixelation import (
+    PIXELATION_METHODS, DRAFT_METHODS, clamp_grid, pixelate_image, pixelate_array, upscale_grid,
+    pixelate_file_tiled, grid_scale, draft_reduction, apply_draft, average_from_integral
+)
+from background_removal import remove_background, background_mask, with_alpha
+from encoding import OUTPUT_FORMATS, PNG_COMPRESS_LEVEL, WEBP_MAX_SIZE, palette_image, save_image
+from geometry import MAX_CRUNCH, crop_box, crop_image, rotate_image, crunch_image, crunch_size
+from cache import load_raw
+from metrics import timed
+from palette import MAX_PALETTE_COLORS, kmeans_palette, quantize_grid, resolve_palette
+from utils import array_mode, get_image_dimensions, working_mode
+
+
+MAX_OUTPUT_SCALE = 64  # Largest integer multiplier for a pixelated grid
+
+# Pixelate-only chains on images at least this large run strip by strip
+TILED_MIN_PIXELS = int(float(os.environ.get('PXL8_TILED_MIN_MP', 16)) * 1000 * 1000)
+
+# Source pixels to keep along each block side when decoding JPEGs in draft mode (0 disables)
+DRAFT_MIN_BLOCK_PIXELS = int(os.environ.get('PXL8_DRAFT_MIN_BLOCK_PIXELS', 8))
+
+# Colors of a palette derived with palette 'auto' unless palette_colors says otherwise
+DEFAULT_PALETTE_COLORS = 16
+
+# Default longer side of the background-removal proxy mask (0 keeps full resolution)
+BG_PROXY_SIZE = int(os.environ.get('PXL8_BG_PROXY_SIZE', 0))
+
+# Fewest source pixels per grid block (along each side) a preview is rendered
+# from, and the longest side of a preview image
+PREVIEW_MIN_BLOCK_PIXELS = int(os.environ.get('PXL8_PREVIEW_MIN_BLOCK_PIXELS', 4))
+PREVIEW_MAX_SIZE = int(os.environ.get('PXL8_PREVIEW_MAX_SIZE', 512))
+
+# Keep decoded uploads as raw .npy files that every process memory-maps
+# (PXL8_RAW_DECODED=1) instead of a private decoded copy per process
+RAW_DECODED_UPLOADS = os.environ.get('PXL8_RAW_DECODED', '0') == '1'
+
+# Operations that only move or resample pixels; by default they run first
+GEOMETRY_OPERATIONS = ('crop', 'rotate', 'crunch')
+OPERATIONS = GEOMETRY_OPERATIONS + ('pixelate', 'remove_background')
+
+
+def parse_output_scale(value) -> Optional[int]:
+    """
+    Parse the output_scale request option.
+    
+    Returns None for 'original' (scale back up to the source size) or the
+    integer multiplier applied to the pixelated grid ('grid' means 1).
+    Raises ValueError for anything else.
+    """
+    if value is None or value == 'original':
+        return None
+    if value == 'grid':
+        return 1
+    scale = int(value)
+    if scale < 1 or scale > MAX_OUTPUT_SCALE:
+        raise ValueError(f'output_scale must be between 1 and {MAX_OUTPUT_SCALE}')
+    return scale
+
+
+def parse_proxy_size(value, name: str = 'bg_proxy_size') -> Optional[int]:
+    """
+    Parse a background proxy size request option.
+    
+    Args:
+        value: The option's value from the request, or None if absent
+        name: The option's name, for error messages ('bg_proxy_size' in
+            /api/process, 'proxy_size' in /api/remove-background)
+    
+    Returns:
+        None to compute the background mask at full resolution, or the
+        longer side of the proxy the mask is computed on. Raises ValueError
+        for anything else.
+    """
+    proxy_size = BG_PROXY_SIZE if value is None else int(value)
+    if proxy_size < 0:
+        raise ValueError(f'{name} must not be negative')
+    return proxy_size or None
+
+
+def draft_threshold(data: Dict[str, Any], method: str) -> Optional[int]:
+    """
+    The JPEG draft-mode threshold (min_block_pixels) a pixelation request asks for.
+    
+    Args:
+        data: Request JSON; "draft": false disables draft decoding
+        method: Pixelation method of the request
+    
+    Returns:
+        DRAFT_MIN_BLOCK_PIXELS, or None to decode at full size (when draft
+        is off, and always for 'nearest')
+    """
+    if method not in DRAFT_METHODS or not data.get('draft', True):
+        return None
+    return DRAFT_MIN_BLOCK_PIXELS
+
+
+def grid_info(
+    original_size: Tuple[int, int],
+    grid_size: Tuple[int, int],
+    output_size: Tuple[int, int]
+) -> Dict[str, Any]:
+    """Describe a pixelated result so clients can upscale it themselves."""
+    scale_x, scale_y = grid_scale(original_size, grid_size)
+    return {
+        'width': output_size[0],
+        'height': output_size[1],
+        'grid_width': grid_size[0],
+        'grid_height': grid_size[1],
+        'scale_x': scale_x,
+        'scale_y': scale_y
+    }
+
+
+def parse_palette(value, colors=None) -> Optional[Any]:
+    """
+    Parse the palette and palette_colors request options.
+    
+    Returns None for no palette, a list of [r, g, b] colors for a fixed
+    palette name or a color list, or the color count of a palette to derive
+    from each image's grid for 'auto'. Raises ValueError for anything else.
+    """
+    if value is None:
+        return None
+    if value == 'auto':
+        count = DEFAULT_PALETTE_COLORS if colors is None else int(colors)
+        if count < 2 or count > MAX_PALETTE_COLORS:
+            raise ValueError(f'palette_colors must be between 2 and {MAX_PALETTE_COLORS}')
+        return count
+    return resolve_palette(value)
+
+
+def parse_crop(value) -> Optional[Dict[str, Any]]:
+    """
+    Parse the crop request option.
+    
+    Accepts an aspect ratio string ('1:1', '3:2', '4:3') for a centered crop,
+    or an object with x, y, width and height in pixels. Returns the crop
+    operation params, or None when no crop was requested. Raises ValueError
+    for anything else.
+    """
+    if value is None:
+        return None
+    if isinstance(value, str):
+        crop_box((1, 1), aspect_ratio=value)  # Validates the ratio
+        return {'aspect_ratio': value, 'box': None}
+    if isinstance(value, dict):
+        if not all(key in value for key in ('x', 'y', 'width', 'height')):
+            raise ValueError('crop needs x, y, width and height')
+        box = [int(value[key]) for key in ('x', 'y', 'width', 'height')]
+        if box[2] < 1 or box[3] < 1:
+            raise ValueError('crop width and height must be positive')
+        return {'aspect_ratio': None, 'box': box}
+    raise ValueError('crop must be an aspect ratio or an {x, y, width, height} object')
+
+
+def parse_output_options(data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Parse the output_format, png_palette and compress_level request options.
+    
+    Returns the encode params, or None when all are left at their defaults
+    (results keep the upload's format, or PNG once transparency is added).
+    Raises ValueError for invalid values.
+    """
+    output_format = data.get('output_format')
+    palette = bool(data.get('png_palette', False))
+    compress_level = data.get('compress_level')
+    if output_format is None and not palette and compress_level is None:
+        return None
+    
+    if output_format is not None and (not isinstance(output_format, str) or output_format not in OUTPUT_FORMATS):
+        raise ValueError(f'output_format must be one of {sorted(OUTPUT_FORMATS)}')
+    if compress_level is not None:
+        try:
+            compress_level = int(compress_level)
+        except (TypeError, ValueError):
+            raise ValueError('compress_level must be an integer')
+        if compress_level < 0 or compress_level > 9:
+            raise ValueError('compress_level must be between 0 and 9')
+    return {'format': output_format, 'palette': palette, 'compress_level': compress_level}
+
+
+def build_operations(data: Dict[str, Any]) -> List[list]:
+    """
+    Turn /api/process options into an ordered operation chain.
+    
+    Each operation is a JSON-serializable [name, params] pair, so the chain
+    doubles as a cache key and can be sent to worker processes.
+    
+    The chain runs in operation_order when given (a list naming every
+    enabled operation once); otherwise crop, rotate and crunch come first,
+    followed by pixelation and background removal in process_order.
+    Output options, if any, end the chain as an 'encode' entry.
+    Raises ValueError for invalid options.
+    """
+    pixelate_enabled = data.get('pixelate_enabled', False)
+    remove_bg_enabled = data.get('remove_bg_enabled', False)
+    process_order = data.get('process_order', 'pixelate_first')  # 'pixelate_first' or 'bg_first'
+    
+    try:
+        scale = parse_output_scale(data.get('output_scale'))
+    except (TypeError, ValueError) as e:
+        raise ValueError(f'Invalid output_scale: {str(e)}')
+    
+    try:
+        proxy_size = parse_proxy_size(data.get('bg_proxy_size'))
+    except (TypeError, ValueError) as e:
+        raise ValueError(f'Invalid bg_proxy_size: {str(e)}')
+    
+    try:
+        palette = parse_palette(data.get('palette'), data.get('palette_colors'))
+    except (TypeError, ValueError) as e:
+        raise ValueError(f'Invalid palette: {str(e)}')
+    
+    try:
+        crop = parse_crop(data.get('crop'))
+    except (TypeError, ValueError) as e:
+        raise ValueError(f'Invalid crop: {str(e)}')
+    
+    try:
+        rotate = int(data.get('rotate', 0)) % 360
+    except (TypeError, ValueError):
+        raise ValueError('rotate must be an integer')
+    if rotate % 90:
+        raise ValueError('rotate must be a multiple of 90 degrees')
+    
+    try:
+        crunch = int(data.get('crunch', 0))
+    except (TypeError, ValueError):
+        raise ValueError('crunch must be an integer')
+    if crunch < 0 or crunch > MAX_CRUNCH:
+        raise ValueError(f'crunch must be between 0 and {MAX_CRUNCH}')
+    
+    method = data.get('pixelation_method', 'average')
+    if pixelate_enabled and method not in PIXELATION_METHODS:
+        raise ValueError(f'pixelation_method must be one of {list(PIXELATION_METHODS)}')
+    
+    try:
+        target_width = int(data.get('target_width', 100))
+        target_height = int(data.get('target_height', 100))
+    except (TypeError, ValueError):
+        raise ValueError('target_width and target_height must be integers')
+    
+    try:
+        threshold = float(data.get('bg_threshold', 50.0))
+    except (TypeError, ValueError):
+        raise ValueError('bg_threshold must be a number')
+    
+    enabled = {}
+    if crop is not None:
+        enabled['crop'] = crop
+    if rotate:
+        enabled['rotate'] = {'degrees': rotate}
+    if crunch:
+        enabled['crunch'] = {'count': crunch}
+    if pixelate_enabled:
+        enabled['pixelate'] = {
+            'target_width': max(1, target_width),
+            'target_height': max(1, target_height),
+            'method': method,
+            'scale': scale,
+            'min_block_pixels': draft_threshold(data, method),
+            'palette': palette
+        }
+    if remove_bg_enabled:
+        enabled['remove_background'] = {
+            'threshold': threshold,
+            'proxy_size': proxy_size
+        }
+    
+    if not enabled:
+        raise ValueError('At least one processing option must be enabled')
+    
+    order = data.get('operation_order')
+    if order is None:
+        order = list(GEOMETRY_OPERATIONS) + ['pixelate', 'remove_background']
+        if process_order != 'pixelate_first':  # bg_first
+            order[-2:] = ['remove_background', 'pixelate']
+        order = [operation for operation in order if operation in enabled]
+    elif (
+        not isinstance(order, list) or not all(isinstance(operation, str) for operation in order)
+        or sorted(order) != sorted(enabled)
+    ):
+        raise ValueError(f'operation_order must list each enabled operation once: {sorted(enabled)}')
+    
+    operations = [[operation, enabled[operation]] for operation in order]
+    output = parse_output_options(data)
+    if output is not None:
+        operations.append(['encode', output])
+    return operations
+
+
+def split_output(operations: List[list]) -> Tuple[List[list], Dict[str, Any]]:
+    """Separate the image operations of a chain from its trailing encode params."""
+    if operations and operations[-1][0] == 'encode':
+        return operations[:-1], operations[-1][1]
+    return operations, {'format': None, 'palette': False, 'compress_level': None}
+
+
+def operation_size(size: Tuple[int, int], operation: str, params: Dict[str, Any]) -> Tuple[int, int]:
+    """(width, height) an operation produces from an image of the given size."""
+    if operation == 'crop':
+        left, top, right, bottom = crop_box(size, params['aspect_ratio'], params['box'])
+        return (right - left, bottom - top)
+    if operation == 'rotate':
+        return size if params['degrees'] % 180 == 0 else (size[1], size[0])
+    if operation == 'crunch':
+        return crunch_size(size, params['count'])
+    if operation == 'pixelate' and params['scale'] is not None:
+        target_width, target_height = clamp_grid(size, params['target_width'], params['target_height'])
+        return (target_width * params['scale'], target_height * params['scale'])
+    if operation == 'encode' and params['format'] == 'webp' and max(size) > WEBP_MAX_SIZE:
+        raise ValueError(f'WebP output is limited to {WEBP_MAX_SIZE} pixels per side')
+    return size
+
+
+def chain_size(size: Tuple[int, int], operations: List[list]) -> Tuple[int, int]:
+    """
+    (width, height) a whole chain produces from an image of the given size.
+    
+    Only needs the source size, so requests can be checked before decoding.
+    Raises ValueError when a crop falls outside the image at its step, or
+    when any step would produce more than Image.MAX_IMAGE_PIXELS pixels.
+    """
+    for operation, params in operations:
+        size = operation_size(size, operation, params)
+        if size[0] * size[1] > Image.MAX_IMAGE_PIXELS:
+            raise ValueError(
+                f'{operation} would produce {size[0]}x{size[1]} pixels; '
+                f'at most {Image.MAX_IMAGE_PIXELS / 1e6:.0f} megapixels are allowed'
+            )
+    return size
+
+
+def apply_operations(
+    image: Union[Image.Image, np.ndarray],
+    operations: List[list],
+    integral: Optional[np.ndarray] = None
+) -> Image.Image:
+    """
+    Run an operation chain on an image, in order.
+    
+    Every operation works on the in-memory image from the previous one;
+    nothing is encoded until the chain is done (a trailing 'encode' entry
+    is ignored here; see process_upload). Once leading geometry
+    operations have run, a remaining chain that pixelates and removes the
+    background runs fused on a single RGBA buffer (see
+    apply_operations_fused); anything else runs each operation on PIL
+    images in turn. Given the image's summed-area table, chains that
+    uses_integral() accepts run from the table without reading the image.
+    
+    The image may also be a decoded L, RGB or RGBA pixel array (e.g. from
+    load_raw); pixelation and background removal then read it in place,
+    and it becomes a PIL image only for geometry operations.
+    """
+    operations, _ = split_output(operations)
+    if integral is not None and uses_integral(operations):
+        return apply_operations_integral(integral, operations)
+    if isinstance(image, np.ndarray) and operations and operations[0][0] in GEOMETRY_OPERATIONS:
+        image = Image.fromarray(image, array_mode(image))
+    leading = 0
+    while leading < len(operations) and operations[leading][0] in GEOMETRY_OPERATIONS:
+        image = apply_operation(image, *operations[leading])
+        leading += 1
+    operations = operations[leading:]
+    
+    names = {operation for operation, _ in operations}
+    if names == {'pixelate', 'remove_background'} and _size_and_mode(image)[1] in ('L', 'RGB', 'RGBA'):
+        return apply_operations_fused(image, operations)
+    
+    for operation, params in operations:
+        image = apply_operation(image, operation, params)
+    return image
+
+
+def apply_operation(image: Image.Image, operation: str, params: Dict[str, Any]) -> Image.Image:
+    """Run a single operation of a chain on a PIL image."""
+    if operation == 'crop':
+        return crop_image(image, params['aspect_ratio'], params['box'])
+    if operation == 'rotate':
+        return rotate_image(image, params['degrees'])
+    if operation == 'crunch':
+        return crunch_image(image, params['count'])
+    if operation == 'pixelate':
+        return pixelate_image(
+            image, params['target_width'], params['target_height'],
+            params['method'], scale=params['scale'],
+            min_block_pixels=params.get('min_block_pixels'), palette=params.get('palette')
+        )
+    if operation == 'remove_background':
+        return remove_background(image, params['threshold'], proxy_size=params.get('proxy_size'))
+    raise ValueError(f'Unknown operation: {operation}')
+
+
+def apply_operations_fused(image: Union[Image.Image, np.ndarray], operations: List[list]) -> Image.Image:
+    """
+    Run a pixelate / remove_background chain on one numpy buffer.
+    
+    The image is converted to an array once, pixelation reduces it to the
+    compact grid, the background mask becomes the alpha channel of whatever
+    the buffer holds at that point, and the final buffer is converted back
+    to PIL once and upscaled with color and alpha together.
+    
+    Removing the background after pixelating therefore computes the mask on
+    the grid rather than on the upscaled image, so the mask follows block
+    edges; the output equals the sequential chain at output_scale 'grid' and
+    in bg_first order.
+    
+    Args:
+        image: PIL Image in L, RGB or RGBA mode, or such a pixel array
+            (used as the buffer without a copy)
+        operations: Chain from build_operations()
+    
+    Returns:
+        Processed RGBA PIL Image
+    """
+    if isinstance(image, np.ndarray):
+        output_size = (image.shape[1], image.shape[0])
+        pixels = image
+    else:
+        output_size = image.size
+        
+        # Decode coarse grids from a reduced-size JPEG, as pixelate_image would
+        operation, params = operations[0]
+        if operation == 'pixelate' and params.get('min_block_pixels'):
+            apply_draft(image, params['target_width'], params['target_height'], params['min_block_pixels'])
+        
+        if getattr(image, 'tile', None):
+            with timed('decode', image.format or '', image.size):
+                image.load()
+        pixels = np.asarray(image)
+    
+    for operation, params in operations:
+        if operation == 'pixelate':
+            target_width, target_height = clamp_grid(
+                (pixels.shape[1], pixels.shape[0]), params['target_width'], params['target_height']
+            )
+            pixels = pixelate_array(pixels, target_width, target_height, params['method'], params.get('palette'))
+            if params['scale'] is not None:
+                output_size = (target_width * params['scale'], target_height * params['scale'])
+        elif operation == 'remove_background':
+            pixels = with_alpha(pixels, background_mask(pixels, params['threshold'], params.get('proxy_size')))
+        else:
+            raise ValueError(f'Unknown operation: {operation}')
+    
+    return upscale_grid(Image.fromarray(pixels, 'RGBA'), output_size)
+
+
+def uses_integral(operations: List[list]) -> bool:
+    """
+    Whether a chain can run from its source's summed-area table: 'average'
+    pixelation first, optionally followed by background removal.
+    """
+    operations, _ = split_output(operations)
+    if not operations or operations[0][0] != 'pixelate' or operations[0][1]['method'] != 'average':
+        return False
+    return [operation for operation, _ in operations[1:]] in ([], ['remove_background'])
+
+
+def apply_operations_integral(table: np.ndarray, operations: List[list]) -> Image.Image:
+    """
+    Run a chain uses_integral() accepts from a summed-area table.
+    
+    The grid comes from average_from_integral in time proportional to its
+    size, then gets the palette, background mask and upscale the chain
+    would give it from the image itself (apply_operations_fused, or
+    pixelate_image for a pixelate-only chain), with identical results.
+    
+    Args:
+        table: Table from integral_image() of the source, e.g. a memory map
+            from IntegralImageStore
+        operations: Chain from build_operations()
+    
+    Returns:
+        Processed PIL Image
+    """
+    operations, _ = split_output(operations)
+    params = operations[0][1]
+    target_width, target_height = clamp_grid(
+        (table.shape[1] - 1, table.shape[0] - 1), params['target_width'], params['target_height']
+    )
+    
+    pixels = average_from_integral(table, target_width, target_height)
+    if params.get('palette') is not None:
+        pixels = quantize_grid(pixels, params['palette'])
+    
+    if params['scale'] is None:
+        output_size = (table.shape[1] - 1, table.shape[0] - 1)
+    else:
+        output_size = (target_width * params['scale'], target_height * params['scale'])
+    
+    if len(operations) > 1:
+        bg_params = operations[1][1]
+        pixels = with_alpha(pixels, background_mask(pixels, bg_params['threshold'], bg_params.get('proxy_size')))
+        return upscale_grid(Image.fromarray(pixels, 'RGBA'), output_size)
+    return upscale_grid(Image.fromarray(pixels), output_size)
+
+
+def derives_palette(operations: List[list]) -> bool:
+    """Whether a chain derives its palette from each image (palette 'auto')."""
+    return any(
+        operation == 'pixelate' and isinstance(params.get('palette'), int) for operation, params in operations
+    )
+
+
+def derive_palette(image: Image.Image, operations: List[list]) -> Optional[List[List[int]]]:
+    """
+    Fit the palette a chain with palette 'auto' would derive for an image.
+    
+    Runs the chain up to its pixelate step, reduces to the grid and fits
+    k-means on it. Substituting the result with with_palette() lets a batch
+    share one palette instead of deriving one per image.
+    
+    Returns:
+        [r, g, b] colors, or None if the chain derives no palette
+    """
+    if not derives_palette(operations):
+        return None
+    index = next(index for index, (operation, _) in enumerate(operations) if operation == 'pixelate')
+    params = operations[index][1]
+    
+    if index == 0 and params.get('min_block_pixels'):
+        apply_draft(image, params['target_width'], params['target_height'], params['min_block_pixels'])
+    image = apply_operations(image, operations[:index]) if index else image
+    if getattr(image, 'tile', None):
+        with timed('decode', image.format or '', image.size):
+            image.load()
+    
+    mode = working_mode(image)
+    pixels = np.asarray(image if image.mode == mode else image.convert(mode))
+    grid = pixelate_array(pixels, params['target_width'], params['target_height'], params['method'])
+    return kmeans_palette(grid, params['palette'])
+
+
+def with_palette(operations: List[list], colors: List[List[int]]) -> List[list]:
+    """The chain with its pixelate step using a fixed palette of these colors."""
+    return [
+        [operation, {**params, 'palette': colors} if operation == 'pixelate' else params]
+        for operation, params in operations
+    ]
+
+
+def _grid_operations(operations: List[list], mode: str) -> Optional[List[list]]:
+    """
+    The chain with pixelation stopping at the grid, when its result is just
+    that grid upscaled (pixelate last, or pixelate then remove_background on
+    the fused path, which masks the grid). None for any other chain.
+    """
+    names = [operation for operation, _ in operations if operation not in GEOMETRY_OPERATIONS]
+    leading = len(operations) - len(names)
+    if any(operation in GEOMETRY_OPERATIONS for operation, _ in operations[leading:]):
+        return None
+    if names[-1:] != ['pixelate'] and not (
+        names == ['pixelate', 'remove_background'] and mode in ('L', 'RGB', 'RGBA')
+    ):
+        return None
+    return [
+        [operation, {**params, 'scale': 1} if operation == 'pixelate' else params]
+        for operation, params in operations
+    ]
+
+
+def should_tile(filepath: str, operations: List[list]) -> bool:
+    """
+    Whether a chain should run with pixelate_file_tiled instead of in memory.
+    
+    Only pixelate-only chains whose output is PNG anyway (a PNG upload, or
+    an explicit 'png' format) with no derived palette on images of at least
+    TILED_MIN_PIXELS qualify, so a JPEG upload keeps its format; the check
+    reads just the image header.
+    """
+    operations, output = split_output(operations)
+    if len(operations) != 1 or operations[0][0] != 'pixelate':
+        return False
+    output_ext = output['format'] or os.path.splitext(filepath)[1][1:].lower()
+    if output_ext != 'png':
+        return False
+    if isinstance(operations[0][1].get('palette'), int):
+        return False  # A derived palette needs the whole grid
+    width, height = get_image_dimensions(filepath)
+    return width * height >= TILED_MIN_PIXELS
+
+
+def needs_decoded_image(filepath: str, operations: List[list]) -> bool:
+    """
+    Whether a chain should start from a fully decoded upload.
+    
+    False when the chain is better served by opening the file lazily:
+    large pixelate-only chains run tiled, and chains starting with a coarse
+    pixelation of a JPEG decode it in draft mode.
+    """
+    if should_tile(filepath, operations):
+        return False
+    
+    operation, params = operations[0]
+    if operation == 'pixelate' and params.get('min_block_pixels'):
+        with Image.open(filepath) as image:
+            reduction = draft_reduction(
+                image, params['target_width'], params['target_height'], params['min_block_pixels']
+            )
+        return reduction == 1
+    return True
+
+
+def preview_operations(
+    operations: List[list],
+    source_size: Tuple[int, int],
+    level_size: Tuple[int, int]
+) -> Optional[List[list]]:
+    """
+    The chain rescaled to run on a reduced copy of its source, for previews.
+    
+    Crop boxes are scaled to the copy, pixelation stops at the grid and
+    reads every pixel of the copy (no draft decoding), and output options
+    are dropped. Returns None when geometry follows pixelation, since its
+    crop boxes are in output pixels.
+    """
+    operations, _ = split_output(operations)
+    preview = []
+    size, scaled = source_size, level_size
+    pixelated = False
+    for operation, params in operations:
+        if operation in GEOMETRY_OPERATIONS and pixelated:
+            return None
+        preview_params = params
+        if operation == 'crop' and params['box'] is not None:
+            left, top, right, bottom = crop_box(size, None, params['box'])
+            x_factor, y_factor = scaled[0] / size[0], scaled[1] / size[1]
+            x = min(int(left * x_factor), scaled[0] - 1)
+            y = min(int(top * y_factor), scaled[1] - 1)
+            width = max(1, min(scaled[0], math.ceil(right * x_factor)) - x)
+            height = max(1, min(scaled[1], math.ceil(bottom * y_factor)) - y)
+            preview_params = {**params, 'box': [x, y, width, height]}
+        elif operation == 'pixelate':
+            preview_params = {**params, 'scale': 1, 'min_block_pixels': None}
+            pixelated = True
+        preview.append([operation, preview_params])
+        size = operation_size(size, operation, params)
+        scaled = operation_size(scaled, operation, preview_params)
+    return preview
+
+
+def preview_level(
+    operations: List[list],
+    source_size: Tuple[int, int],
+    level_sizes: List[Tuple[int, int]],
+    min_block_pixels: int = PREVIEW_MIN_BLOCK_PIXELS,
+    max_size: int = PREVIEW_MAX_SIZE
+) -> Optional[int]:
+    """
+    Pick the reduced copy of a source a preview of the chain can start from.
+    
+    A pixelating chain needs at least min_block_pixels pixels per grid
+    block along each side where it pixelates; any other chain needs an
+    output of at least max_size on its longest side.
+    
+    Args:
+        operations: Chain from build_operations()
+        source_size: (width, height) of the full-resolution source
+        level_sizes: (width, height) of each reduced copy, largest first
+    
+    Returns:
+        Index of the smallest suitable copy, or None to use the source itself
+    """
+    for index in reversed(range(len(level_sizes))):
+        preview = preview_operations(operations, source_size, level_sizes[index])
+        if preview is None:
+            return None
+        size = level_sizes[index]
+        for operation, params in preview:
+            if operation == 'pixelate':
+                if (size[0] < params['target_width'] * min_block_pixels or
+                        size[1] < params['target_height'] * min_block_pixels):
+                    break
+                return index
+            size = operation_size(size, operation, params)
+        else:
+            if max(size) >= max_size:
+                return index
+    return None
+
+
+def render_preview(
+    image: Image.Image,
+    operations: List[list],
+    max_size: int = PREVIEW_MAX_SIZE
+) -> Image.Image:
+    """
+    Render a quick preview of a chain from an image (usually a reduced copy).
+    
+    Args:
+        image: PIL Image the chain starts from
+        operations: Chain from preview_operations() for this image
+        max_size: Longest side of the preview
+    
+    Returns:
+        The pixelated grid upscaled by the largest integer factor that fits
+        max_size (the bare grid if it is larger), or for chains without
+        pixelation the result scaled down to fit max_size
+    """
+    with timed('preview', image.mode, image.size):
+        image = apply_operations(image, operations)
+        if any(operation == 'pixelate' for operation, _ in operations):
+            factor = max(1, max_size // max(image.size))
+            return upscale_grid(image, (image.width * factor, image.height * factor))
+        if max(image.size) > max_size:
+            image = image.copy()
+            image.thumbnail((max_size, max_size), Image.LANCZOS)
+        return image
+
+
+def process_upload(
+    filepath: str,
+    operations: List[list],
+    processed_folder: str,
+    cache_key: str,
+    image: Optional[Union[Image.Image, np.ndarray]] = None,
+    integral: Optional[np.ndarray] = None
+) -> Dict[str, Any]:
+    """
+    Run an operation chain on an upload and save the result.
+    
+    Args:
+        filepath: Path to the uploaded image
+        operations: Chain from build_operations()
+        processed_folder: Directory for the output file
+        cache_key: Result cache key; its prefix makes the output name unique
+        image: Already decoded upload as a PIL Image or pixel array, if
+            available; otherwise the raw decoded upload is memory-mapped
+            when RAW_DECODED_UPLOADS is set and the chain needs every pixel,
+            and the file is opened lazily from filepath when not
+        integral: The upload's summed-area table, if available; chains that
+            uses_integral() accepts then never decode the upload
+    
+    Returns:
+        Response fields: 'processed_filename' plus grid info when pixelating
+    """
+    operations, output = split_output(operations)
+    if image is None:
+        if should_tile(filepath, operations):
+            return _process_upload_tiled(
+                filepath, operations[0][1], processed_folder, cache_key, output['compress_level']
+            )
+        if RAW_DECODED_UPLOADS and integral is None and needs_decoded_image(filepath, operations):
+            image, _ = load_raw(filepath)
+        else:
+            image = Image.open(filepath)
+    original_size, mode = _size_and_mode(image)
+    
+    # Determine output format (the requested one, else PNG when transparency was added)
+    filename = os.path.basename(filepath)
+    base, ext = filename.rsplit('.', 1)
+    remove_bg_enabled = any(operation == 'remove_background' for operation, _ in operations)
+    if output['format'] is not None:
+        output_ext = output['format']
+    else:
+        output_ext = 'png' if remove_bg_enabled else ext.lower()
+    output_format = 'JPEG' if output_ext in ('jpg', 'jpeg') else output_ext.upper()
+    
+    grid_operations = None
+    if output['palette'] and output_format == 'PNG':
+        grid_operations = _grid_operations(operations, mode)
+    if grid_operations is not None:
+        # Index the colors of the compact grid and upscale 1-byte palette
+        # indices; same pixels as indexing the upscaled image, at a fraction
+        # of the cost
+        image = apply_operations(image, grid_operations, integral)
+        image = upscale_grid(palette_image(image) or image, chain_size(original_size, operations))
+    else:
+        image = apply_operations(image, operations, integral)
+    
+    # Save processed image
+    processed_filename = f"processed_{base}_{cache_key[:16]}.{output_ext}"
+    save_image(
+        image, os.path.join(processed_folder, processed_filename), output_format,
+        palette=output['palette'], compress_level=output['compress_level']
+    )
+    
+    # Grid scale is relative to the image as it reached the pixelate step
+    result = {'processed_filename': processed_filename}
+    size = original_size
+    for operation, params in operations:
+        if operation == 'pixelate':
+            grid_size = clamp_grid(size, params['target_width'], params['target_height'])
+            result.update(grid_info(size, grid_size, image.size))
+        size = operation_size(size, operation, params)
+    return result
+
+
+def _size_and_mode(image: Union[Image.Image, np.ndarray]) -> Tuple[Tuple[int, int], str]:
+    """(width, height) and mode of a PIL image or decoded pixel array."""
+    if isinstance(image, np.ndarray):
+        return (image.shape[1], image.shape[0]), array_mode(image)
+    return image.size, image.mode
+
+
+def _process_upload_tiled(
+    filepath: str,
+    params: Dict[str, Any],
+    processed_folder: str,
+    cache_key: str,
+    compress_level: Optional[int] = None
+) -> Dict[str, Any]:
+    """Pixelate a large upload strip by strip straight to a PNG file."""
+    base = os.path.basename(filepath).rsplit('.', 1)[0]
+    processed_filename = f"processed_{base}_{cache_key[:16]}.png"
+    
+    original_size = get_image_dimensions(filepath)
+    
+    # Decode, reduction and PNG encoding are interleaved strip by strip
+    with timed('pixelate_tiled', params['method'], original_size):
+        output_size = pixelate_file_tiled(
+            filepath, os.path.join(processed_folder, processed_filename),
+            params['target_width'], params['target_height'], params['method'], scale=params['scale'],
+            min_block_pixels=params.get('min_block_pixels'),
+            compress_level=PNG_COMPRESS_LEVEL if compress_level is None else compress_level,
+            palette=params.get('palette')
+        )
+    
+    grid_size = clamp_grid(original_size, params['target_width'], params['target_height'])
+    return {
+        'processed_filename': processed_filename,
+        **grid_info(original_size, grid_size, output_size)
+    }
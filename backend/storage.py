@@ -0,0 +1,276 @@
+"""
+Content-addressed upload storage with reference counts and retention.
+"""
+
+import hashlib
+import json
+import os
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+from utils import cleanup_file, ingest_upload, place_upload
+
+
+# Interrupted uploads older than this are removed when the store starts
+STALE_PARTIAL_SECONDS = 3600
+
+
+class UploadStore:
+    """
+    Uploads stored once per distinct content, shared by reference count.
+    
+    ingest_upload names files by their content hash, so every upload of the
+    same bytes resolves to the same filename. Each upload takes a reference
+    and gets a token for it; release needs that token, so a client can only
+    give up the references it took, and the file is removed with the last
+    reference. Only token hashes are kept.
+    
+    The store also keeps each file's size and last access time, so
+    retention (expire) never has to rescan the folder, and pins files that
+    in-flight work depends on so retention skips them. Files other
+    components derive from an upload, kept in hidden derived_folders as
+    '<upload filename>.<ext>', count towards the quota with their upload;
+    expire() lists just those folders, since other processes write them. Counts, sizes and
+    access times are kept in a JSON index inside the folder so they survive
+    restarts; the folder is scanned once at startup to pick up files the
+    index does not know (counted as a single reference without a token, so
+    only retention removes them).
+    """
+    
+    INDEX_NAME = '.uploads.json'
+    
+    def __init__(self, folder: str, derived_folders: Sequence[str] = ()):
+        self.folder = folder
+        self.derived_folders = [os.path.join(folder, name) for name in derived_folders]
+        self._index_path = os.path.join(folder, self.INDEX_NAME)
+        self._files: Dict[str, Dict[str, Any]] = {}
+        self._pins: Dict[str, int] = {}
+        self._dirty = False
+        self._lock = threading.Lock()
+        
+        os.makedirs(folder, exist_ok=True)
+        try:
+            with open(self._index_path) as f:
+                self._files = json.load(f).get('files', {})
+        except (OSError, ValueError):
+            self._files = {}
+        self._sync_with_folder()
+    
+    def path(self, filename: str) -> str:
+        return os.path.join(self.folder, filename)
+    
+    def add(self, file) -> Dict[str, Any]:
+        """
+        Store an upload (or find its existing copy) and take a reference.
+        
+        Returns the ingest_upload() fields, including 'duplicate', plus the
+        reference's release 'token'.
+        Raises ValueError if the upload is not an acceptable image.
+        """
+        token = secrets.token_urlsafe(16)
+        upload = ingest_upload(
+            file, self.folder, place=lambda partial_path, filepath: self._place(partial_path, filepath, token)
+        )
+        return {**upload, 'token': token}
+    
+    def _place(self, partial_path: str, filepath: str, token: str) -> bool:
+        # Under the lock, so a concurrent last release cannot delete the
+        # file between finding the duplicate and taking the reference
+        with self._lock:
+            duplicate = place_upload(partial_path, filepath)
+            filename = os.path.basename(filepath)
+            info = self._files.get(filename)
+            if info is None:
+                info = self._files[filename] = {'refs': 0, 'bytes': os.path.getsize(filepath)}
+            info['refs'] += 1
+            info.setdefault('tokens', []).append(_token_hash(token))
+            info['access'] = time.time()
+            self._save()
+        return duplicate
+    
+    def release(self, filename: str, token: str) -> bool:
+        """
+        Drop the reference an upload's token was issued for.
+        
+        Returns True when that was the last reference and the file was
+        deleted, False while other holders remain.
+        Raises KeyError if the upload is not stored and PermissionError if
+        the token does not hold one of its references (or was released).
+        """
+        with self._lock:
+            info = self._files.get(filename)
+            if info is None:
+                raise KeyError(filename)
+            tokens = info.get('tokens', [])
+            digest = _token_hash(token)
+            if digest not in tokens:
+                raise PermissionError('Invalid upload token')
+            tokens.remove(digest)
+            info['refs'] -= 1
+            remaining = info['refs']
+            if remaining <= 0:
+                del self._files[filename]
+                cleanup_file(self.path(filename))
+            self._save()
+        return remaining <= 0
+    
+    def refcount(self, filename: str) -> int:
+        """Current references to an upload (0 if it is not stored)."""
+        with self._lock:
+            info = self._files.get(filename)
+            return info['refs'] if info else 0
+    
+    def touch(self, filename: str) -> None:
+        """Record an access; persisted with the next index write."""
+        with self._lock:
+            info = self._files.get(filename)
+            if info is not None:
+                info['access'] = time.time()
+                self._dirty = True
+    
+    def pin(self, filename: str) -> None:
+        """Protect an upload from retention until a matching unpin()."""
+        with self._lock:
+            self._pins[filename] = self._pins.get(filename, 0) + 1
+    
+    def unpin(self, filename: str) -> None:
+        """Release a pin; the end of the work counts as an access."""
+        with self._lock:
+            count = self._pins.get(filename, 0) - 1
+            if count > 0:
+                self._pins[filename] = count
+            else:
+                self._pins.pop(filename, None)
+        self.touch(filename)
+    
+    @contextmanager
+    def pinned(self, filename: str) -> Iterator[None]:
+        """Pin an upload for the duration of a block."""
+        self.pin(filename)
+        try:
+            yield
+        finally:
+            self.unpin(filename)
+    
+    def expire(self, ttl: Optional[float] = None, max_bytes: Optional[int] = None) -> List[str]:
+        """
+        Delete unpinned uploads, least recently accessed first, while they
+        are older than ttl seconds or the store, counting derived files,
+        exceeds max_bytes.
+        
+        Retention overrides reference counts. Returns the deleted filenames.
+        """
+        now = time.time()
+        removed = []
+        derived = self._derived_bytes()
+        with self._lock:
+            sizes = {
+                filename: info['bytes'] + derived.get(filename, 0) for filename, info in self._files.items()
+            }
+            total = sum(sizes.values())
+            candidates = sorted(
+                (info['access'], filename) for filename, info in self._files.items()
+                if filename not in self._pins
+            )
+            for access, filename in candidates:
+                expired = ttl is not None and now - access > ttl
+                over_quota = max_bytes is not None and total > max_bytes
+                if not (expired or over_quota):
+                    break  # Everything after this was accessed more recently
+                del self._files[filename]
+                total -= sizes[filename]
+                cleanup_file(self.path(filename))
+                removed.append(filename)
+            if removed or self._dirty:
+                self._save()
+        return removed
+    
+    def stats(self) -> Dict[str, int]:
+        derived = self._derived_bytes()
+        with self._lock:
+            return {
+                'files': len(self._files),
+                'references': sum(info['refs'] for info in self._files.values()),
+                'bytes': sum(info['bytes'] for info in self._files.values()),
+                'derived_bytes': sum(derived.values()),
+                'pinned': len(self._pins)
+            }
+    
+    def _derived_bytes(self) -> Dict[str, int]:
+        """Bytes of derived files per upload filename (partial files excluded)."""
+        sizes: Dict[str, int] = {}
+        for folder in self.derived_folders:
+            try:
+                with os.scandir(folder) as entries:
+                    for entry in entries:
+                        if entry.name.endswith('.part'):
+                            continue
+                        try:
+                            nbytes = entry.stat().st_size
+                        except OSError:
+                            continue  # Deleted while listing
+                        filename = entry.name.rsplit('.', 1)[0]
+                        sizes[filename] = sizes.get(filename, 0) + nbytes
+            except FileNotFoundError:
+                pass
+        return sizes
+    
+    def _sync_with_folder(self) -> None:
+        """One startup scan: adopt unknown files, forget missing ones, drop stale partials."""
+        now = time.time()
+        present = set()
+        changed = False
+        with os.scandir(self.folder) as entries:
+            for entry in entries:
+                if not entry.is_file() or entry.name.startswith('.'):
+                    continue
+                stat = entry.stat()
+                if entry.name.endswith('.part'):
+                    if now - stat.st_mtime > STALE_PARTIAL_SECONDS:
+                        cleanup_file(entry.path)
+                    continue
+                present.add(entry.name)
+                if entry.name not in self._files:
+                    self._files[entry.name] = {'refs': 1, 'bytes': stat.st_size, 'access': stat.st_mtime}
+                    changed = True
+        
+        for filename in set(self._files) - present:
+            del self._files[filename]
+            changed = True
+        
+        # Derived files of uploads that are gone, and stale partials
+        for folder in self.derived_folders:
+            if not os.path.isdir(folder):
+                continue
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if entry.name.endswith('.part'):
+                        if now - entry.stat().st_mtime > STALE_PARTIAL_SECONDS:
+                            cleanup_file(entry.path)
+                    elif entry.name.rsplit('.', 1)[0] not in present:
+                        cleanup_file(entry.path)
+        # Only write when the index was out of date, so processes that merely
+        # import the app (spawned pool workers) leave it alone
+        if changed:
+            with self._lock:
+                self._save()
+    
+    def _save(self) -> None:
+        # Write-then-rename so a crash never leaves a truncated index (lock
+        # held); the partial name is unique per process and thread, so stores
+        # in other processes never rename each other's file away
+        partial_path = f'{self._index_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            with open(partial_path, 'w') as f:
+                json.dump({'files': self._files}, f)
+            os.replace(partial_path, self._index_path)
+        finally:
+            cleanup_file(partial_path)
+        self._dirty = False
+
+
+def _token_hash(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
@@ -3,14 +3,36 @@ Utility functions for image processing and file management.
 """
 
 from PIL import Image
+import hashlib
+import io
 import os
-from typing import Tuple, Optional
+from typing import Any, Callable, Dict, Iterable, Iterator, Tuple, Optional
 import uuid
+import warnings
+import zipfile
 
 
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
+ALLOWED_FORMATS = {'PNG', 'JPEG'}
+
+# Extension uploads are stored under, by detected format
+FORMAT_EXTENSIONS = {'PNG': 'png', 'JPEG': 'jpg'}
+
+# Hex digits of the content hash used in upload filenames
+UPLOAD_ID_LENGTH = 32
 MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
 
+# Largest accepted image in pixels (decompression bomb guard); also applied to
+# Pillow's own check so processing never decodes past it
+MAX_IMAGE_PIXELS = int(float(os.environ.get('PXL8_MAX_IMAGE_MP', Image.MAX_IMAGE_PIXELS / 1e6)) * 1e6)
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+
+# Leading bytes of an upload kept in memory to read its header
+UPLOAD_HEADER_BYTES = 64 * 1024
+
+# Already-compressed formats are stored in ZIP archives without deflate
+STORED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'webp', 'gif'}
+
 
 def allowed_file(filename: str) -> bool:
     """Check if file extension is allowed."""
@@ -18,61 +40,139 @@ def allowed_file(filename: str) -> bool:
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
-def validate_image(file) -> Tuple[bool, Optional[str]]:
+def ingest_upload(
+    file,
+    upload_folder: str,
+    chunk_size: int = 256 * 1024,
+    place: Optional[Callable[[str, str], bool]] = None
+) -> Dict[str, Any]:
     """
-    Validate uploaded image file.
+    Validate and store an upload in a single pass, named by its content.
+    
+    The request stream is copied to disk once while it is hashed and sized;
+    format and dimensions come from the header in the first bytes, so the
+    image is never reopened or decoded. Sizes past MAX_IMAGE_PIXELS are
+    rejected from the header alone.
+    
+    The stored filename is the content hash plus the extension of the
+    detected format, so identical bytes always map to the same file; when
+    that file already exists the new copy is discarded.
+    
+    Args:
+        file: File object from Flask request
+        upload_folder: Directory to save file
+        chunk_size: Bytes copied per read
+        place: Moves the received file into place, as place_upload does
+            (the default); storage layers wrap it to update their
+            bookkeeping atomically with the move
     
     Returns:
-        (is_valid, error_message)
-    """
-    if not file:
-        return False, "No file provided"
+        Dict with 'filename', 'width', 'height', 'format', 'mode', 'bytes',
+        'sha256' (hex digest of the stored file) and 'duplicate' (True when
+        the content was already stored)
     
+    Raises:
+        ValueError: If the upload is not an acceptable image
+    """
+    if not file or not file.filename:
+        raise ValueError("No file provided")
     if not allowed_file(file.filename):
-        return False, "File type not allowed. Please upload JPG or PNG files."
+        raise ValueError("File type not allowed. Please upload JPG or PNG files.")
     
-    # Check file size
-    file.seek(0, os.SEEK_END)
-    file_size = file.tell()
-    file.seek(0)  # Reset file pointer
-    
-    if file_size > MAX_FILE_SIZE:
-        return False, f"File too large. Maximum size is {MAX_FILE_SIZE / (1024*1024):.0f}MB"
+    os.makedirs(upload_folder, exist_ok=True)
+    partial_path = os.path.join(upload_folder, f"{uuid.uuid4().hex}.part")
     
-    # Try to open as image to validate
+    digest = hashlib.sha256()
+    head = bytearray()
+    size = 0
     try:
-        img = Image.open(file)
-        img.verify()  # Verify it's a valid image
-        file.seek(0)  # Reset after verify
-    except Exception as e:
-        return False, f"Invalid image file: {str(e)}"
+        with open(partial_path, 'wb') as out:
+            for chunk in iter(lambda: file.stream.read(chunk_size), b''):
+                size += len(chunk)
+                if size > MAX_FILE_SIZE:
+                    raise ValueError(f"File too large. Maximum size is {MAX_FILE_SIZE / (1024*1024):.0f}MB")
+                if len(head) < UPLOAD_HEADER_BYTES:
+                    head += chunk[:UPLOAD_HEADER_BYTES - len(head)]
+                digest.update(chunk)
+                out.write(chunk)
+        
+        info = _read_header(bytes(head), partial_path)
+        
+        sha256 = digest.hexdigest()
+        filename = f"{sha256[:UPLOAD_ID_LENGTH]}.{FORMAT_EXTENSIONS[info['format']]}"
+        duplicate = (place or place_upload)(partial_path, os.path.join(upload_folder, filename))
+    except BaseException:
+        cleanup_file(partial_path)
+        raise
     
-    return True, None
+    return {'filename': filename, **info, 'bytes': size, 'sha256': sha256, 'duplicate': duplicate}
 
 
-def save_uploaded_file(file, upload_folder: str) -> str:
+def place_upload(partial_path: str, filepath: str) -> bool:
     """
-    Save uploaded file and return filename.
+    Move a received upload to its content-addressed path.
     
-    Args:
-        file: File object from Flask request
-        upload_folder: Directory to save file
-    
-    Returns:
-        Saved filename
+    Returns True (and discards the new copy) when identical content is
+    already stored there.
     """
-    # Create upload folder if it doesn't exist
-    os.makedirs(upload_folder, exist_ok=True)
+    if os.path.exists(filepath):
+        os.remove(partial_path)
+        return True
+    os.replace(partial_path, filepath)
+    return False
+
+
+def _read_header(head: bytes, filepath: str) -> Dict[str, Any]:
+    """
+    Format, mode and size of an image from its leading bytes.
     
-    # Generate unique filename
-    ext = file.filename.rsplit('.', 1)[1].lower()
-    filename = f"{uuid.uuid4().hex}.{ext}"
-    filepath = os.path.join(upload_folder, filename)
+    Headers that do not fit in head (large EXIF or ICC blocks) are read
+    lazily from filepath instead. Raises ValueError for unreadable or
+    unsupported images and for sizes past MAX_IMAGE_PIXELS.
+    """
+    too_large = f"Image too large. Maximum size is {MAX_IMAGE_PIXELS / 1e6:.0f} megapixels"
+    info = None
+    for source in (io.BytesIO(head), filepath):
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', Image.DecompressionBombWarning)
+                with Image.open(source) as image:
+                    info = {'format': image.format, 'mode': image.mode, 'width': image.width, 'height': image.height}
+            break
+        except Image.DecompressionBombError:
+            raise ValueError(too_large)
+        except Exception:
+            continue
     
-    # Save file
-    file.save(filepath)
+    if info is None:
+        raise ValueError("Invalid image file: unrecognized or corrupt image data")
+    if info['width'] * info['height'] > MAX_IMAGE_PIXELS:
+        raise ValueError(too_large)
+    if info['format'] not in ALLOWED_FORMATS:
+        raise ValueError("File type not allowed. Please upload JPG or PNG files.")
+    return info
+
+
+def working_mode(image: Image.Image) -> str:
+    """
+    Mode an image is processed in: L, RGB or RGBA.
     
-    return filename
+    1-bit images become L; palette, CMYK and other modes become RGBA when
+    they carry transparency and RGB otherwise.
+    """
+    if image.mode in ('L', 'RGB', 'RGBA'):
+        return image.mode
+    if image.mode == '1':
+        return 'L'
+    has_alpha = 'A' in image.getbands() or 'transparency' in image.info
+    return 'RGBA' if has_alpha else 'RGB'
+
+
+def array_mode(pixels) -> str:
+    """Mode of a decoded pixel array: L for 2 dimensions, else RGB or RGBA by channel count."""
+    if pixels.ndim == 2:
+        return 'L'
+    return {3: 'RGB', 4: 'RGBA'}[pixels.shape[2]]
 
 
 def get_image_dimensions(image_path: str) -> Tuple[int, int]:
@@ -81,6 +181,15 @@ def get_image_dimensions(image_path: str) -> Tuple[int, int]:
         return img.size
 
 
+def hash_file(filepath: str, chunk_size: int = 1024 * 1024) -> str:
+    """Return the SHA-256 hex digest of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
 def cleanup_file(filepath: str) -> None:
     """Delete a file if it exists."""
     try:
@@ -89,3 +198,72 @@ def cleanup_file(filepath: str) -> None:
     except Exception:
         pass  # Ignore cleanup errors
 
+
+class _ZipSink(io.RawIOBase):
+    """
+    Write-only, unseekable sink for zipfile that hands out data as it arrives.
+    
+    zipfile falls back to data descriptors when the output can't seek, so
+    the archive can be sent while it is being built.
+    """
+    
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+        self._position = 0
+    
+    def writable(self) -> bool:
+        return True
+    
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+    
+    def tell(self) -> int:
+        return self._position
+    
+    def drain(self) -> bytes:
+        """Return and forget everything written since the last drain."""
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def stream_zip(files: Iterable[Tuple[str, str]], chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+    """
+    Build a ZIP archive on the fly and yield it in chunks.
+    
+    Only one chunk of one file is held in memory at a time. Files with an
+    extension in STORED_EXTENSIONS are stored as-is; others are deflated.
+    
+    Args:
+        files: (filepath, name in archive) pairs
+        chunk_size: Bytes read from each file per step
+    
+    Yields:
+        Consecutive pieces of the archive
+    """
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, 'w', allowZip64=True) as archive:
+        for filepath, arcname in files:
+            info = zipfile.ZipInfo.from_file(filepath, arcname)
+            ext = arcname.rsplit('.', 1)[-1].lower()
+            info.compress_type = zipfile.ZIP_STORED if ext in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+            
+            with open(filepath, 'rb') as src, \
+                    archive.open(info, 'w', force_zip64=info.file_size >= zipfile.ZIP64_LIMIT) as dst:
+                for chunk in iter(lambda: src.read(chunk_size), b''):
+                    dst.write(chunk)
+                    data = sink.drain()
+                    if data:
+                        yield data
+            
+            data = sink.drain()
+            if data:
+                yield data
+    
+    # Central directory
+    data = sink.drain()
+    if data:
+        yield data
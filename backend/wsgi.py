@@ -0,0 +1,10 @@
+"""
+WSGI entry point for production servers.
+
+Run from the backend directory:
+    gunicorn -c gunicorn.conf.py wsgi:app
+"""
+
+from app import app
+
+application = app